@@ -1,4 +1,32 @@
-from django.contrib import admin
+"""
+Адмінка для великих таблиць.
+
+Стандартний ModelAdmin на мільйонах рядків непридатний: COUNT(*) на кожну
+сторінку, OFFSET для далеких сторінок, випадаючі списки з усіма
+користувачами/активностями в формах і __str__ з запитом на кожен рядок.
+Тут:
+  - EstimatedCountPaginator: на PostgreSQL кількість береться з оцінки
+    планувальника (EXPLAIN), точний COUNT - лише для малих вибірок;
+  - KeysetChangeList: сторінки за первинним ключем (WHERE id < ? ORDER BY id DESC),
+    перехід на наступну сторінку не дорожчий за першу;
+  - raw_id_fields замість випадаючих списків і list_select_related для колонок;
+  - масові дії пакетами через репозиторії (лічильники, outbox і похідні дані
+    лишаються узгодженими) після сторінки підтвердження, що не збирає каскад;
+    активності й користувачі видаляються у фоні (deletion.py).
+"""
+import json
+from typing import Iterator, List, Optional
+
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.admin.utils import model_ngettext
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+
 from .models import (
     Activity,
     Profile,
@@ -6,14 +34,296 @@ from .models import (
     Kudos,
     Follower,
     ActivityPoint,
-    UserMonthlyStats
+    UserMonthlyStats,
+    Challenge,
+    ChallengeParticipant
 )
+from .repositories import DataAccessLayer
+
+# Точний COUNT(*) робиться, лише якщо оцінка менша за це число
+EXACT_COUNT_BELOW = 10000
+# Рядків на транзакцію в масових діях
+ACTION_BATCH_SIZE = 500
+# Параметр запиту з курсором keyset-сторінки
+CURSOR_VAR = 'after'
+# Скільки рядків вибірки перелічує сторінка підтвердження видалення
+CONFIRM_LIST_LIMIT = 100
+
+
+# --- Кількість рядків ---
+
+def estimated_count(queryset) -> Optional[int]:
+    """Оцінка кількості рядків queryset з плану PostgreSQL (None - на інших СУБД)."""
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def approximate_count(queryset) -> int:
+    """Точний COUNT(*) для малих вибірок, понад EXACT_COUNT_BELOW - оцінка планувальника."""
+    estimate = estimated_count(queryset)
+    if estimate is None or estimate < EXACT_COUNT_BELOW:
+        return queryset.count()
+    return estimate
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator без COUNT(*) по великій таблиці: понад EXACT_COUNT_BELOW - оцінка планувальника."""
+
+    @cached_property
+    def count(self):
+        return approximate_count(self.object_list)
+
+
+# --- Keyset-сторінки ---
+
+class KeysetChangeList(ChangeList):
+    """Changelist, що гортається курсором ?after=<pk> (новіші першими) замість номера сторінки."""
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_ordering(self, request, queryset):
+        return ['-pk']
+
+    def get_results(self, request):
+        try:
+            after = int(request.GET.get(CURSOR_VAR, ''))
+        except ValueError:
+            after = None
+        # Фільтри вже застосовані - курсор не переноситься в їхні посилання
+        self.params.pop(CURSOR_VAR, None)
+        self.filter_params.pop(CURSOR_VAR, None)
+
+        queryset = self.queryset if after is None else self.queryset.filter(pk__lt=after)
+        rows = list(queryset[:self.list_per_page + 1])
+        self.result_list = rows[:self.list_per_page]
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = after is not None or len(rows) > self.list_per_page
+        self.next_url = (
+            self.get_query_string({CURSOR_VAR: self.result_list[-1].pk}) if len(rows) > self.list_per_page else None
+        )
+        self.first_url = self.get_query_string(remove=[CURSOR_VAR]) if after is not None else None
+
+
+def pk_batches(queryset, size: int = ACTION_BATCH_SIZE) -> Iterator[List[int]]:
+    """Первинні ключі вибірки пакетами за зростанням pk (без OFFSET; рядки можна видаляти по ходу)."""
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        batch = list((pks if last is None else pks.filter(pk__gt=last))[:size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    База для великих таблиць: оцінена кількість, keyset-сторінки, без повного
+    COUNT для "усього рядків" і без сортування за колонками (лише за pk).
+    Видалення йде через delete_batch() пакетами, без збору каскаду в Python.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    sortable_by = ()
+    list_per_page = 100
+    change_list_template = 'admin/keyset_change_list.html'
+    delete_in_batches_confirmation_template = 'admin/delete_in_batches_confirmation.html'
+    actions = ['delete_in_batches']
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # Стандартна дія збирає весь каскад у пам'ять - замінена на delete_in_batches
+        actions.pop('delete_selected', None)
+        return actions
+
+    def delete_batch(self, pks: List[int]) -> int:
+        """
+        Видаляє пакет рядків і повертає їх кількість. Типово - звичайний DELETE
+        у транзакції (каскад збирає Django); таблиці з лічильниками, outbox чи
+        похідними даними перевизначають його викликом свого репозиторію.
+        """
+        with transaction.atomic():
+            _, deleted = self.model.objects.filter(pk__in=pks).delete()
+        return deleted.get(self.opts.label, 0)
+
+    def delete_model(self, request, obj):
+        self.delete_batch([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        for batch in pk_batches(queryset):
+            self.delete_batch(batch)
+
+    def get_deleted_objects(self, objs, request):
+        # Сторінка підтвердження не перелічує дочірні рядки (точки треку тощо)
+        # і показує лише перші CONFIRM_LIST_LIMIT рядків вибірки
+        if isinstance(objs, QuerySet):
+            shown, count = list(objs[:CONFIRM_LIST_LIMIT]), approximate_count(objs)
+        else:
+            shown = list(objs)
+            count = len(shown)
+        listed = [str(obj) for obj in shown]
+        if count > len(shown):
+            listed.append(f"... and about {count - len(shown)} more")
+        return listed, {self.opts.verbose_name_plural: count}, set(), []
+
+    @admin.action(description="Delete selected in batches", permissions=['delete'])
+    def delete_in_batches(self, request, queryset):
+        # Перший POST - сторінка підтвердження, другий (post=yes) - видалення
+        if not request.POST.get('post'):
+            return self.delete_in_batches_confirmation(request, queryset)
+        deleted = 0
+        for batch in pk_batches(queryset):
+            deleted += self.delete_batch(batch)
+        self.message_user(request, f"{deleted} row(s) deleted.", messages.SUCCESS)
+
+    def delete_in_batches_confirmation(self, request, queryset):
+        """
+        Як delete_selected, але без збору каскаду. Форма повторює відмічені
+        рядки (Django обробляє підтвердження лише з ними) і прапорець "вибрати
+        все": тоді дія бере всю відфільтровану вибірку, а не список pk.
+        """
+        deletable_objects, model_count, _, _ = self.get_deleted_objects(queryset, request)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': "Delete multiple objects",
+            'subtitle': None,
+            'objects_name': str(model_ngettext(queryset)),
+            'deletable_objects': [deletable_objects],
+            'model_count': dict(model_count).items(),
+            'select_across': request.POST.get('select_across') == '1',
+            'selected_pks': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'opts': self.opts,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            'media': self.media,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, self.delete_in_batches_confirmation_template, context)
+
+
+# --- Моделі ---
+
+@admin.register(Activity)
+class ActivityAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'activity_type', 'start_time', 'distance_m', 'duration_sec', 'kudos_count', 'deleted_at')
+    list_select_related = ('user',)
+    # Обидва фільтри йдуть по індексах (activity_type, start_time) і (start_time)
+    list_filter = ('activity_type', ('start_time', admin.DateFieldListFilter))
+    raw_id_fields = ('user',)
+    # deleted_at лише для читання: м'яке видалення йде тільки через delete_batch (schedule_delete)
+    readonly_fields = ('kudos_count', 'fingerprint', 'idempotency_key', 'start_lat', 'start_lon',
+                       'min_lat', 'min_lon', 'max_lat', 'max_lon', 'start_geohash', 'updated_at', 'deleted_at')
+
+    def delete_batch(self, pks):
+        # М'яке видалення: точки, коментарі й kudos видаляє purge_deletions
+        with transaction.atomic():
+            repo = DataAccessLayer().activities
+            return sum(repo.schedule_delete(pk) is not None for pk in pks)
+
+    def save_model(self, request, obj, form, change):
+        db = DataAccessLayer()
+        if change:
+            db.activities.update(obj.pk, **{name: getattr(obj, name) for name in form.changed_data})
+        else:
+            obj.pk = db.activities.add(**{name: form.cleaned_data[name] for name in form.cleaned_data}).pk
+
+
+@admin.register(ActivityPoint)
+class ActivityPointAdmin(LargeTableAdmin):
+    # activity_id замість activity: без JOIN і без Activity.__str__ на кожен рядок
+    list_display = ('id', 'activity_id', 'recorded_at', 'lat', 'lon', 'ele', 'speed', 'cadence')
+    raw_id_fields = ('activity',)
+
+    def delete_batch(self, pks):
+        return DataAccessLayer().activity_points.delete_many(pks)
+
+
+@admin.register(Comment)
+class CommentAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'activity_id', 'parent_comment_id', 'created_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('activity', 'user', 'parent_comment')
+
+    def delete_batch(self, pks):
+        with transaction.atomic():
+            repo = DataAccessLayer().comments
+            return sum(repo.delete(id=pk) for pk in pks)
+
+
+@admin.register(Kudos)
+class KudosAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'activity_id', 'created_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('activity', 'user')
+
+    def delete_batch(self, pks):
+        # Через take_back: Activity.kudos_count лишається узгодженим
+        with transaction.atomic():
+            repo = DataAccessLayer().kudos
+            return sum(repo.delete(id=pk) for pk in pks)
+
+
+@admin.register(ChallengeParticipant)
+class ChallengeParticipantAdmin(LargeTableAdmin):
+    list_display = ('id', 'challenge_id', 'user', 'progress', 'activity_count', 'completed_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('challenge', 'user')
+    readonly_fields = ('progress', 'activity_count', 'completed_at')
+
+    def delete_batch(self, pks):
+        db = DataAccessLayer()
+        with transaction.atomic():
+            entries = ChallengeParticipant.objects.filter(pk__in=pks).values_list('challenge_id', 'user_id')
+            return sum(db.challenges.leave(challenge_id, user_id) for challenge_id, user_id in entries)
+
+
+@admin.register(Profile)
+class ProfileAdmin(admin.ModelAdmin):
+    list_display = ('user', 'display_name', 'city', 'country', 'updated_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('user__username', 'display_name')
+
+
+@admin.register(Follower)
+class FollowerAdmin(admin.ModelAdmin):
+    list_display = ('id', 'follower', 'followee', 'created_at')
+    list_select_related = ('follower', 'followee')
+    raw_id_fields = ('follower', 'followee')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(UserMonthlyStats)
+class UserMonthlyStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'year', 'month', 'total_distance_m', 'total_duration_sec')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    list_filter = ('year',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
-# Реєструємо всі ваші моделі, щоб ви бачили їх в /admin/
-admin.site.register(Activity)
-admin.site.register(Profile)
-admin.site.register(Comment)
-admin.site.register(Kudos)
-admin.site.register(Follower)
-admin.site.register(ActivityPoint)
-admin.site.register(UserMonthlyStats)
\ No newline at end of file
+@admin.register(Challenge)
+class ChallengeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'title', 'activity_type', 'metric', 'goal', 'starts_at', 'ends_at',
+                    'participant_count', 'completed_count')
+    raw_id_fields = ('created_by',)
+    readonly_fields = ('participant_count', 'completed_count', 'total_progress')
@@ -0,0 +1,176 @@
+"""
+Автентифікація за токеном з кешем ідентичності в пам'яті процесу.
+
+TokenAuthentication робить на кожен запит запит токена з користувачем, а
+в'юхи потім окремо читають Profile. CachedTokenAuthentication тримає
+token -> (користувач, профіль) у кеші процесу на IDENTITY_CACHE_TTL_SEC:
+у типовому випадку ідентичність не коштує жодного запиту до БД.
+
+Кеш скидається явно: вихід (видалення токена), зміна пароля чи інших полів
+користувача, деактивація, створення/зміна/видалення профілю - репозиторії
+викликають invalidate_user() після коміту транзакції. Кеш процесу не бачить
+інвалідацій з інших воркерів, тому кожен запис пам'ятає покоління
+користувача, з яким його заповнено, а invalidate_user() ще й підвищує це
+покоління в кеші Django (спільному для воркерів у продакшені). Влучання
+перевіряє покоління одним читанням з кешу Django: вихід чи деактивація
+діють в усіх процесах одразу, а не через TTL. Лишається вузьке вікно:
+інвалідація, закомічена між читанням токена з БД і читанням покоління при
+промаху, живе в цьому процесі не довше за TTL.
+
+Профіль з кешу видно лише самому користувачеві (request.user.profile);
+профілі інших користувачів репозиторій читає з БД.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import Profile
+
+# Профіль користувача не існує (кешується так само, як і знайдений)
+NO_PROFILE = object()
+
+
+def cache_ttl() -> float:
+    return getattr(settings, 'IDENTITY_CACHE_TTL_SEC', 30)
+
+
+def cache_size() -> int:
+    return getattr(settings, 'IDENTITY_CACHE_MAX_ENTRIES', 10000)
+
+
+# --- Спільне покоління користувача ---
+
+def generation_key(user_id: int) -> str:
+    return f"identity.generation.{user_id}"
+
+
+def current_generation(user_id: int) -> int:
+    return cache.get(generation_key(user_id), 0)
+
+
+def bump_generation(user_id: int):
+    key = generation_key(user_id)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключ витіснили між add і incr
+        cache.set(key, 1, timeout=None)
+
+
+# --- Кеш процесу ---
+
+class IdentityCache:
+    """token key -> (термін дії, Token з користувачем, Profile або NO_PROFILE, покоління); LRU з TTL."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+        # Інший воркер міг інвалідувати користувача - запис тоді застарів
+        if current_generation(entry[1].user_id) != entry[3]:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._drop(key)
+            return None
+        return entry[1], entry[2]
+
+    def put(self, key: str, token: Token, profile, generation: int):
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + cache_ttl(), token, profile, generation)
+            self._keys_by_user.setdefault(token.user_id, set()).add(key)
+            while len(self._entries) > cache_size():
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_token(self, key: str):
+        with self._lock:
+            self._drop(key)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[1].user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[1].user_id]
+
+
+identity_cache = IdentityCache()
+
+
+def invalidate_user(user_id: int):
+    # id з URL приходить рядком
+    identity_cache.invalidate_user(int(user_id))
+    bump_generation(int(user_id))
+
+
+def invalidate_token(key: str):
+    identity_cache.invalidate_token(key)
+
+
+def attach_profile(user: User, profile):
+    """request.user.profile без запиту до БД (None - звернення кине Profile.DoesNotExist)."""
+    User.profile.related.set_cached_value(user, None if profile is NO_PROFILE else profile)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Заміна TokenAuthentication: токен, користувач і профіль читаються одним
+    запитом при промаху і далі віддаються з кешу процесу (копії - запити не
+    ділять екземпляри моделей).
+    """
+
+    def authenticate_credentials(self, key) -> Tuple[User, Token]:
+        cached = identity_cache.get(key)
+        if cached is None:
+            token = Token.objects.select_related('user', 'user__profile').filter(key=key).first()
+            if token is None:
+                raise AuthenticationFailed(_('Invalid token.'))
+            try:
+                profile = token.user.profile
+            except Profile.DoesNotExist:
+                profile = NO_PROFILE
+            identity_cache.put(key, token, profile, current_generation(token.user_id))
+        else:
+            token, profile = cached
+
+        token, user = copy.copy(token), copy.copy(token.user)
+        token.user = user
+        attach_profile(user, copy.copy(profile) if profile is not NO_PROFILE else profile)
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, token
+
@@ -0,0 +1,376 @@
+"""
+Фреймворк перерахунку (backfill) похідних даних по мільйонах рядків.
+
+Кожен backfill - підклас Backfill, зареєстрований декоратором @register:
+він знає свою модель і вміє обробити діапазон первинних ключів
+[start_id, end_id) кількома пакетними запитами. run() фіксує діапазон id,
+ділить його на чанки (BackfillChunk - чекпоінти) і виконує їх у пулі процесів,
+кожен зі своїм з'єднанням з БД. Перерваний запуск продовжується з
+незавершених чанків. Перед видачею нового чанка перевіряється навантаження
+БД (PostgreSQL: активні запити в pg_stat_activity), а після кожного чанка
+виводиться пропускна здатність і ETA.
+
+Рядки, створені після старту, backfill не бачить - їх уже підтримують
+інкрементальні шляхи запису в репозиторіях. Похідні дані пишуться напряму,
+без подій outbox (це не зміни, зроблені користувачами).
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from . import challenges, estimation, records, routes, spatial, versions
+from .dedup import compute_fingerprint
+from .models import Activity, ActivityPoint, BackfillChunk, BackfillRun, Challenge, Kudos, UserMonthlyStats
+
+REGISTRY: Dict[str, type] = {}
+
+
+def register(cls):
+    REGISTRY[cls.name] = cls
+    return cls
+
+
+def get_backfill(name: str) -> 'Backfill':
+    try:
+        return REGISTRY[name]()
+    except KeyError:
+        raise ValueError(f"Unknown backfill '{name}'. Available: {', '.join(sorted(REGISTRY))}")
+
+
+class Backfill:
+    """Контракт backfill-а: модель, типовий розмір чанка і обробка діапазону id."""
+    name = None
+    model = Activity
+    chunk_size = 5000
+    description = ''
+
+    def id_bounds(self) -> Tuple[int, int]:
+        bounds = self.model.objects.aggregate(low=Min('id'), high=Max('id'))
+        return bounds['low'] or 0, bounds['high'] or 0
+
+    def process_range(self, start_id: int, end_id: int) -> int:
+        """Обробляє рядки з id у [start_id, end_id). Повертає кількість оброблених рядків."""
+        raise NotImplementedError
+
+
+# --- Зареєстровані перерахунки ---
+
+@register
+class MonthlyStatsBackfill(Backfill):
+    name = 'monthly_stats'
+    description = "Recompute UserMonthlyStats totals from activities."
+
+    def process_range(self, start_id, end_id):
+        live = Activity.objects.filter(deleted_at__isnull=True, start_time__isnull=False)
+        # Місяці, яких торкається чанк, перераховуються повністю - повтор ідемпотентний
+        keys = set(
+            live.filter(id__gte=start_id, id__lt=end_id)
+            .annotate(year=ExtractYear('start_time'), month=ExtractMonth('start_time'))
+            .values_list('user_id', 'year', 'month').distinct()
+        )
+        if not keys:
+            return 0
+        totals = (
+            live.filter(user_id__in={user_id for user_id, _, _ in keys})
+            .annotate(year=ExtractYear('start_time'), month=ExtractMonth('start_time'))
+            .values('user_id', 'year', 'month')
+            .annotate(distance=Sum('distance_m'), duration=Sum('duration_sec'))
+        )
+        rows = [
+            UserMonthlyStats(
+                user_id=t['user_id'], year=t['year'], month=t['month'],
+                total_distance_m=t['distance'] or 0.0, total_duration_sec=int(t['duration'] or 0),
+            )
+            for t in totals if (t['user_id'], t['year'], t['month']) in keys
+        ]
+        UserMonthlyStats.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['user', 'year', 'month'],
+            update_fields=['total_distance_m', 'total_duration_sec'],
+        )
+        return Activity.objects.filter(id__gte=start_id, id__lt=end_id).count()
+
+
+@register
+class KudosCountBackfill(Backfill):
+    name = 'kudos_count'
+    description = "Recompute the denormalised Activity.kudos_count from Kudos rows."
+
+    def process_range(self, start_id, end_id):
+        counts = Kudos.objects.filter(activity_id=OuterRef('id')).order_by() \
+            .values('activity_id').annotate(total=Count('id')).values('total')
+        activities = Activity.objects.filter(id__gte=start_id, id__lt=end_id)
+        # Переписуються лише розбіжні лічильники - версії (ETag) решти рядків не змінюються
+        drifted = activities.annotate(actual=Coalesce(Subquery(counts), 0)).exclude(kudos_count=F('actual'))
+        if drifted.update(kudos_count=Coalesce(Subquery(counts), 0), updated_at=timezone.now()):
+            versions.bump(Activity)
+        return activities.count()
+
+
+@register
+class EstimatesBackfill(Backfill):
+    name = 'estimates'
+    chunk_size = 1000
+    description = "Recompute calorie/MET estimates (estimation.py) in vectorized batches."
+
+    def process_range(self, start_id, end_id):
+        ids = list(
+            Activity.objects.filter(id__gte=start_id, id__lt=end_id, deleted_at__isnull=True)
+            .values_list('id', flat=True)
+        )
+        return estimation.estimate_batch(ids) if ids else 0
+
+
+@register
+class RoutesBackfill(Backfill):
+    name = 'routes'
+    chunk_size = 500
+    description = "Rebuild route fingerprints and same-route groups (routes.py)."
+
+    def process_range(self, start_id, end_id):
+        ids = list(
+            Activity.objects.filter(id__gte=start_id, id__lt=end_id, deleted_at__isnull=True)
+            .values_list('id', flat=True)
+        )
+        return routes.index_activities(ids) if ids else 0
+
+
+@register
+class GeoIndexBackfill(Backfill):
+    name = 'geo_index'
+    chunk_size = 1000
+    description = "Fill activity start points, bounding boxes and geohashes for nearby search (spatial.py)."
+
+    def process_range(self, start_id, end_id):
+        # Лише ще не проіндексовані: треки, які вже прибрала політика зберігання, індекс не втрачають
+        ids = list(
+            Activity.objects.filter(id__gte=start_id, id__lt=end_id, deleted_at__isnull=True,
+                                    start_geohash__isnull=True)
+            .filter(Exists(ActivityPoint.objects.filter(activity_id=OuterRef('id'))))
+            .values_list('id', flat=True)
+        )
+        return spatial.index_activities(ids) if ids else 0
+
+
+@register
+class ChallengesBackfill(Backfill):
+    name = 'challenges'
+    model = Challenge
+    chunk_size = 10
+    description = "Recompute challenge participant progress and totals from activities (challenges.py)."
+
+    def process_range(self, start_id, end_id):
+        count = 0
+        for challenge in Challenge.objects.filter(id__gte=start_id, id__lt=end_id):
+            challenges.recompute(challenge)
+            count += 1
+        return count
+
+
+@register
+class FingerprintsBackfill(Backfill):
+    name = 'fingerprints'
+    chunk_size = 500
+    description = "Recompute duplicate-detection fingerprints (dedup.py) from activity fields and tracks."
+
+    def process_range(self, start_id, end_id):
+        activities = list(
+            Activity.objects.filter(id__gte=start_id, id__lt=end_id, deleted_at__isnull=True)
+            .values('id', 'activity_type', 'start_time', 'duration_sec', 'fingerprint')
+        )
+        tracks = {}
+        for activity_id, lat, lon in ActivityPoint.objects.filter(activity_id__in=[a['id'] for a in activities]) \
+                .order_by('activity_id', 'recorded_at', 'id').values_list('activity_id', 'lat', 'lon'):
+            tracks.setdefault(activity_id, []).append({'lat': lat, 'lon': lon})
+        now, changed = timezone.now(), 0
+        for values in activities:
+            fingerprint = compute_fingerprint(values['activity_type'], values['start_time'], values['duration_sec'],
+                                              tracks.get(values['id']))
+            # Відбиток видно в API - переписуються лише змінені рядки разом з їхньою версією
+            if fingerprint != values['fingerprint']:
+                changed += Activity.objects.filter(id=values['id']).update(fingerprint=fingerprint, updated_at=now)
+        if changed:
+            versions.bump(Activity)
+        return len(activities)
+
+
+@register
+class RecordsBackfill(Backfill):
+    name = 'records'
+    model = User
+    chunk_size = 200
+    description = "Rebuild personal records and training trends per user."
+
+    def process_range(self, start_id, end_id):
+        user_ids = list(User.objects.filter(id__gte=start_id, id__lt=end_id).values_list('id', flat=True))
+        for user_id in user_ids:
+            records.rebuild_user(user_id)
+        return len(user_ids)
+
+
+# --- Навантаження БД ---
+
+class LoadThrottle:
+    """
+    Не видає нові чанки, поки БД зайнята: на PostgreSQL - кількість активних
+    запитів (крім нашого) понад max_active. На інших СУБД перевірки немає.
+    """
+
+    def __init__(self, max_active: Optional[int] = None, pause: float = 1.0, max_pause: float = 30.0):
+        self.max_active = max_active if max_active is not None else getattr(settings, 'BACKFILL_MAX_ACTIVE_QUERIES', 20)
+        self.pause = pause
+        self.max_pause = max_pause
+        self.waited = 0.0
+
+    def active_queries(self) -> int:
+        if connection.vendor != 'postgresql':
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE state = 'active' AND pid <> pg_backend_pid() AND datname = current_database()"
+            )
+            return cursor.fetchone()[0]
+
+    def wait_for_capacity(self, log: Optional[Callable] = None):
+        pause = self.pause
+        while self.max_active and self.active_queries() > self.max_active:
+            if log:
+                log(f"database busy, pausing {pause:.0f}s")
+            time.sleep(pause)
+            self.waited += pause
+            pause = min(pause * 2, self.max_pause)
+
+
+# --- Виконання ---
+
+def init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def run_chunk(name: str, chunk_id: int, in_worker: bool = True) -> Tuple[int, int, float]:
+    """Задача воркера: обробити чанк і записати чекпоінт. Повертає (chunk_id, rows, seconds)."""
+    chunk = BackfillChunk.objects.get(id=chunk_id)
+    started = time.monotonic()
+    try:
+        with transaction.atomic():
+            rows = get_backfill(name).process_range(chunk.start_id, chunk.end_id)
+            seconds = time.monotonic() - started
+            BackfillChunk.objects.filter(id=chunk_id).update(
+                status='done', rows=rows, seconds=seconds, error='', finished_at=timezone.now()
+            )
+    except Exception as exc:
+        BackfillChunk.objects.filter(id=chunk_id).update(status='failed', error=str(exc)[:2000])
+        raise
+    finally:
+        if in_worker:
+            connections.close_all()
+    return chunk_id, rows, seconds
+
+
+def start_or_resume(backfill: Backfill, chunk_size: Optional[int] = None, restart: bool = False) -> BackfillRun:
+    """Незавершений запуск з тим самим ім'ям продовжується, інакше створюється новий."""
+    run = BackfillRun.objects.filter(name=backfill.name).exclude(status='done').order_by('-id').first()
+    if run and not restart:
+        BackfillRun.objects.filter(id=run.id).update(status='running')
+        BackfillChunk.objects.filter(run=run, status='failed').update(status='pending')
+        return run
+    if run:
+        BackfillRun.objects.filter(id=run.id).update(status='failed', finished_at=timezone.now())
+
+    size = chunk_size or backfill.chunk_size
+    low, high = backfill.id_bounds()
+    run = BackfillRun.objects.create(name=backfill.name, min_id=low, max_id=high, chunk_size=size)
+    if high:
+        BackfillChunk.objects.bulk_create(
+            [BackfillChunk(run=run, start_id=start, end_id=min(start + size, high + 1))
+             for start in range(low, high + 1, size)],
+            batch_size=1000,
+        )
+    return run
+
+
+def run(name: str, workers: int = 4, chunk_size: Optional[int] = None, restart: bool = False,
+        throttle: Optional[LoadThrottle] = None, log: Optional[Callable] = None) -> BackfillRun:
+    """
+    Виконує (або продовжує) backfill. workers=0 - усе в поточному процесі
+    (розробка на SQLite, налагодження).
+    """
+    backfill = get_backfill(name)
+    throttle = throttle or LoadThrottle()
+    if workers > 0 and connection.vendor == 'sqlite':
+        # SQLite допускає лише одного записувача - паралельні чанки впиралися б у "database is locked"
+        if log:
+            log("SQLite: running chunks in this process")
+        workers = 0
+    run_obj = start_or_resume(backfill, chunk_size, restart)
+    pending = list(
+        BackfillChunk.objects.filter(run=run_obj, status='pending').order_by('start_id').values_list('id', flat=True)
+    )
+    total_chunks = run_obj.chunks.count()
+    progress = {'chunks': 0, 'rows': 0}
+    started = time.monotonic()
+
+    def report(rows: int):
+        progress['chunks'] += 1
+        progress['rows'] += rows
+        if not log:
+            return
+        elapsed = max(time.monotonic() - started, 1e-9)
+        eta = elapsed / progress['chunks'] * (len(pending) - progress['chunks'])
+        log(f"[{name}] chunk {total_chunks - len(pending) + progress['chunks']}/{total_chunks}: "
+            f"{progress['rows']} rows, {progress['rows'] / elapsed:.0f} rows/s, ETA {eta:.0f}s")
+
+    failed = None
+    if workers <= 0:
+        for chunk_id in pending:
+            throttle.wait_for_capacity(log)
+            try:
+                _, rows, _ = run_chunk(name, chunk_id, in_worker=False)
+            except Exception as exc:
+                failed = exc
+                break
+            report(rows)
+    else:
+        # Дочірні процеси не повинні успадкувати відкрите з'єднання батька
+        connections.close_all()
+        queue = iter(pending)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            in_flight = set()
+            while True:
+                # Не більше двох чанків на воркер у черзі, щоб тротлінг діяв швидко
+                while len(in_flight) < workers * 2 and failed is None:
+                    chunk_id = next(queue, None)
+                    if chunk_id is None:
+                        break
+                    throttle.wait_for_capacity(log)
+                    in_flight.add(pool.submit(run_chunk, name, chunk_id))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        _, rows, _ = future.result()
+                    except Exception as exc:
+                        failed = failed or exc
+                        continue
+                    report(rows)
+
+    processed = run_obj.chunks.filter(status='done').aggregate(rows=Sum('rows'))['rows'] or 0
+    status = 'failed' if failed or run_obj.chunks.exclude(status='done').exists() else 'done'
+    BackfillRun.objects.filter(id=run_obj.id).update(
+        status=status, rows_processed=processed, finished_at=timezone.now()
+    )
+    run_obj.refresh_from_db()
+    if failed:
+        raise failed
+    return run_obj
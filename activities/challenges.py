@@ -0,0 +1,275 @@
+"""
+Челенджі: прогрес учасників, таблиця лідерів і історичні знімки.
+
+Прогрес не рахується на запит. ActivityRepository.on_change викликає
+apply_activity_change(old, new): для участей автора, у вікно яких потрапляє
+активність до або після запису, прогрес змінюється на різницю внесків
+(кілька UPDATE ... SET progress = progress + delta) разом з відміткою про
+виконання мети. Запис активності оновлює лише рядки учасників: підсумки
+челенджу (total_progress, completed_count) - один рядок на всіх учасників,
+тож їх агрегує refresh_totals() у snapshot_challenges, а не кожен запис.
+Приєднання до челенджу, що вже йде, одним агрегатом зараховує активності,
+завантажені раніше.
+
+Таблиця лідерів - впорядкований скан індексу (challenge, -progress, id):
+сторінка з курсором (progress, id, місце) коштує стільки ж при сотні і при
+десятках тисяч учасників. Місце користувача ("me") береться з останнього
+знімка по індексу (snapshot, user); точне місце зараз - лічба учасників
+попереду, лише на явний запит. snapshot_challenges зберігає знімки таблиць
+(ROW_NUMBER() одним INSERT ... SELECT), а recompute() - точний перерахунок
+(backfill 'challenges' або зміна умов челенджу).
+"""
+import base64
+import json
+from typing import List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Activity, Challenge, ChallengeParticipant, ChallengeSnapshot, ChallengeStandingEntry
+
+# Поля челенджу, від яких залежить прогрес (їх зміна вимагає перерахунку)
+RULE_FIELDS = ('activity_type', 'metric', 'starts_at', 'ends_at', 'goal')
+
+
+# --- Внесок активності ---
+
+def contribution(challenge: Challenge, values: Optional[dict]) -> Tuple[float, int]:
+    """(значення метрики, 1) для активності, що зараховується в челендж, інакше (0, 0)."""
+    if values is None or values['start_time'] is None:
+        return 0.0, 0
+    if challenge.activity_type and values['activity_type'] != challenge.activity_type:
+        return 0.0, 0
+    if not challenge.starts_at <= values['start_time'] < challenge.ends_at:
+        return 0.0, 0
+    if challenge.metric == 'activities':
+        return 1.0, 1
+    return float(values[challenge.metric] or 0), 1
+
+
+def matching_activities(challenge: Challenge):
+    """Активності, що зараховуються в челендж (для агрегатів при приєднанні і перерахунку)."""
+    queryset = Activity.objects.filter(
+        deleted_at__isnull=True, start_time__gte=challenge.starts_at, start_time__lt=challenge.ends_at
+    )
+    if challenge.activity_type:
+        queryset = queryset.filter(activity_type=challenge.activity_type)
+    return queryset
+
+
+def _metric_total(challenge: Challenge):
+    return Count('id') if challenge.metric == 'activities' else Sum(challenge.metric)
+
+
+def _add_progress(participant_id: int, challenge: Challenge, delta: float, count_delta: int):
+    """Дельта прогресу учасника; мета позначається виконаною (або знову ні). Рядок челенджу не чіпається."""
+    participants = ChallengeParticipant.objects.filter(id=participant_id)
+    participants.update(progress=F('progress') + delta, activity_count=F('activity_count') + count_delta)
+    participants.filter(completed_at__isnull=True, progress__gte=challenge.goal).update(completed_at=timezone.now())
+    participants.filter(completed_at__isnull=False, progress__lt=challenge.goal).update(completed_at=None)
+
+
+def apply_activity_change(old: Optional[dict], new: Optional[dict]):
+    """
+    Інкрементальне оновлення прогресу при записі активності (у транзакції запису).
+    old / new - records.activity_snapshot до і після (None - створення / видалення).
+    """
+    dated = [values for values in (old, new) if values and values['start_time'] is not None]
+    if not dated:
+        return
+    windows = Q()
+    for values in dated:
+        windows |= Q(challenge__starts_at__lte=values['start_time'], challenge__ends_at__gt=values['start_time'])
+    entries = ChallengeParticipant.objects.filter(windows, user_id=dated[0]['user_id']).select_related('challenge')
+    for entry in entries:
+        value_old, count_old = contribution(entry.challenge, old)
+        value_new, count_new = contribution(entry.challenge, new)
+        if value_new != value_old or count_new != count_old:
+            _add_progress(entry.id, entry.challenge, value_new - value_old, count_new - count_old)
+
+
+# --- Участь ---
+
+def join(challenge: Challenge, user_id: int) -> Tuple[ChallengeParticipant, bool]:
+    """
+    Додає учасника (ідемпотентно). Активності, завантажені до приєднання, але
+    в межах вікна челенджу, зараховуються одним агрегатним запитом.
+    """
+    with transaction.atomic():
+        participant, created = ChallengeParticipant.objects.get_or_create(challenge=challenge, user_id=user_id)
+        if not created:
+            return participant, False
+        totals = matching_activities(challenge).filter(user_id=user_id) \
+            .aggregate(value=_metric_total(challenge), count=Count('id'))
+        Challenge.objects.filter(id=challenge.id).update(participant_count=F('participant_count') + 1)
+        if totals['count']:
+            _add_progress(participant.id, challenge, float(totals['value'] or 0), totals['count'])
+        participant.refresh_from_db()
+    return participant, True
+
+
+def leave(challenge_id: int, user_id: int) -> bool:
+    with transaction.atomic():
+        participant = ChallengeParticipant.objects.select_for_update() \
+            .filter(challenge_id=challenge_id, user_id=user_id).first()
+        if participant is None:
+            return False
+        participant.delete()
+        Challenge.objects.filter(id=challenge_id).update(participant_count=F('participant_count') - 1)
+    return True
+
+
+def withdraw_user(user_id: int) -> int:
+    """Виводить користувача з усіх челенджів (видалення акаунта)."""
+    challenge_ids = list(ChallengeParticipant.objects.filter(user_id=user_id).values_list('challenge_id', flat=True))
+    return sum(leave(challenge_id, user_id) for challenge_id in challenge_ids)
+
+
+def recompute(challenge: Challenge) -> int:
+    """Точний перерахунок прогресу всіх учасників і підсумків челенджу (set-based, кілька запитів)."""
+    own = matching_activities(challenge).filter(user_id=OuterRef('user_id')).order_by().values('user_id')
+    with transaction.atomic():
+        participants = ChallengeParticipant.objects.filter(challenge_id=challenge.id)
+        count = participants.update(
+            progress=Coalesce(Subquery(own.annotate(total=_metric_total(challenge)).values('total')), 0.0,
+                              output_field=FloatField()),
+            activity_count=Coalesce(Subquery(own.annotate(total=Count('id')).values('total')), 0),
+        )
+        participants.filter(completed_at__isnull=True, progress__gte=challenge.goal).update(completed_at=timezone.now())
+        participants.filter(completed_at__isnull=False, progress__lt=challenge.goal).update(completed_at=None)
+        Challenge.objects.filter(id=challenge.id).update(participant_count=count)
+        refresh_totals(challenge.id)
+    return count
+
+
+def refresh_totals(challenge_id: int) -> dict:
+    """Підсумки челенджу одним агрегатом по учасниках (snapshot_challenges, recompute)."""
+    totals = ChallengeParticipant.objects.filter(challenge_id=challenge_id).aggregate(
+        total_progress=Coalesce(Sum('progress'), 0.0),
+        completed_count=Count('id', filter=Q(completed_at__isnull=False)),
+    )
+    Challenge.objects.filter(id=challenge_id).update(**totals)
+    return totals
+
+
+# --- Таблиця лідерів ---
+
+def encode_cursor(progress: float, participant_id: int, rank: int) -> str:
+    raw = json.dumps([progress, participant_id, rank]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int, int]:
+    """(прогрес, id учасника, місце) з курсора; ValueError - курсор пошкоджений."""
+    try:
+        progress, participant_id, rank = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(progress), int(participant_id), int(rank)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+
+
+def standings(challenge_id: int, limit: int, after: Optional[Tuple[float, int, int]] = None) \
+        -> Tuple[List[dict], Optional[str]]:
+    """
+    Сторінка поточної таблиці (місце, учасник, прогрес) і курсор наступної.
+    Рівний прогрес - вище той, хто приєднався раніше.
+    """
+    queryset = ChallengeParticipant.objects.filter(challenge_id=challenge_id)
+    rank = 0
+    if after is not None:
+        progress, participant_id, rank = after
+        # progress <= ... задає початок діапазону індексу, решта - фільтр рівних
+        queryset = queryset.filter(Q(progress__lt=progress) | Q(progress=progress, id__gt=participant_id),
+                                   progress__lte=progress)
+    rows = list(
+        queryset.order_by('-progress', 'id')
+        .values('id', 'user_id', 'user__username', 'progress', 'activity_count', 'completed_at')[:limit + 1]
+    )
+    results = [
+        {'rank': rank + position, 'user': row['user_id'], 'username': row['user__username'],
+         'progress': round(row['progress'], 1), 'activity_count': row['activity_count'],
+         'completed_at': row['completed_at']}
+        for position, row in enumerate(rows[:limit], start=1)
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last['progress'], last['id'], rank + limit)
+    return results, next_cursor
+
+
+def participant_rank(challenge_id: int, user_id: int, live: bool = False) -> Optional[dict]:
+    """
+    Поточний прогрес користувача і його місце: з останнього знімка (ranked_at -
+    час знімка; None - користувача в знімку ще немає) або, якщо live, точне
+    місце зараз - лічба учасників попереду, O(місця).
+    """
+    me = ChallengeParticipant.objects.filter(challenge_id=challenge_id, user_id=user_id) \
+        .values('id', 'progress', 'activity_count', 'completed_at').first()
+    if me is None:
+        return None
+    rank, ranked_at = None, None
+    if live:
+        rank = ChallengeParticipant.objects.filter(challenge_id=challenge_id).filter(
+            Q(progress__gt=me['progress']) | Q(progress=me['progress'], id__lt=me['id'])
+        ).count() + 1
+        ranked_at = timezone.now()
+    else:
+        snapshot = ChallengeSnapshot.objects.filter(challenge_id=challenge_id).order_by('-taken_at') \
+            .values('id', 'taken_at').first()
+        if snapshot is not None:
+            rank = ChallengeStandingEntry.objects.filter(snapshot_id=snapshot['id'], user_id=user_id) \
+                .values_list('rank', flat=True).first()
+            ranked_at = snapshot['taken_at'] if rank is not None else None
+    return {'rank': rank, 'ranked_at': ranked_at, 'progress': round(me['progress'], 1),
+            'activity_count': me['activity_count'], 'completed_at': me['completed_at']}
+
+
+# --- Знімки ---
+
+def take_snapshot(challenge: Challenge, final: bool = False) -> ChallengeSnapshot:
+    """
+    Знімок поточної таблиці: місця нумеруються в БД одним INSERT ... SELECT.
+    Перед знімком оновлюються підсумки челенджу (refresh_totals).
+    """
+    qn = connection.ops.quote_name
+    with transaction.atomic():
+        challenge = Challenge.objects.select_for_update().get(id=challenge.id)
+        for name, value in refresh_totals(challenge.id).items():
+            setattr(challenge, name, value)
+        snapshot = ChallengeSnapshot.objects.create(
+            challenge=challenge, taken_at=timezone.now(), participant_count=challenge.participant_count,
+            total_progress=challenge.total_progress, final=final,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {qn(ChallengeStandingEntry._meta.db_table)} (snapshot_id, {qn('rank')}, user_id, progress) "
+                f"SELECT %s, ROW_NUMBER() OVER (ORDER BY progress DESC, id), user_id, progress "
+                f"FROM {qn(ChallengeParticipant._meta.db_table)} WHERE challenge_id = %s",
+                [snapshot.id, challenge.id]
+            )
+    return snapshot
+
+
+def due_for_snapshot(now=None):
+    """Челенджі, що йдуть зараз, і завершені, для яких ще немає фінального знімка."""
+    now = now or timezone.now()
+    return Challenge.objects.filter(starts_at__lte=now).filter(
+        Q(ends_at__gt=now) | ~Q(snapshots__final=True)
+    ).distinct().order_by('id')
+
+
+def snapshot_standings(snapshot_id: int, limit: int, after_rank: int = 0) -> Tuple[List[dict], Optional[int]]:
+    """Сторінка знімка за місцем (унікальний індекс (snapshot, rank)) і місце для наступної сторінки."""
+    rows = list(
+        ChallengeStandingEntry.objects.filter(snapshot_id=snapshot_id, rank__gt=after_rank).order_by('rank')
+        .values('rank', 'user_id', 'user__username', 'progress')[:limit + 1]
+    )
+    results = [
+        {'rank': row['rank'], 'user': row['user_id'], 'username': row['user__username'],
+         'progress': round(row['progress'], 1)}
+        for row in rows[:limit]
+    ]
+    return results, (rows[limit - 1]['rank'] if len(rows) > limit else None)
@@ -0,0 +1,189 @@
+"""
+WebSocket-споживачі live-трекінгу (Django Channels, див. live.py).
+
+ws/activities/<id>/live/publish/?token=... - телефон власника:
+    -> {"type": "samples", "samples": [{"lat", "lon", "ele", "speed", "cadence", "recorded_at"}, ...]}
+    -> {"type": "finish"}
+    <- {"type": "finished", "activity": {...}}
+ws/activities/<id>/live/?token=... - власник або його фоловер:
+    <- {"type": "samples", "activity": id, "samples": [...]}   (перше - хвіст буфера)
+    <- {"type": "finished", "activity": {...}}
+
+Розсилка йде через групу шару каналів, тож публікатор і глядачі можуть
+бути в різних процесах (у продакшені - channels_redis). Розрив з'єднання
+публікатора без 'finish' фіналізує активність лише через LIVE_IDLE_TIMEOUT_SEC,
+якщо публікатор не перепідключився (live.close_if_idle).
+"""
+import asyncio
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.middleware import BaseMiddleware
+from django.db import DatabaseError
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import live
+from .authentication import CachedTokenAuthentication
+
+CLOSE_FORBIDDEN = 4403
+
+
+@database_sync_to_async
+def user_for_token(key: str):
+    # Той самий кеш ідентичності, що й для HTTP-запитів
+    try:
+        user, _ = CachedTokenAuthentication().authenticate_credentials(key)
+    except AuthenticationFailed:
+        return None
+    return user
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Токен DRF з ?token= у рядку запиту -> scope['user'] (браузерний WebSocket
+    не дозволяє задати заголовок Authorization). Без токена лишається сесія.
+    """
+
+    async def __call__(self, scope, receive, send):
+        key = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+        if key:
+            user = await user_for_token(key)
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
+
+
+async def finish_when_idle(channel_layer, group: str, session: live.LiveSession):
+    """Таймер розірваного з'єднання публікатора (live.close_if_idle)."""
+    await asyncio.sleep(live.idle_timeout())
+    closed, summary = await database_sync_to_async(live.close_if_idle)(session)
+    if closed:
+        await channel_layer.group_send(group, {'type': 'live.finished', 'activity': summary})
+
+
+class LiveActivityConsumer(AsyncJsonWebsocketConsumer):
+    """Спільне: перевірка доступу і підписка на групу активності."""
+
+    async def allowed(self, user) -> bool:
+        raise NotImplementedError
+
+    async def connect(self):
+        self.activity_id = int(self.scope['url_route']['kwargs']['activity_id'])
+        self.group = live.group_name(self.activity_id)
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated or not await self.allowed(user):
+            await self.close(code=CLOSE_FORBIDDEN)
+            return
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+        await self.joined()
+
+    async def joined(self):
+        pass
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    # Обробники повідомлень групи; кожен споживач перевизначає ті, що йому потрібні
+    async def live_samples(self, event):
+        pass
+
+    async def live_sync(self, event):
+        pass
+
+    async def live_finished(self, event):
+        pass
+
+
+class LiveWatchConsumer(LiveActivityConsumer):
+    """Глядач: отримує точки в реальному часі, після підключення - хвіст буфера публікатора."""
+
+    async def allowed(self, user) -> bool:
+        return await database_sync_to_async(live.can_watch)(user.id, self.activity_id)
+
+    async def joined(self):
+        await self.channel_layer.group_send(self.group, {'type': 'live.sync', 'reply_to': self.channel_name})
+
+    async def receive_json(self, content, **kwargs):
+        pass
+
+    async def live_samples(self, event):
+        await self.send_json({'type': 'samples', 'activity': self.activity_id, 'samples': event['samples']})
+
+    async def live_finished(self, event):
+        await self.send_json({'type': 'finished', 'activity': event['activity']})
+
+
+class LiveBeaconConsumer(LiveActivityConsumer):
+    """Публікатор (телефон власника): буферизує точки, розсилає їх і періодично зберігає."""
+
+    async def allowed(self, user) -> bool:
+        return await database_sync_to_async(live.can_publish)(user.id, self.activity_id)
+
+    async def joined(self):
+        self.session = await database_sync_to_async(live.open_session)(self.activity_id)
+        self.finished = False
+        self.flusher = asyncio.ensure_future(self.flush_periodically())
+
+    async def receive_json(self, content, **kwargs):
+        kind = content.get('type') if isinstance(content, dict) else None
+        if kind == 'samples':
+            samples = content.get('samples')
+            accepted = self.session.add(samples if isinstance(samples, list) else [])
+            if accepted:
+                await self.channel_layer.group_send(
+                    self.group, {'type': 'live.samples', 'samples': [live.sample_json(s) for s in accepted]}
+                )
+            if self.session.should_flush():
+                await self.flush()
+        elif kind == 'finish':
+            summary = await self.end_session()
+            await self.send_json({'type': 'finished', 'activity': summary})
+            await self.close()
+        else:
+            await self.send_json({'type': 'error', 'error': "Unknown message type."})
+
+    async def flush(self):
+        batch = self.session.take_pending()
+        try:
+            await database_sync_to_async(live.flush)(self.activity_id, batch)
+        except DatabaseError:
+            self.session.requeue(batch)
+            raise
+        self.session.flushed += len(batch)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(live.flush_interval())
+            if self.session.should_flush():
+                try:
+                    await self.flush()
+                except DatabaseError:
+                    # Точки лишились у черзі - повтор на наступному такті
+                    continue
+
+    async def end_session(self):
+        """Фініш від публікатора: зберігає решту черги і фіналізує агрегати (один раз)."""
+        if self.finished:
+            return None
+        self.finished = True
+        self.flusher.cancel()
+        await self.flush()
+        summary = await database_sync_to_async(live.close_session)(self.session)
+        await self.channel_layer.group_send(self.group, {'type': 'live.finished', 'activity': summary})
+        return summary
+
+    async def disconnect(self, code):
+        if hasattr(self, 'session') and not self.finished:
+            # Розрив - ще не фініш: точки зберігаються, фіналізація - лише якщо публікатор не повернеться
+            self.finished = True
+            self.flusher.cancel()
+            try:
+                await self.flush()
+            finally:
+                asyncio.ensure_future(finish_when_idle(self.channel_layer, self.group, self.session))
+        await super().disconnect(code)
+
+    async def live_sync(self, event):
+        await self.channel_layer.send(event['reply_to'], {'type': 'live.samples', 'samples': self.session.tail()})
@@ -0,0 +1,43 @@
+import hashlib
+from typing import Iterable, Optional
+
+# Скільки точок треку беремо у відбиток (рівномірна вибірка)
+FINGERPRINT_SAMPLE_SIZE = 32
+# Округлення координат (~11 м), щоб шум GPS при повторній відправці не змінював відбиток
+FINGERPRINT_COORD_PRECISION = 4
+
+
+def sample_points(points: list, size: int = FINGERPRINT_SAMPLE_SIZE) -> list:
+    """Рівномірна вибірка не більше `size` точок, включно з першою та останньою."""
+    if len(points) <= size:
+        return list(points)
+    step = (len(points) - 1) / (size - 1)
+    return [points[round(i * step)] for i in range(size)]
+
+
+# Поля активності, від яких залежить відбиток (їх зміна вимагає перерахунку)
+FINGERPRINT_FIELDS = ('activity_type', 'start_time', 'duration_sec')
+
+
+def compute_fingerprint(activity_type, start_time, duration_sec,
+                        points: Optional[Iterable[dict]] = None) -> Optional[str]:
+    """
+    Відбиток активності: вид, час старту, тривалість і хеш вибірки точок треку.
+    Без треку дві ручні активності з однаковим часом, але різного виду - не дублікати.
+    Повертає None, якщо даних замало для надійного порівняння.
+    """
+    points = list(points or [])
+    if start_time is None and not points:
+        return None
+
+    parts = [
+        activity_type or '',
+        start_time.isoformat() if start_time else '',
+        f"{float(duration_sec or 0):.0f}",
+    ]
+    for point in sample_points(points):
+        parts.append(
+            f"{round(float(point['lat']), FINGERPRINT_COORD_PRECISION)},"
+            f"{round(float(point['lon']), FINGERPRINT_COORD_PRECISION)}"
+        )
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
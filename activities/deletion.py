@@ -0,0 +1,201 @@
+"""
+Каскадне видалення без завантаження каскаду в Python.
+
+Репозиторії лише ховають рядок (Activity.deleted_at, User.is_active = False) і
+ставлять DeletionJob. Команда purge_deletions потім видаляє дочірні таблиці
+сирими DELETE ... WHERE id IN (SELECT id ... LIMIT n), кожен пакет у власній
+короткій транзакції (пакет точок треку заодно віднімається від теплових карт),
+і записує прогрес у DeletionJob. Корінь видаляється
+звичайним ORM .delete() уже тоді, коли великих дочірніх наборів не лишилось.
+"""
+from collections import Counter
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import heatmap, versions
+from .models import (
+    Activity, ActivityPoint, Comment, Kudos, Follower, UserMonthlyStats, HeatmapTile, DeletionJob,
+    Notification, ChallengeStandingEntry
+)
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+
+def batch_size() -> int:
+    return getattr(settings, 'DELETION_BATCH_SIZE', 5000)
+
+
+def schedule(target: str, object_id: int, requested_by_id: Optional[int] = None) -> DeletionJob:
+    return DeletionJob.objects.create(target=target, object_id=object_id, requested_by_id=requested_by_id)
+
+
+def pending_ids(target: str):
+    """Підзапит id об'єктів, що чекають на видалення (для фільтрації в репозиторіях)."""
+    return DeletionJob.objects.filter(target=target, status__in=ACTIVE_STATUSES).values('object_id')
+
+
+class Purger:
+    """Виконує одну DeletionJob пакетами, зберігаючи прогрес після кожного пакета."""
+
+    def __init__(self, job: DeletionJob, size: Optional[int] = None, log=None):
+        self.job = job
+        self.size = size or batch_size()
+        self.log = log
+
+    def _progress(self, step: str, deleted: int):
+        self.job.current_step = step
+        self.job.rows_deleted += deleted
+        DeletionJob.objects.filter(id=self.job.id).update(
+            current_step=step, rows_deleted=self.job.rows_deleted
+        )
+        if self.log and deleted:
+            self.log(f"job {self.job.id}: {step} -{deleted} (total {self.job.rows_deleted})")
+
+    def _batches(self, step: str, model, where_sql: str, params: list) -> int:
+        """DELETE пакетами по self.size рядків, поки умова щось знаходить."""
+        table = connection.ops.quote_name(model._meta.db_table)
+        total = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE id IN ("
+                    f"SELECT id FROM {table} WHERE {where_sql} LIMIT %s)",
+                    params + [self.size]
+                )
+                deleted = cursor.rowcount
+            self._progress(step, deleted)
+            total += deleted
+            if deleted < self.size:
+                return total
+
+    def _purge_points(self, where_sql: str, params: list) -> int:
+        """Як _batches для ActivityPoint, але кожен пакет віднімається від теплових карт у своїй транзакції."""
+        table = connection.ops.quote_name(ActivityPoint._meta.db_table)
+        # Спершу на мапу додаються всі закомічені точки: коли активність зникне, їх власника вже не знайти
+        heatmap.update_incremental()
+        total = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE id IN ("
+                    f"SELECT id FROM {table} WHERE {where_sql} LIMIT %s) RETURNING activity_id, lat, lon",
+                    params + [self.size]
+                )
+                rows = cursor.fetchall()
+                heatmap.remove_rows(rows)
+            self._progress('activity_points', len(rows))
+            total += len(rows)
+            if len(rows) < self.size:
+                return total
+
+    def _detach_replies(self, where_sql: str, params: list):
+        """Відповіді на коментарі, що видаляються, втрачають батька (інакше FK не дасть видалити пакет)."""
+        qn = connection.ops.quote_name
+        table = qn(Comment._meta.db_table)
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} SET parent_comment_id = NULL WHERE id IN ("
+                    f"SELECT id FROM {table} WHERE parent_comment_id IN ("
+                    f"SELECT id FROM {table} WHERE {where_sql}) LIMIT %s)",
+                    params + [self.size]
+                )
+                updated = cursor.rowcount
+            if updated < self.size:
+                return
+
+    def _purge_kudos_given(self, user_id: int):
+        """Kudos користувача на чужих активностях, з корекцією Activity.kudos_count."""
+        table = connection.ops.quote_name(Kudos._meta.db_table)
+        while True:
+            with transaction.atomic():
+                batch = list(Kudos.objects.filter(user_id=user_id).values_list('id', 'activity_id')[:self.size])
+                if not batch:
+                    return
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(batch))})",
+                        [kudos_id for kudos_id, _ in batch]
+                    )
+                for activity_id, count in Counter(activity_id for _, activity_id in batch).items():
+                    Activity.objects.filter(id=activity_id).update(
+                        kudos_count=Greatest(F('kudos_count') - count, 0), updated_at=timezone.now()
+                    )
+                versions.bump(Activity)
+            self._progress('kudos_given', len(batch))
+            if len(batch) < self.size:
+                return
+
+    def purge_activity_children(self, activity_where: str, params: list):
+        """Точки, коментарі й kudos активностей, що задані підзапитом id."""
+        subquery = f"SELECT id FROM {connection.ops.quote_name(Activity._meta.db_table)} WHERE {activity_where}"
+        # Видимі списки вже змінились (і версії колекцій підвищено) у schedule_delete
+        self._purge_points(f"activity_id IN ({subquery})", params)
+        self._detach_replies(f"activity_id IN ({subquery})", params)
+        self._batches('comments', Comment, f"activity_id IN ({subquery})", params)
+        self._batches('kudos', Kudos, f"activity_id IN ({subquery})", params)
+
+    def purge_activity(self, activity_id: int):
+        self.purge_activity_children("id = %s", [activity_id])
+        # Дрібні залишки (інші зв'язані таблиці) збирає стандартний колектор
+        count, _ = Activity.objects.filter(id=activity_id).delete()
+        self._progress('activity', count)
+
+    def purge_user(self, user_id: int):
+        # Активності - пакетами id, кожен пакет: діти сирими DELETE, далі самі рядки
+        while True:
+            ids = list(Activity.objects.filter(user_id=user_id).values_list('id', flat=True)[:self.size])
+            if not ids:
+                break
+            placeholders = ', '.join(['%s'] * len(ids))
+            self.purge_activity_children(f"id IN ({placeholders})", ids)
+            count, _ = Activity.objects.filter(id__in=ids).delete()
+            self._progress('activities', count)
+
+        self._detach_replies("user_id = %s", [user_id])
+        self._batches('comments_written', Comment, "user_id = %s", [user_id])
+        self._purge_kudos_given(user_id)
+        self._batches('follows', Follower, "follower_id = %s OR followee_id = %s", [user_id, user_id])
+        self._batches('monthly_stats', UserMonthlyStats, "user_id = %s", [user_id])
+        self._batches('heatmap_tiles', HeatmapTile, "user_id = %s", [user_id])
+        self._batches('notifications', Notification, "recipient_id = %s", [user_id])
+        # Участі в челенджах прибрав UserRepository.schedule_delete; лишились рядки знімків
+        self._batches('challenge_standings', ChallengeStandingEntry, "user_id = %s", [user_id])
+
+        count, _ = User.objects.filter(id=user_id).delete()
+        self._progress('user', count)
+
+    def run(self) -> DeletionJob:
+        job = self.job
+        job.status, job.started_at = 'running', timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+        try:
+            if job.target == 'activity':
+                self.purge_activity(job.object_id)
+            elif job.target == 'user':
+                self.purge_user(job.object_id)
+            else:
+                raise ValueError(f"Unknown deletion target {job.target}")
+        except Exception as exc:
+            DeletionJob.objects.filter(id=job.id).update(status='failed', error=str(exc), finished_at=timezone.now())
+            raise
+        DeletionJob.objects.filter(id=job.id).update(status='done', current_step='', finished_at=timezone.now())
+        job.refresh_from_db()
+        return job
+
+
+def run_pending(max_jobs: Optional[int] = None, size: Optional[int] = None, log=None) -> int:
+    """Виконує чергу DeletionJob у порядку створення. Повертає кількість виконаних задач."""
+    done = 0
+    for job in DeletionJob.objects.filter(status='pending').order_by('id').iterator():
+        Purger(job, size=size, log=log).run()
+        done += 1
+        if max_jobs and done >= max_jobs:
+            break
+    return done
@@ -0,0 +1,244 @@
+"""
+Оцінка калорій, навантаження (MET) та відносної інтенсивності активностей.
+
+Кисневі витрати (VO2, мл/кг/хв) рахуються за рівняннями ACSM для ходьби і
+бігу (швидкість + підйом), для велосипеда - MET з таблиці Compendium за
+швидкістю плюс робота на підйомі, для решти видів - сталий MET. Якщо трек має
+час і координати, розрахунок іде по сегментах треку (паузи відкидаються),
+інакше - за середньою швидкістю і набором висоти активності.
+
+Профіль (вага, зріст, вік, стать) дає:
+  * калорії: VO2 * вага * 5 ккал/л O2;
+  * особистий базовий обмін (Mifflin-St Jeor) - для активних калорій і MET,
+    скоригованого на власний RMR замість стандартних 3.5 мл/кг/хв;
+  * оціночний VO2max за віком і статтю - для відносної інтенсивності.
+
+Усе векторизовано: пакет активностей обробляється кількома операціями numpy
+над конкатенованими сегментами всіх треків пакета.
+"""
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from .geo import haversine_m
+from .models import Activity, ActivityEstimate, ActivityPoint, Profile
+
+ENGINE_VERSION = 1
+
+# Поля, зміна яких робить оцінку застарілою
+ACTIVITY_INPUT_FIELDS = ('activity_type', 'duration_sec', 'distance_m', 'elevation_gain_m')
+PROFILE_INPUT_FIELDS = ('weight_kg', 'height_cm', 'age', 'gender')
+
+# Якщо профілю немає або поле порожнє
+DEFAULT_PROFILE = {'weight_kg': 70.0, 'height_cm': 170.0, 'age': 35, 'gender': 'other'}
+
+# Сталий MET для видів без моделі швидкості (Compendium of Physical Activities)
+CONSTANT_MET = {
+    'swimming': 7.0,
+    'yoga': 2.5,
+    'gym': 5.0,
+    'crossfit': 8.0,
+    'other': 4.0,
+}
+# Велосипед: швидкість, км/год -> MET на рівній дорозі
+CYCLING_SPEED_KMH = np.array([0.0, 16.0, 17.5, 20.5, 23.5, 27.5, 32.0])
+CYCLING_MET = np.array([3.5, 4.0, 6.8, 8.0, 10.0, 12.0, 15.8])
+
+MODEL_WALK, MODEL_RUN, MODEL_CYCLE, MODEL_CONSTANT = 0, 1, 2, 3
+SPEED_MODEL = {'walking': MODEL_WALK, 'hiking': MODEL_WALK, 'running': MODEL_RUN, 'cycling': MODEL_CYCLE}
+
+REST_VO2 = 3.5            # мл/кг/хв = 1 MET
+KCAL_PER_LITRE_O2 = 5.0
+MAX_SEGMENT_GAP_SEC = 300  # довші проміжки між точками - пауза
+MAX_GRADE = 0.3
+
+
+# --- Фізіологія ---
+
+def profile_arrays(profiles: List[dict]) -> Dict[str, np.ndarray]:
+    """Поля профілів з підстановкою типових значень -> масиви."""
+    def column(name):
+        return np.array([p.get(name) if p.get(name) else DEFAULT_PROFILE[name] for p in profiles], dtype=object)
+    return {
+        'weight': column('weight_kg').astype(np.float64),
+        'height': column('height_cm').astype(np.float64),
+        'age': column('age').astype(np.float64),
+        'gender': column('gender'),
+    }
+
+
+def basal_kcal_per_min(weight, height, age, gender) -> np.ndarray:
+    """Mifflin-St Jeor: базовий обмін, ккал/хв."""
+    offset = np.select([gender == 'male', gender == 'female'], [5.0, -161.0], default=-78.0)
+    return (10.0 * weight + 6.25 * height - 5.0 * age + offset) / 1440.0
+
+
+def estimated_vo2max(age, gender) -> np.ndarray:
+    """Популяційна норма VO2max (мл/кг/хв) за віком і статтю, без тесту навантаження."""
+    male, female = 60.0 - 0.55 * age, 48.0 - 0.37 * age
+    return np.maximum(np.select([gender == 'male', gender == 'female'], [male, female], default=(male + female) / 2), 15.0)
+
+
+def vo2(model: np.ndarray, activity_type: np.ndarray, speed_ms: np.ndarray, grade: np.ndarray) -> np.ndarray:
+    """VO2 (мл/кг/хв) для масивів сегментів або активностей."""
+    speed = speed_ms * 60.0  # м/хв
+    grade = np.clip(grade, 0.0, MAX_GRADE)  # спуск ACSM не моделює
+    walk = REST_VO2 + 0.1 * speed + 1.8 * speed * grade
+    run = REST_VO2 + 0.2 * speed + 0.9 * speed * grade
+    cycle = np.interp(speed_ms * 3.6, CYCLING_SPEED_KMH, CYCLING_MET) * REST_VO2 + 1.8 * speed * grade
+    constant = np.array([CONSTANT_MET.get(t, CONSTANT_MET['other']) for t in activity_type]) * REST_VO2
+    return np.select([model == MODEL_WALK, model == MODEL_RUN, model == MODEL_CYCLE], [walk, run, cycle], default=constant)
+
+
+# --- Пакетна оцінка ---
+
+def load_inputs(activity_ids: Iterable[int]):
+    """Активності пакета, профілі їхніх власників і всі точки треків одним запитом на таблицю."""
+    activities = list(
+        Activity.objects.filter(id__in=list(activity_ids))
+        .order_by('id').values('id', 'user_id', *ACTIVITY_INPUT_FIELDS)
+    )
+    profiles = {
+        row['user_id']: row
+        for row in Profile.objects.filter(user_id__in={a['user_id'] for a in activities})
+        .values('user_id', *PROFILE_INPUT_FIELDS)
+    }
+    points = np.array(list(
+        ActivityPoint.objects.filter(activity_id__in=[a['id'] for a in activities], recorded_at__isnull=False)
+        .order_by('activity_id', 'recorded_at', 'id')
+        .values_list('activity_id', 'recorded_at', 'lat', 'lon', 'ele', 'speed')
+    ), dtype=object).reshape(-1, 6)
+    return activities, profiles, points
+
+
+def track_segments(points: np.ndarray, index_of: Dict[int, int]):
+    """
+    Сегменти між сусідніми точками одного треку.
+    Повертає (індекс активності, тривалість с, швидкість м/с, ухил) для валідних сегментів.
+    """
+    if len(points) < 2:
+        empty = np.array([], dtype=np.float64)
+        return np.array([], dtype=np.int64), empty, empty, empty
+    act = np.array([index_of[a] for a in points[:, 0]], dtype=np.int64)
+    t = np.array([p.timestamp() for p in points[:, 1]], dtype=np.float64)
+    lat, lon = points[:, 2].astype(np.float64), points[:, 3].astype(np.float64)
+    ele = np.array([np.nan if e is None else e for e in points[:, 4]], dtype=np.float64)
+    speed = np.array([np.nan if s is None else s for s in points[:, 5]], dtype=np.float64)
+
+    dt = np.diff(t)
+    dist = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    valid = (act[1:] == act[:-1]) & (dt > 0) & (dt <= MAX_SEGMENT_GAP_SEC)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Швидкість з датчика, якщо є на обох кінцях сегмента, інакше - з координат
+        sensor = (speed[:-1] + speed[1:]) / 2
+        seg_speed = np.where(np.isnan(sensor), dist / dt, sensor)
+        grade = np.where((dist > 1.0) & ~np.isnan(ele[:-1]) & ~np.isnan(ele[1:]), np.diff(ele) / dist, 0.0)
+    valid &= np.isfinite(seg_speed)
+    return act[1:][valid], dt[valid], seg_speed[valid], np.nan_to_num(grade[valid])
+
+
+def estimate(activities: List[dict], profiles: Dict[int, dict], points: np.ndarray) -> List[dict]:
+    """Оцінки для пакета активностей (порядок збігається з activities)."""
+    n = len(activities)
+    if n == 0:
+        return []
+    index_of = {a['id']: i for i, a in enumerate(activities)}
+    types = np.array([a['activity_type'] for a in activities], dtype=object)
+    model = np.array([SPEED_MODEL.get(t, MODEL_CONSTANT) for t in types], dtype=np.int64)
+    person = profile_arrays([profiles.get(a['user_id'], {}) for a in activities])
+
+    # Трек: MET-хвилини і рухомий час по сегментах
+    seg_act, seg_dt, seg_speed, seg_grade = track_segments(points, index_of)
+    seg_vo2 = vo2(model[seg_act], types[seg_act], seg_speed, seg_grade)
+    track_minutes = np.bincount(seg_act, weights=seg_dt / 60.0, minlength=n)
+    track_vo2_minutes = np.bincount(seg_act, weights=seg_vo2 * seg_dt / 60.0, minlength=n)
+
+    # Без придатного треку: середня швидкість і набір висоти за всю активність
+    duration = np.array([a['duration_sec'] or 0.0 for a in activities], dtype=np.float64)
+    distance = np.array([a['distance_m'] or 0.0 for a in activities], dtype=np.float64)
+    gain = np.array([a['elevation_gain_m'] or 0.0 for a in activities], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_speed = np.where(duration > 0, distance / duration, 0.0)
+        avg_grade = np.where(distance > 0, gain / distance, 0.0)
+    summary_vo2_minutes = vo2(model, types, avg_speed, avg_grade) * duration / 60.0
+
+    from_track = track_minutes > 0
+    minutes = np.where(from_track, track_minutes, duration / 60.0)
+    vo2_minutes = np.where(from_track, track_vo2_minutes, summary_vo2_minutes)
+
+    basal = basal_kcal_per_min(person['weight'], person['height'], person['age'], person['gender'])
+    calories = vo2_minutes * person['weight'] * KCAL_PER_LITRE_O2 / 1000.0
+    active = np.maximum(calories - basal * minutes, 0.0)
+    # Особистий RMR у мл/кг/хв замість стандартних 3.5
+    rmr = basal * 1000.0 / KCAL_PER_LITRE_O2 / person['weight']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_vo2 = np.where(minutes > 0, vo2_minutes / minutes, 0.0)
+    met_avg = avg_vo2 / rmr
+    intensity = avg_vo2 / estimated_vo2max(person['age'], person['gender'])
+
+    return [
+        {
+            'activity_id': activities[i]['id'],
+            'calories_kcal': round(float(calories[i]), 1),
+            'active_calories_kcal': round(float(active[i]), 1),
+            'met_avg': round(float(met_avg[i]), 2),
+            'met_minutes': round(float(met_avg[i] * minutes[i]), 1),
+            'relative_intensity': round(float(intensity[i]), 3),
+            'moving_time_sec': round(float(minutes[i] * 60.0), 1),
+            'source': 'track' if from_track[i] else 'summary',
+        }
+        for i in range(n)
+    ]
+
+
+def estimate_batch(activity_ids: Iterable[int]) -> int:
+    """Рахує і зберігає оцінки для пакета активностей. Повертає кількість збережених."""
+    results = estimate(*load_inputs(activity_ids))
+    rows = [ActivityEstimate(engine_version=ENGINE_VERSION, stale=False, **result) for result in results]
+    with transaction.atomic():
+        ActivityEstimate.objects.filter(activity_id__in=[r.activity_id for r in rows]).delete()
+        ActivityEstimate.objects.bulk_create(rows)
+    return len(rows)
+
+
+def pending_ids():
+    """Активності без актуальної оцінки (немає, застаріла або стара версія рушія)."""
+    return Activity.objects.filter(deleted_at__isnull=True).filter(
+        Q(estimate__isnull=True) | Q(estimate__stale=True) | ~Q(estimate__engine_version=ENGINE_VERSION)
+    ).order_by('id').values_list('id', flat=True)
+
+
+def get_estimate(activity_id: int) -> Optional[ActivityEstimate]:
+    """Збережена оцінка; застаріла або відсутня перераховується на місці."""
+    current = ActivityEstimate.objects.filter(
+        activity_id=activity_id, stale=False, engine_version=ENGINE_VERSION
+    ).first()
+    if current:
+        return current
+    if not estimate_batch([activity_id]):
+        return None
+    return ActivityEstimate.objects.get(activity_id=activity_id)
+
+
+# --- Інвалідація (викликається з репозиторіїв) ---
+
+def activity_inputs_changed(old: Optional[dict], new: Optional[dict]) -> bool:
+    if not old or not new:
+        return False
+    return any(old.get(name) != new.get(name) for name in ACTIVITY_INPUT_FIELDS)
+
+
+def profile_inputs_changed(old: Optional[dict], new: Optional[dict]) -> bool:
+    if old is None or new is None:
+        return old != new
+    return any(old.get(name) != new.get(name) for name in PROFILE_INPUT_FIELDS)
+
+
+def invalidate_activities(activity_ids: Iterable[int]) -> int:
+    return ActivityEstimate.objects.filter(activity_id__in=list(activity_ids), stale=False).update(stale=True)
+
+
+def invalidate_user(user_id: int) -> int:
+    return ActivityEstimate.objects.filter(activity__user_id=user_id, stale=False).update(stale=True)
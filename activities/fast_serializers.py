@@ -0,0 +1,121 @@
+"""
+Швидкий шлях серіалізації списків: кортежі .values_list() з репозиторію
+перетворюються на dict-и згенерованою для кожної моделі функцією, без створення
+екземплярів моделей і без per-object to_representation() DRF.
+
+Енкодер будується з полів самого ModelSerializer-а, тож вихід збігається з ним.
+Якщо серіалізатор має поле, яке не відображається на колонку моделі
+(SerializerMethodField, вкладений серіалізатор тощо), швидкий шлях не
+використовується і запит іде стандартним DRF-шляхом. Запис завжди йде через
+звичайні серіалізатори з валідацією.
+"""
+import datetime
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+# Поля, для яких значення з БД вже має потрібний вигляд (to_representation - тотожність)
+IDENTITY_FIELDS = (
+    serializers.IntegerField,
+    serializers.FloatField,
+    serializers.CharField,
+    serializers.BooleanField,
+    serializers.ChoiceField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+def datetime_converter(field):
+    """
+    Те саме, що DateTimeField.to_representation для формату ISO 8601, але з
+    часовим поясом, визначеним один раз при побудові енкодера.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    if getattr(field_timezone, 'key', None) == 'UTC' or field_timezone is datetime.timezone.utc:
+        # Типовий випадок (TIME_ZONE = 'UTC'): значення з БД вже в UTC, astimezone не потрібен
+        def convert_utc(value):
+            if value.tzinfo is not datetime.timezone.utc:
+                value = value.astimezone(datetime.timezone.utc)
+            return value.isoformat()[:-6] + 'Z'
+        return convert_utc
+
+    def convert(value):
+        text = value.astimezone(field_timezone).isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return convert
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+class RowEncoder:
+    """Відображення кортежу колонок на вихідний dict, скомпільоване один раз."""
+
+    def __init__(self, names: List[str], columns: List[str], converters: dict):
+        self.names = names
+        self.columns = columns
+        self.encode = self._compile(names, converters)
+
+    @staticmethod
+    def _compile(names, converters):
+        items = []
+        namespace = {}
+        for index, name in enumerate(names):
+            if index in converters:
+                namespace[f"c{index}"] = converters[index]
+                items.append(f"{name!r}: None if r[{index}] is None else c{index}(r[{index}])")
+            else:
+                items.append(f"{name!r}: r[{index}]")
+        source = "lambda r: {" + ", ".join(items) + "}"
+        return eval(compile(source, '<row-encoder>', 'eval'), namespace)
+
+    def encode_all(self, rows: Iterable[tuple]) -> list:
+        return list(map(self.encode, rows))
+
+
+def column_for(model, field) -> str:
+    """Колонка моделі (attname), з якої читається поле серіалізатора."""
+    if field.source == '*' or '.' in field.source:
+        raise UnsupportedField(field.source)
+    if isinstance(field, serializers.RelatedField) and not isinstance(field, serializers.PrimaryKeyRelatedField):
+        raise UnsupportedField(field.source)
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        raise UnsupportedField(field.source)
+    if not model_field.concrete:
+        raise UnsupportedField(field.source)
+    return model_field.attname
+
+
+@lru_cache(maxsize=256)
+def encoder_for(serializer_class, field_names: Optional[Tuple[str, ...]] = None) -> Optional[RowEncoder]:
+    """
+    Енкодер для серіалізатора (і, за потреби, підмножини полів ?fields=).
+    None - серіалізатор не підтримує швидкий шлях.
+    """
+    serializer = serializer_class()
+    model = serializer.Meta.model
+    names, columns, converters = [], [], {}
+    try:
+        for name, field in serializer.fields.items():
+            if field.write_only or (field_names is not None and name not in field_names):
+                continue
+            columns.append(column_for(model, field))
+            if isinstance(field, serializers.DateTimeField):
+                converters[len(names)] = datetime_converter(field)
+            elif not isinstance(field, IDENTITY_FIELDS):
+                # Десяткові, дати тощо - через to_representation самого поля DRF
+                converters[len(names)] = field.to_representation
+            names.append(name)
+    except UnsupportedField:
+        return None
+    return RowEncoder(names, columns, converters)
@@ -0,0 +1,86 @@
+"""Геометрія треків: відстані на сфері (векторизовано numpy)."""
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Відстань по великому колу в метрах; приймає скаляри або масиви numpy."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def _geohash_bits(precision: int):
+    bits = 5 * precision
+    return bits, (bits + 1) // 2, bits // 2
+
+
+def _quantize(lat, lon, precision: int):
+    """Номери рядка і стовпчика сітки geohash заданої точності."""
+    _, lon_bits, lat_bits = _geohash_bits(precision)
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    lat_q = np.clip(((lat + 90.0) / 180.0 * (1 << lat_bits)).astype(np.int64), 0, (1 << lat_bits) - 1)
+    lon_q = np.clip(((lon + 180.0) / 360.0 * (1 << lon_bits)).astype(np.int64), 0, (1 << lon_bits) - 1)
+    return lat_q, lon_q
+
+
+def _interleave(lat_q, lon_q, precision: int):
+    bits, lon_left, lat_left = _geohash_bits(precision)
+    code = np.zeros(np.broadcast(lat_q, lon_q).shape, dtype=np.int64)
+    for i in range(bits):
+        if i % 2 == 0:
+            lon_left -= 1
+            code = (code << 1) | ((lon_q >> lon_left) & 1)
+        else:
+            lat_left -= 1
+            code = (code << 1) | ((lat_q >> lat_left) & 1)
+    return code
+
+
+def geohash_int(lat, lon, precision: int = 7):
+    """
+    Geohash точок як ціле число (5 * precision біт, починаючи з довготи):
+    сусідні точки мають спільний префікс. Приймає скаляри або масиви numpy.
+    """
+    return _interleave(*_quantize(lat, lon, precision), precision)
+
+
+def geohash_to_str(code: int, precision: int) -> str:
+    chars = []
+    for _ in range(precision):
+        chars.append(GEOHASH_BASE32[code & 31])
+        code >>= 5
+    return ''.join(reversed(chars))
+
+
+def geohash(lat: float, lon: float, precision: int = 9) -> str:
+    """Звичайний рядковий geohash точки (префікс = клітинка, що її містить)."""
+    return geohash_to_str(int(geohash_int(lat, lon, precision)), precision)
+
+
+def geohash_cell_size_m(precision: int, lat: float):
+    """(висота, ширина) клітинки geohash у метрах на широті lat."""
+    _, lon_bits, lat_bits = _geohash_bits(precision)
+    height = np.radians(180.0 / (1 << lat_bits)) * EARTH_RADIUS_M
+    width = np.radians(360.0 / (1 << lon_bits)) * EARTH_RADIUS_M * np.cos(np.radians(lat))
+    return float(height), float(width)
+
+
+def geohash_neighbourhood(lat: float, lon: float, precision: int):
+    """Клітинка точки і вісім сусідніх (довгота - з переходом через 180-й меридіан)."""
+    _, lon_bits, lat_bits = _geohash_bits(precision)
+    lat_q, lon_q = (int(v) for v in _quantize(lat, lon, precision))
+    cells = set()
+    for d_lat in (-1, 0, 1):
+        row = lat_q + d_lat
+        if not 0 <= row < (1 << lat_bits):
+            continue
+        for d_lon in (-1, 0, 1):
+            column = (lon_q + d_lon) % (1 << lon_bits)
+            cells.add(geohash_to_str(int(_interleave(np.int64(row), np.int64(column), precision)), precision))
+    return sorted(cells)
@@ -0,0 +1,283 @@
+"""
+Теплові карти з усіх точок треків.
+
+Точки біняться у тайли веб-меркатора (256x256 пікселів) на кожному рівні
+масштабу з HEATMAP_MIN_ZOOM..HEATMAP_MAX_ZOOM. Масиви щільності зберігаються
+стиснутими у HeatmapTile, тож запит тайла - це одне читання рядка.
+
+Щільність веде різниця двох потоків:
+  - додавання: update_incremental() читає події create/update ActivityPoint з
+    outbox у порядку комітів (споживач 'heatmap'). Водяний знак за id тут не
+    годиться - довга транзакція закомітила б точки з id, нижчими за вже
+    оброблений, і вони ніколи не потрапили б на мапу;
+  - віднімання: кожен шлях, що видаляє чи переносить точки (репозиторій точок,
+    purge_deletions, політика зберігання), у своїй транзакції віднімає їх від
+    тайлів через remove_rows().
+Тайли зберігають знакові лічильники: видалення, закомічене раніше, ніж
+update_incremental() додав ту саму точку, на мить дає від'ємний піксель, який
+при рендерингу обрізається до нуля, а після додавання стає точним.
+Повна перебудова розпаралелюється пулом процесів.
+"""
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max
+
+from . import outbox
+from .models import Activity, ActivityPoint, HeatmapTile, OutboxConsumer
+
+TILE_SIZE = 256
+MAX_MERCATOR_LAT = 85.05112878
+# Споживач outbox, що додає нові точки до тайлів
+CONSUMER = 'heatmap'
+
+# (user_id | None, zoom, x, y) -> масив щільності int64[TILE_SIZE * TILE_SIZE]
+TileKey = Tuple[Optional[int], int, int, int]
+
+
+def zoom_levels() -> range:
+    return range(
+        getattr(settings, 'HEATMAP_MIN_ZOOM', 2),
+        getattr(settings, 'HEATMAP_MAX_ZOOM', 14) + 1
+    )
+
+
+# --- Біннінг ---
+
+def project(lats: np.ndarray, lons: np.ndarray, zoom: int):
+    """Веб-меркатор: координати -> (tile_x, tile_y, pixel_x, pixel_y) для рівня zoom."""
+    n = 1 << zoom
+    lat_rad = np.radians(np.clip(lats, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    world_x = (lons + 180.0) / 360.0 * n
+    world_y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0 * n
+
+    tile_x = np.clip(np.floor(world_x), 0, n - 1).astype(np.int64)
+    tile_y = np.clip(np.floor(world_y), 0, n - 1).astype(np.int64)
+    pixel_x = np.clip(((world_x - tile_x) * TILE_SIZE).astype(np.int64), 0, TILE_SIZE - 1)
+    pixel_y = np.clip(((world_y - tile_y) * TILE_SIZE).astype(np.int64), 0, TILE_SIZE - 1)
+    return tile_x, tile_y, pixel_x, pixel_y
+
+
+def bin_points(lats: np.ndarray, lons: np.ndarray, user_id: Optional[int] = None) -> Dict[TileKey, np.ndarray]:
+    """Рахує точки по пікселях тайлів на всіх рівнях масштабу."""
+    tiles = {}
+    if len(lats) == 0:
+        return tiles
+    pixels_per_tile = TILE_SIZE * TILE_SIZE
+    for zoom in zoom_levels():
+        n = 1 << zoom
+        tile_x, tile_y, pixel_x, pixel_y = project(lats, lons, zoom)
+        # Один ключ на (тайл, піксель): після np.unique ключі відсортовані й згруповані за тайлом
+        combined = (tile_x * n + tile_y) * pixels_per_tile + pixel_y * TILE_SIZE + pixel_x
+        keys, counts = np.unique(combined, return_counts=True)
+        tile_ids = keys // pixels_per_tile
+        pixels = keys % pixels_per_tile
+        bounds = np.flatnonzero(np.diff(tile_ids)) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(keys)]):
+            tile_id = int(tile_ids[start])
+            density = np.zeros(pixels_per_tile, dtype=np.int64)
+            density[pixels[start:end]] = counts[start:end]
+            tiles[(user_id, zoom, tile_id // n, tile_id % n)] = density
+    return tiles
+
+
+def merge_tiles(target: Dict[TileKey, np.ndarray], source: Dict[TileKey, np.ndarray]) -> None:
+    for key, density in source.items():
+        if key in target:
+            target[key] += density
+        else:
+            target[key] = density
+
+
+def bin_rows(user_ids: np.ndarray, lats: np.ndarray, lons: np.ndarray) -> Dict[TileKey, np.ndarray]:
+    """
+    Глобальні тайли плюс персональні для кожного користувача з пакета точок
+    (user_id < 0 - власник невідомий, точка йде лише в глобальні тайли).
+    """
+    tiles = bin_points(lats, lons)
+    order = np.argsort(user_ids, kind='stable')
+    user_ids, lats, lons = user_ids[order], lats[order], lons[order]
+    bounds = np.flatnonzero(np.diff(user_ids)) + 1
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(user_ids)]):
+        if start < end and user_ids[start] >= 0:
+            merge_tiles(tiles, bin_points(lats[start:end], lons[start:end], int(user_ids[start])))
+    return tiles
+
+
+# --- Компактне зберігання ---
+
+def encode_density(density: np.ndarray) -> bytes:
+    return zlib.compress(density.astype('<i4').tobytes(), 6)
+
+
+def decode_density(blob) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(bytes(blob)), dtype='<i4').astype(np.int64)
+
+
+def load_points(start_id: int, end_id: int):
+    """Точки з id у [start_id, end_id) як numpy-масиви (user_id, lat, lon)."""
+    rows = ActivityPoint.objects.filter(id__gte=start_id, id__lt=end_id) \
+        .values_list('activity__user_id', 'lat', 'lon')
+    data = np.array(list(rows), dtype=np.float64).reshape(-1, 3)
+    return data[:, 0].astype(np.int64), data[:, 1], data[:, 2]
+
+
+def owners(activity_ids: np.ndarray) -> np.ndarray:
+    """user_id власника для кожного activity_id (-1 - активність уже видалена)."""
+    known = dict(
+        Activity.objects.filter(id__in=set(activity_ids.tolist())).values_list('id', 'user_id')
+    )
+    return np.array([known.get(activity_id, -1) for activity_id in activity_ids.tolist()], dtype=np.int64)
+
+
+def store_tiles(tiles: Dict[TileKey, np.ndarray]) -> int:
+    """Додає щільності (можуть бути від'ємними) до збережених тайлів або створює нові. Повертає кількість тайлів."""
+    with transaction.atomic():
+        for (user_id, zoom, x, y), density in tiles.items():
+            tile = HeatmapTile.objects.select_for_update() \
+                .filter(user_id=user_id, zoom=zoom, x=x, y=y).first()
+            if tile is None:
+                tile = HeatmapTile(user_id=user_id, zoom=zoom, x=x, y=y)
+            else:
+                density = density + decode_density(tile.density)
+            tile.density = encode_density(density)
+            tile.point_count = int(density.sum())
+            tile.save()
+    return len(tiles)
+
+
+def get_tile_density(zoom: int, x: int, y: int, user_id: Optional[int] = None) -> Optional[np.ndarray]:
+    blob = HeatmapTile.objects.filter(user_id=user_id, zoom=zoom, x=x, y=y) \
+        .values_list('density', flat=True).first()
+    if blob is None:
+        return None
+    # Від'ємні пікселі - видалення, що випередило додавання тих самих точок
+    return np.maximum(decode_density(blob), 0).reshape(TILE_SIZE, TILE_SIZE)
+
+
+# --- Додавання і віднімання точок ---
+
+def store_rows(rows, sign: int = 1) -> int:
+    """Додає (sign=1) або віднімає (sign=-1) рядки (activity_id, lat, lon). Повертає кількість тайлів."""
+    data = np.array(list(rows), dtype=np.float64).reshape(-1, 3)
+    if len(data) == 0:
+        return 0
+    tiles = bin_rows(owners(data[:, 0].astype(np.int64)), data[:, 1], data[:, 2])
+    if sign < 0:
+        for density in tiles.values():
+            np.negative(density, out=density)
+    return store_tiles(tiles)
+
+
+def remove_rows(rows) -> int:
+    """Віднімає видалені точки (activity_id, lat, lon) - у транзакції, що їх видаляє."""
+    return store_rows(rows, sign=-1)
+
+
+# --- Побудова ---
+
+def update_incremental(batch_size: int = 50000) -> int:
+    """
+    Додає до тайлів точки з подій create/update ActivityPoint, закомічених після
+    попереднього запуску. Оновлюються тільки тайли, яких торкаються нові треки.
+    update - це точка після зміни: її старе місце відняв репозиторій.
+    """
+    processed = 0
+    outbox.sequence()
+    while True:
+        with transaction.atomic():
+            events = outbox.fetch_after(
+                outbox.lock_offset(CONSUMER), limit=batch_size, models=[outbox.model_label(ActivityPoint)]
+            )
+            if not events:
+                return processed
+            rows = [
+                (event['payload']['activity_id'], event['payload']['lat'], event['payload']['lon'])
+                for event in events if event['op'] in (outbox.CREATE, outbox.UPDATE) and event['payload']
+            ]
+            store_rows(rows)
+            outbox.ack(CONSUMER, events[-1]['seq'])
+        processed += len(rows)
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _build_range(id_range: Tuple[int, int]) -> Dict[TileKey, bytes]:
+    """Задача воркера: тайли для діапазону id (власне з'єднання з БД у кожному процесі)."""
+    tiles = bin_rows(*load_points(*id_range))
+    connections.close_all()
+    return {key: encode_density(density) for key, density in tiles.items()}
+
+
+def id_ranges(max_id: int, chunk_size: int) -> Iterable[Tuple[int, int]]:
+    for start in range(1, max_id + 1, chunk_size):
+        yield start, min(start + chunk_size, max_id + 1)
+
+
+def rebuild(workers: int = 4, chunk_size: int = 200000, log=None) -> int:
+    """
+    Повна перебудова всіх тайлів з нуля; чанки точок обробляє пул процесів.
+    Споживач 'heatmap' переводиться на кінець outbox на момент початку, тож
+    точки, записані під час перебудови, додасть наступний update_incremental()
+    (ті з них, що потрапили й у чанк, врахуються двічі - перебудову варто
+    запускати, коли трекінг не навантажений).
+    """
+    outbox.sequence()
+    head = outbox.get_offset(outbox.SEQUENCER)
+    max_id = ActivityPoint.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    HeatmapTile.objects.all().delete()
+    ranges = list(id_ranges(max_id, chunk_size))
+
+    if workers > 1 and len(ranges) > 1:
+        # Дочірні процеси не повинні успадкувати відкрите з'єднання батька
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for done, encoded in enumerate(pool.map(_build_range, ranges), start=1):
+                store_tiles({key: decode_density(blob) for key, blob in encoded.items()})
+                if log:
+                    log(f"chunk {done}/{len(ranges)}: {len(encoded)} tiles")
+    else:
+        for done, id_range in enumerate(ranges, start=1):
+            tiles = bin_rows(*load_points(*id_range))
+            store_tiles(tiles)
+            if log:
+                log(f"chunk {done}/{len(ranges)}: {len(tiles)} tiles")
+
+    OutboxConsumer.objects.update_or_create(name=CONSUMER, defaults={'last_event_id': head})
+    return max_id
+
+
+# --- Рендеринг ---
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def render_png(density: Optional[np.ndarray]) -> bytes:
+    """RGBA PNG тайла: логарифмічна шкала, від прозорого до жовто-червоного."""
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    if density is not None and density.max() > 0:
+        intensity = np.log1p(density.astype(np.float64)) / np.log1p(float(density.max()))
+        rgba[..., 0] = 255
+        rgba[..., 1] = (intensity * 255).astype(np.uint8)
+        rgba[..., 3] = np.where(density > 0, 96 + intensity * 159, 0).astype(np.uint8)
+
+    # Кожен рядок PNG починається з байта фільтра (0 - без фільтра)
+    raw = np.concatenate([np.zeros((TILE_SIZE, 1), dtype=np.uint8), rgba.reshape(TILE_SIZE, -1)], axis=1)
+    header = struct.pack('>IIBBBBB', TILE_SIZE, TILE_SIZE, 8, 6, 0, 0, 0)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + _png_chunk(b'IHDR', header)
+        + _png_chunk(b'IDAT', zlib.compress(raw.tobytes(), 6))
+        + _png_chunk(b'IEND', b'')
+    )
@@ -0,0 +1,236 @@
+"""
+Live-трекінг ("маячок"): телефон стрімить точки раз на секунду, підписники
+(власник і його фоловери) бачать пробіжку в реальному часі.
+
+Точки не пишуться в БД поштучно. LiveSession публікатора тримає кільцевий
+буфер останніх LIVE_BUFFER_SIZE точок (хвіст для тих, хто підключився
+пізніше) і чергу ще не збережених точок. Черга скидається в ActivityPoint
+одним пакетом через репозиторій раз на LIVE_FLUSH_INTERVAL_SEC або після
+LIVE_FLUSH_BATCH точок. Коли сесія завершується (повідомлення 'finish'),
+решта черги зберігається, а агрегати Activity (дистанція, тривалість, набір
+висоти, час старту і фінішу) перераховуються з треку.
+
+Розрив з'єднання (тунель, зміна мережі) - ще не фініш: черга зберігається, і
+сесія фіналізується, лише якщо публікатор не повернувся за LIVE_IDLE_TIMEOUT_SEC.
+Хто зараз публікатор, видно з токена в кеші Django (спільному для процесів
+у продакшені): кожне підключення бере новий токен, і таймер розірваного
+з'єднання нічого не робить, якщо токен уже не його. Нова сесія відновлює
+з треку в БД час останньої точки і хвіст буфера, тож повторно надіслані
+телефоном точки відкидаються, а глядачі отримують хвіст як і раніше.
+
+Модуль не залежить від транспорту; WebSocket-споживачі - у consumers.py.
+"""
+import datetime
+import time
+import uuid
+from collections import deque
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import estimation, routes
+from .geo import haversine_m
+from .models import Activity, ActivityPoint, Follower
+from .repositories import DataAccessLayer
+
+SAMPLE_FIELDS = ('lat', 'lon', 'ele', 'speed', 'cadence', 'recorded_at')
+
+
+def buffer_size() -> int:
+    return getattr(settings, 'LIVE_BUFFER_SIZE', 600)
+
+
+def flush_interval() -> float:
+    return getattr(settings, 'LIVE_FLUSH_INTERVAL_SEC', 5.0)
+
+
+def flush_batch() -> int:
+    return getattr(settings, 'LIVE_FLUSH_BATCH', 60)
+
+
+def idle_timeout() -> float:
+    return getattr(settings, 'LIVE_IDLE_TIMEOUT_SEC', 300.0)
+
+
+def group_name(activity_id: int) -> str:
+    return f"live.activity.{activity_id}"
+
+
+def publisher_key(activity_id: int) -> str:
+    return f"live.publisher.{activity_id}"
+
+
+# --- Доступ ---
+
+def can_publish(user_id: int, activity_id: int) -> bool:
+    return Activity.objects.filter(id=activity_id, user_id=user_id, deleted_at__isnull=True).exists()
+
+
+def can_watch(user_id: int, activity_id: int) -> bool:
+    """Дивитися може власник і ті, хто на нього підписаний."""
+    owner_id = Activity.objects.filter(id=activity_id, deleted_at__isnull=True).values_list('user_id', flat=True).first()
+    if owner_id is None:
+        return False
+    return owner_id == user_id or Follower.objects.filter(follower_id=user_id, followee_id=owner_id).exists()
+
+
+# --- Точки ---
+
+def parse_sample(raw) -> Optional[dict]:
+    """Точка з повідомлення клієнта або None, якщо вона некоректна. Без часу - час сервера."""
+    if not isinstance(raw, dict):
+        return None
+    try:
+        lat, lon = float(raw['lat']), float(raw['lon'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None
+
+    recorded_at = raw.get('recorded_at')
+    if isinstance(recorded_at, (int, float)):
+        recorded_at = datetime.datetime.fromtimestamp(recorded_at, tz=datetime.timezone.utc)
+    elif isinstance(recorded_at, str):
+        recorded_at = parse_datetime(recorded_at)
+        if recorded_at is not None and timezone.is_naive(recorded_at):
+            recorded_at = timezone.make_aware(recorded_at, datetime.timezone.utc)
+    else:
+        recorded_at = None
+    sample = {'lat': lat, 'lon': lon, 'recorded_at': recorded_at or timezone.now()}
+    for name, cast in (('ele', float), ('speed', float), ('cadence', int)):
+        try:
+            value = cast(raw[name]) if raw.get(name) is not None else None
+        except (TypeError, ValueError):
+            value = None
+        # speed і cadence не можуть бути від'ємними (обмеження ActivityPoint)
+        sample[name] = value if value is None or name == 'ele' or value >= 0 else None
+    return sample
+
+
+def sample_json(sample: dict) -> dict:
+    return {**sample, 'recorded_at': sample['recorded_at'].isoformat()}
+
+
+class LiveSession:
+    """Кільцевий буфер і черга збереження однієї live-активності (живе в процесі публікатора)."""
+
+    def __init__(self, activity_id: int, size: Optional[int] = None, token: Optional[str] = None):
+        self.activity_id = activity_id
+        self.token = token
+        self.ring = deque(maxlen=size or buffer_size())
+        self.pending: List[dict] = []
+        self.last_recorded_at = None
+        self.last_flush = time.monotonic()
+        self.received = 0
+        self.flushed = 0
+
+    def add(self, raw_samples: Iterable) -> List[dict]:
+        """Приймає точки клієнта; повтори і точки, старші за останню прийняту, відкидаються."""
+        accepted = []
+        for raw in raw_samples:
+            sample = parse_sample(raw)
+            if sample is None or (self.last_recorded_at and sample['recorded_at'] <= self.last_recorded_at):
+                continue
+            self.last_recorded_at = sample['recorded_at']
+            accepted.append(sample)
+        self.ring.extend(accepted)
+        self.pending.extend(accepted)
+        self.received += len(accepted)
+        return accepted
+
+    def should_flush(self) -> bool:
+        if not self.pending:
+            return False
+        return len(self.pending) >= flush_batch() or time.monotonic() - self.last_flush >= flush_interval()
+
+    def take_pending(self) -> List[dict]:
+        batch, self.pending = self.pending, []
+        self.last_flush = time.monotonic()
+        return batch
+
+    def requeue(self, batch: List[dict]):
+        """Пакет, який не вдалося зберегти, повертається в чергу наступного скидання."""
+        self.pending = batch + self.pending
+
+    def tail(self) -> List[dict]:
+        return [sample_json(sample) for sample in self.ring]
+
+    def restore(self, samples: List[dict]):
+        """Збережені раніше точки (за часом): хвіст буфера і межа для повторів після перепідключення."""
+        self.ring.extend(samples)
+        if samples:
+            self.last_recorded_at = samples[-1]['recorded_at']
+
+
+# --- Сесія публікатора ---
+
+def open_session(activity_id: int) -> LiveSession:
+    """Сесія нового підключення публікатора: забирає токен і відновлює хвіст з треку в БД."""
+    session = LiveSession(activity_id, token=uuid.uuid4().hex)
+    cache.set(publisher_key(activity_id), session.token, timeout=None)
+    saved = ActivityPoint.objects.filter(activity_id=activity_id, recorded_at__isnull=False) \
+        .order_by('-recorded_at').values(*SAMPLE_FIELDS)[:session.ring.maxlen]
+    session.restore(list(reversed(saved)))
+    return session
+
+
+def close_session(session: LiveSession) -> Optional[dict]:
+    """Фініш, надісланий публікатором: токен звільняється, агрегати перераховуються."""
+    if cache.get(publisher_key(session.activity_id)) == session.token:
+        cache.delete(publisher_key(session.activity_id))
+    return finalize(session.activity_id)
+
+
+def close_if_idle(session: LiveSession) -> Tuple[bool, Optional[dict]]:
+    """
+    Після таймауту розірваного з'єднання: (True, агрегати), якщо публікатор так
+    і не повернувся, інакше (False, None) - сесію продовжує нове підключення.
+    """
+    if cache.get(publisher_key(session.activity_id)) != session.token:
+        return False, None
+    cache.delete(publisher_key(session.activity_id))
+    return True, finalize(session.activity_id)
+
+
+# --- Збереження ---
+
+def flush(activity_id: int, samples: List[dict]) -> int:
+    """Один пакетний INSERT точок (повтори відкидає унікальний індекс (activity, recorded_at))."""
+    if not samples:
+        return 0
+    return DataAccessLayer().activity_points.add_bulk(
+        activity_id, [{name: sample[name] for name in SAMPLE_FIELDS} for sample in samples]
+    )
+
+
+def finalize(activity_id: int) -> Optional[dict]:
+    """Агрегати Activity з усього збереженого треку; похідні дані оновлює ActivityRepository.update."""
+    rows = list(
+        ActivityPoint.objects.filter(activity_id=activity_id, recorded_at__isnull=False)
+        .order_by('recorded_at').values_list('recorded_at', 'lat', 'lon', 'ele')
+    )
+    if len(rows) < 2:
+        return None
+    lat = np.array([row[1] for row in rows], dtype=np.float64)
+    lon = np.array([row[2] for row in rows], dtype=np.float64)
+    ele = np.array([np.nan if row[3] is None else row[3] for row in rows], dtype=np.float64)
+    climbs = np.diff(ele[~np.isnan(ele)])
+    totals = {
+        'start_time': rows[0][0],
+        'end_time': rows[-1][0],
+        'duration_sec': (rows[-1][0] - rows[0][0]).total_seconds(),
+        'distance_m': round(float(haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:]).sum()), 1),
+        'elevation_gain_m': int(round(float(climbs[climbs > 0].sum()))),
+    }
+    db = DataAccessLayer()
+    if not db.activities.update(activity_id, **totals):
+        return None
+    # Трек дописувався поза on_change - оцінка і групування маршруту будуються заново
+    estimation.invalidate_activities([activity_id])
+    routes.index_activities([activity_id])
+    return {'id': activity_id, **totals, 'start_time': totals['start_time'].isoformat(),
+            'end_time': totals['end_time'].isoformat()}
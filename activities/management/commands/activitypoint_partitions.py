@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from activities import partitioning
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage monthly ActivityPoint partitions (PostgreSQL) and apply the track "
+        "retention policy from settings.ACTIVITY_POINT_RETENTION."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert', action='store_true',
+            help="One-off: turn the plain ActivityPoint table into a table partitioned by recorded_at."
+        )
+        parser.add_argument(
+            '--ahead', type=int, default=None,
+            help="How many upcoming monthly partitions to create (default: PARTITIONS_AHEAD)."
+        )
+        parser.add_argument(
+            '--retention', action='store_true',
+            help="Drop expired months and thin out tracks older than FULL_RESOLUTION_MONTHS."
+        )
+
+    def handle(self, *args, **options):
+        if options['convert']:
+            try:
+                moved = partitioning.convert_to_partitioned()
+            except (NotImplementedError, ValueError) as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(self.style.SUCCESS(f"Partitioned table ready, {moved} rows moved."))
+
+        if partitioning.is_partitioned():
+            created = partitioning.ensure_partitions(options['ahead'])
+            for name in created:
+                self.stdout.write(f"Created partition {name}")
+            if not created:
+                self.stdout.write("Upcoming partitions already exist.")
+        elif not options['retention']:
+            self.stdout.write(
+                "ActivityPoint is not partitioned; run with --convert first (PostgreSQL only)."
+            )
+
+        if options['retention']:
+            report = partitioning.apply_retention()
+            for item in report['dropped']:
+                self.stdout.write(f"Dropped {item}")
+            for month, deleted in report['downsampled'].items():
+                self.stdout.write(f"Downsampled {month}: {deleted} points removed")
+            self.stdout.write(self.style.SUCCESS("Retention policy applied."))
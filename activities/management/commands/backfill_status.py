@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q, Sum
+
+from activities.models import BackfillRun
+
+
+class Command(BaseCommand):
+    help = "Show backfill runs with chunk progress and throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help="Only runs of this backfill.")
+        parser.add_argument('--limit', type=int, default=10)
+
+    def handle(self, *args, **options):
+        runs = BackfillRun.objects.order_by('-id')
+        if options['name']:
+            runs = runs.filter(name=options['name'])
+        runs = runs.annotate(
+            total=Count('chunks'),
+            done=Count('chunks', filter=Q(chunks__status='done')),
+            failed=Count('chunks', filter=Q(chunks__status='failed')),
+            rows=Sum('chunks__rows'),
+            seconds=Sum('chunks__seconds'),
+        )[:options['limit']]
+        for run in runs:
+            rate = (run.rows or 0) / run.seconds if run.seconds else 0
+            self.stdout.write(
+                f"#{run.id} {run.name:<16} {run.status:<8} chunks {run.done}/{run.total} "
+                f"(failed {run.failed}), {run.rows or 0} rows, {rate:.0f} rows/s per worker"
+            )
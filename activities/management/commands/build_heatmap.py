@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from activities import heatmap
+
+
+class Command(BaseCommand):
+    help = (
+        "Bin ActivityPoint tracks into heatmap tiles. By default only points committed "
+        "since the previous run are added (read from the change-event outbox; deleted points "
+        "are subtracted when they are deleted); --rebuild recomputes every tile in parallel."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Drop all tiles and rebuild from scratch.")
+        parser.add_argument('--workers', type=int, default=4, help="Worker processes for --rebuild.")
+        parser.add_argument('--chunk-size', type=int, default=200000, help="Points per worker task.")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            last_id = heatmap.rebuild(
+                workers=options['workers'],
+                chunk_size=options['chunk_size'],
+                log=self.stdout.write
+            )
+            self.stdout.write(self.style.SUCCESS(f"Heatmap rebuilt up to point {last_id}."))
+        else:
+            processed = heatmap.update_incremental(batch_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f"Heatmap updated with {processed} new points."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from activities import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact the change-event outbox: keep only the latest event per object and drop "
+        "delete tombstones older than --tombstone-days that every consumer has read."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per DELETE statement.")
+        parser.add_argument('--tombstone-days', type=int, default=None,
+                            help="Tombstone retention (default: settings.OUTBOX_TOMBSTONE_DAYS).")
+
+    def handle(self, *args, **options):
+        report = outbox.compact(batch_size=options['batch_size'], tombstone_days=options['tombstone_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Outbox compacted: {report['superseded']} superseded events, "
+            f"{report['tombstones']} tombstones removed."
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from activities import estimation
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute calorie/MET estimates for activities that have none, whose estimate is "
+        "stale (activity, track or profile changed) or was made by an older engine version."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Activities per vectorized batch.")
+
+    def handle(self, *args, **options):
+        size = options['batch_size']
+        total = 0
+        while True:
+            ids = list(estimation.pending_ids()[:size])
+            if not ids:
+                break
+            total += estimation.estimate_batch(ids)
+            self.stdout.write(f"{total} activities estimated")
+        self.stdout.write(self.style.SUCCESS(f"Estimates up to date ({total} computed)."))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from activities import notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Turn kudos, comment and follow events from the outbox into grouped notifications. "
+        "Each batch updates one row per (recipient, kind, target) group."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Outbox events per batch.")
+        parser.add_argument('--follow', action='store_true', help="Keep polling for new events.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between polls with --follow.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = notifications.process_pending(batch_size=options['batch_size'])
+            if processed:
+                self.stdout.write(f"{processed} events processed.")
+            if not options['follow']:
+                break
+            time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS("Notifications are up to date."))
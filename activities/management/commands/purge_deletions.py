@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from activities import deletion
+
+
+class Command(BaseCommand):
+    help = (
+        "Run pending DeletionJobs: purge soft-deleted users and activities together with "
+        "their points, comments, kudos and stats in bounded batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Rows per DELETE statement (default: settings.DELETION_BATCH_SIZE).")
+        parser.add_argument('--max-jobs', type=int, default=None, help="Stop after this many jobs.")
+
+    def handle(self, *args, **options):
+        done = deletion.run_pending(
+            max_jobs=options['max_jobs'],
+            size=options['batch_size'],
+            log=self.stdout.write
+        )
+        self.stdout.write(self.style.SUCCESS(f"{done} deletion job(s) completed."))
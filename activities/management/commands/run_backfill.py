@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from activities import backfill
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute derived data over primary-key ranges in a process pool. Progress is "
+        "checkpointed per chunk, so an interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help="Backfill to run (see --list).")
+        parser.add_argument('--list', action='store_true', help="List registered backfills.")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Worker processes; 0 runs every chunk in this process.")
+        parser.add_argument('--chunk-size', type=int, default=None, help="Primary keys per chunk (new runs only).")
+        parser.add_argument('--restart', action='store_true', help="Abandon an unfinished run and start over.")
+        parser.add_argument('--max-active-queries', type=int, default=None,
+                            help="Pause while PostgreSQL has more active queries than this "
+                                 "(default: settings.BACKFILL_MAX_ACTIVE_QUERIES, 0 disables).")
+
+    def handle(self, *args, **options):
+        if options['list'] or not options['name']:
+            for name, cls in sorted(backfill.REGISTRY.items()):
+                self.stdout.write(f"{name:<16} {cls.description}")
+            return
+        try:
+            run = backfill.run(
+                options['name'],
+                workers=options['workers'],
+                chunk_size=options['chunk_size'],
+                restart=options['restart'],
+                throttle=backfill.LoadThrottle(max_active=options['max_active_queries']),
+                log=self.stdout.write,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfill '{run.name}' {run.status}: {run.rows_processed} rows in ids {run.min_id}..{run.max_id}."
+        ))
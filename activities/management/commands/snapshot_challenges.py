@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from activities import challenges
+from activities.models import Challenge
+
+
+class Command(BaseCommand):
+    help = (
+        "Save standings snapshots for running challenges (schedule it, e.g. hourly or daily) "
+        "and a final snapshot for challenges that have ended since the previous run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--challenge', type=int, default=None, help="Snapshot only this challenge.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['challenge'] is not None:
+            due = Challenge.objects.filter(id=options['challenge'])
+        else:
+            due = challenges.due_for_snapshot(now)
+        taken = 0
+        for challenge in due:
+            snapshot = challenges.take_snapshot(challenge, final=challenge.ends_at <= now)
+            kind = "final " if snapshot.final else ""
+            self.stdout.write(
+                f"challenge {challenge.id}: {kind}snapshot {snapshot.id} ({snapshot.participant_count} participants)"
+            )
+            taken += 1
+        self.stdout.write(self.style.SUCCESS(f"{taken} snapshot(s) saved."))
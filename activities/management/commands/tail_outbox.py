@@ -0,0 +1,41 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from activities import outbox
+from activities.models import OutboxConsumer
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream change events from the transactional outbox as JSON lines, in order. "
+        "The consumer offset is committed after each delivered batch (at-least-once)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', required=True, help="Consumer name; its offset is stored in OutboxConsumer.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Events per batch.")
+        parser.add_argument('--model', action='append', dest='models',
+                            help="Only events for this model (repeatable), e.g. --model activity.")
+        parser.add_argument('--follow', action='store_true', help="Keep polling for new events.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between polls with --follow.")
+        parser.add_argument('--from-start', action='store_true', help="Reset the consumer offset to 0 first.")
+
+    def handle(self, *args, **options):
+        consumer = options['consumer']
+        if options['from_start']:
+            OutboxConsumer.objects.update_or_create(name=consumer, defaults={'last_event_id': 0})
+
+        while True:
+            batch = outbox.fetch_batch(consumer, limit=options['batch_size'], models=options['models'])
+            if batch:
+                self.stdout.write('\n'.join(json.dumps(event, cls=DjangoJSONEncoder) for event in batch))
+                self.stdout.flush()
+                outbox.ack(consumer, batch[-1]['seq'])
+                if len(batch) == options['batch_size']:
+                    continue
+            if not options['follow']:
+                return
+            time.sleep(options['poll_interval'])
@@ -1,8 +1,10 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
 from django.db.models import F
+from django.db.models.functions import Lower
 
 
 class Profile(models.Model):
@@ -39,6 +41,8 @@ class Profile(models.Model):
 
     bio = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Версія рядка для ETag/Last-Modified; QuerySet.update() у репозиторії виставляє її явно
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         constraints = [
@@ -60,6 +64,10 @@ class Profile(models.Model):
                 name='profile_gender_valid_choice'
             ),
         ]
+        indexes = [
+            # Атлети з того ж міста: рівність по LOWER(...) без урахування регістру
+            models.Index(Lower('city'), Lower('country'), name='profile_location_idx'),
+        ]
 
     def __str__(self):
         return self.user.username
@@ -104,6 +112,28 @@ class Activity(models.Model):
     start_time = models.DateTimeField(null=True, blank=True)
     end_time = models.DateTimeField(null=True, blank=True)
 
+    # М'яке видалення: рядок ховається одразу, дочірні дані чистить purge_deletions
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    # Денормалізований лічильник, оновлюється разом із вставкою/видаленням Kudos
+    kudos_count = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+
+    # Захист від дублікатів при повторних завантаженнях (ретраї мобільних клієнтів)
+    idempotency_key = models.CharField(max_length=64, blank=True, null=True)
+    fingerprint = models.CharField(max_length=64, blank=True, null=True)
+
+    # Геоіндекс треку для пошуку поблизу (веде spatial.py при збереженні точок)
+    start_lat = models.FloatField(null=True, blank=True)
+    start_lon = models.FloatField(null=True, blank=True)
+    min_lat = models.FloatField(null=True, blank=True)
+    min_lon = models.FloatField(null=True, blank=True)
+    max_lat = models.FloatField(null=True, blank=True)
+    max_lon = models.FloatField(null=True, blank=True)
+    start_geohash = models.CharField(max_length=12, blank=True, null=True)
+
+    # Версія рядка для ETag/Last-Modified (змінюється і разом з kudos_count)
+    updated_at = models.DateTimeField(auto_now=True)
+
     # created_at ВИДАЛЕНО згідно з вимогою
 
     def clean(self):
@@ -143,6 +173,22 @@ class Activity(models.Model):
                 ]),
                 name='activity_type_valid_choice'
             ),
+            # Один ключ ідемпотентності на користувача
+            models.UniqueConstraint(
+                fields=['user', 'idempotency_key'],
+                condition=models.Q(idempotency_key__isnull=False),
+                name='activity_user_idempotency_key_unique'
+            ),
+        ]
+        indexes = [
+            # Пошук дублікатів за відбитком треку - індексований lookup
+            models.Index(fields=['user', 'fingerprint'], name='activity_user_fingerprint_idx'),
+            models.Index(fields=['deleted_at'], name='activity_deleted_at_idx'),
+            # Пошук поблизу: префікс geohash = діапазон по цьому індексу
+            models.Index(fields=['start_geohash'], name='activity_start_geohash_idx'),
+            # Фільтри адмінки (і звіти) за видом і датою старту
+            models.Index(fields=['activity_type', 'start_time'], name='activity_type_start_idx'),
+            models.Index(fields=['start_time'], name='activity_start_time_idx'),
         ]
 
     def __str__(self):
@@ -176,12 +222,37 @@ class ActivityPoint(models.Model):
                 check=models.Q(cadence__gte=0),
                 name='activitypoint_cadence_positive'
             ),
+            # Повторно завантажена точка треку не створює дубліката
+            models.UniqueConstraint(
+                fields=['activity', 'recorded_at'],
+                condition=models.Q(recorded_at__isnull=False),
+                name='activitypoint_activity_recorded_at_unique'
+            ),
+        ]
+        indexes = [
+            # Діапазонні вибірки за часом (політика зберігання, помісячні партиції)
+            models.Index(fields=['recorded_at'], name='activitypoint_recorded_at_idx'),
         ]
 
     def __str__(self):
         return f"Point at ({self.lat}, {self.lon})"
 
 
+class ActivityPointRetentionLog(models.Model):
+    """Місяці треків, які вже проріджено політикою зберігання (щоб не проріджувати двічі)."""
+    year = models.IntegerField()
+    month = models.IntegerField()
+    keep_every = models.IntegerField(validators=[MinValueValidator(1)])
+    rows_deleted = models.BigIntegerField(default=0)
+    downsampled_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('year', 'month')
+
+    def __str__(self):
+        return f"Points {self.year}/{self.month} thinned to every {self.keep_every}"
+
+
 class Comment(models.Model):
     activity = models.ForeignKey(Activity, on_delete=models.CASCADE, related_name="comments")
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
@@ -197,7 +268,7 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Comment by {self.user.username} on Activity {self.activity.id}"
+        return f"Comment by {self.user.username} on Activity {self.activity_id}"
 
 
 class Kudos(models.Model):
@@ -209,7 +280,7 @@ class Kudos(models.Model):
         unique_together = ('activity', 'user')
 
     def __str__(self):
-        return f"Kudos from {self.user.username} to Activity {self.activity.id}"
+        return f"Kudos from {self.user.username} to Activity {self.activity_id}"
 
 
 class Follower(models.Model):
@@ -252,4 +323,442 @@ class UserMonthlyStats(models.Model):
         ]
 
     def __str__(self):
-        return f"Stats for {self.user.username} - {self.year}/{self.month}"
\ No newline at end of file
+        return f"Stats for {self.user.username} - {self.year}/{self.month}"
+
+
+class DeletionJob(models.Model):
+    """
+    Фонове видалення користувача або активності: рядок одразу прихований (soft delete),
+    а дочірні записи видаляються обмеженими пакетами командою purge_deletions.
+    """
+    TARGET_CHOICES = [
+        ('user', 'User'),
+        ('activity', 'Activity'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    object_id = models.BigIntegerField()
+    requested_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="deletion_jobs"
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    current_step = models.CharField(max_length=100, blank=True, default='')
+    rows_deleted = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['target', 'status'], name='deletionjob_target_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Delete {self.target} {self.object_id} ({self.status})"
+
+
+class CollectionVersion(models.Model):
+    """Лічильник змін колекції (списку API) для умовних GET - див. versions.py."""
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class OutboxEvent(models.Model):
+    """
+    Транзакційний outbox: кожен запис репозиторію додає сюди подію в тій самій
+    транзакції. Споживачі читають події за зростанням seq (tail_outbox).
+    payload - повний рядок після запису (без пароля), тож для стиснення
+    достатньо лишити останню подію кожного об'єкта.
+    """
+    OP_CHOICES = [
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    # Позиція в порядку комітів: видається після коміту (outbox.sequence), споживачі читають за нею
+    seq = models.BigIntegerField(null=True, blank=True, unique=True)
+    model = models.CharField(max_length=50)
+    object_id = models.CharField(max_length=64)
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    payload = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Стиснення: пошук новішої події того самого об'єкта
+            models.Index(fields=['model', 'object_id', 'id'], name='outbox_model_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.op} {self.model}:{self.object_id}"
+
+
+class OutboxConsumer(models.Model):
+    """Зміщення споживача outbox: seq останньої підтвердженої події."""
+    name = models.CharField(max_length=100, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Consumer '{self.name}' at event {self.last_event_id}"
+
+
+class Notification(models.Model):
+    """
+    Згруповане сповіщення: серія однакових подій (kudos на одну активність,
+    коментарі до неї, відповіді на коментар, нові підписники) - це один рядок
+    з лічильником, поки його не прочитано. Рядки пише fanout_notifications
+    пакетами з outbox.
+    """
+    KIND_CHOICES = [
+        ('kudos', 'Kudos'),
+        ('comment', 'Comment'),
+        ('reply', 'Reply'),
+        ('follow', 'Follow'),
+    ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Ключ групи: 'activity:<id>', 'comment:<id>' або 'user:<id>'
+    target_key = models.CharField(max_length=64)
+    activity = models.ForeignKey(
+        Activity, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    count = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # Останні актори групи: [{'id': ..., 'username': ...}, ...]
+    actors = models.JSONField(default=list)
+    latest_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Стрічка сповіщень (cursor pagination) і лічильник непрочитаних
+            models.Index(fields=['recipient', '-latest_at', '-id'], name='notification_feed_idx'),
+            models.Index(fields=['recipient', 'read_at'], name='notification_unread_idx'),
+            models.Index(fields=['recipient', 'kind', 'target_key'], name='notification_group_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} x{self.count} for user {self.recipient_id} ({self.target_key})"
+
+
+class ActivityEstimate(models.Model):
+    """
+    Оцінка витрат енергії для активності (estimation.py) з урахуванням профілю.
+    stale = True ставлять репозиторії, коли змінюється активність, її трек або
+    поля профілю, від яких залежить оцінка; інші записи не торкаються.
+    """
+    SOURCE_CHOICES = [
+        ('track', 'Track'),
+        ('summary', 'Summary'),
+    ]
+
+    activity = models.OneToOneField(Activity, on_delete=models.CASCADE, primary_key=True, related_name="estimate")
+    calories_kcal = models.FloatField(validators=[MinValueValidator(0.0)])
+    # Понад базовий обмін за той самий час
+    active_calories_kcal = models.FloatField(validators=[MinValueValidator(0.0)])
+    # Скоригований на особистий RMR MET і сумарне навантаження в MET-хвилинах
+    met_avg = models.FloatField(validators=[MinValueValidator(0.0)])
+    met_minutes = models.FloatField(validators=[MinValueValidator(0.0)])
+    # Частка від оціночного VO2max (0..1+)
+    relative_intensity = models.FloatField(validators=[MinValueValidator(0.0)])
+    moving_time_sec = models.FloatField(validators=[MinValueValidator(0.0)])
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    engine_version = models.SmallIntegerField()
+    stale = models.BooleanField(default=False)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stale'], name='activityestimate_stale_idx'),
+        ]
+
+    def __str__(self):
+        return f"Estimate for activity {self.activity_id}: {self.calories_kcal:.0f} kcal"
+
+
+class RouteGroup(models.Model):
+    """Активності одного виду, пройдені тим самим маршрутом (routes.py)."""
+    activity_type = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Route {self.id} ({self.activity_type})"
+
+
+class RouteSketch(models.Model):
+    """
+    Відбиток маршруту активності: MinHash-підпис множини geohash-клітинок треку
+    і трек, перевибраний до сталої кількості точок, для перевірки відстанню Фреше.
+    """
+    activity = models.OneToOneField(Activity, on_delete=models.CASCADE, primary_key=True, related_name="route")
+    group = models.ForeignKey(RouteGroup, on_delete=models.SET_NULL, null=True, blank=True, related_name="members")
+    # uint64 x ROUTE_SIGNATURE_SIZE і float32 (lat, lon) x ROUTE_PATH_POINTS
+    signature = models.BinaryField()
+    path = models.BinaryField()
+    length_m = models.FloatField(validators=[MinValueValidator(0.0)])
+    engine_version = models.SmallIntegerField()
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Route sketch for activity {self.activity_id}"
+
+
+class RouteBucket(models.Model):
+    """LSH-кошик: хеш однієї смуги MinHash-підпису. Кандидати - активності зі спільним кошиком."""
+    activity = models.ForeignKey(Activity, on_delete=models.CASCADE, related_name="+")
+    key = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key'], name='routebucket_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"Bucket {self.key} for activity {self.activity_id}"
+
+
+class BackfillRun(models.Model):
+    """
+    Запуск перерахунку похідних даних (backfill.py). Діапазон id фіксується на
+    старті й ділиться на чанки BackfillChunk; повторний запуск продовжує з
+    незавершених чанків.
+    """
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    min_id = models.BigIntegerField()
+    max_id = models.BigIntegerField()
+    chunk_size = models.IntegerField(validators=[MinValueValidator(1)])
+    rows_processed = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Backfill '{self.name}' #{self.id} ({self.status})"
+
+
+class BackfillChunk(models.Model):
+    """Чекпоінт: діапазон первинних ключів [start_id, end_id) одного запуску."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    run = models.ForeignKey(BackfillRun, on_delete=models.CASCADE, related_name="chunks")
+    start_id = models.BigIntegerField()
+    end_id = models.BigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    rows = models.BigIntegerField(default=0)
+    seconds = models.FloatField(default=0.0)
+    error = models.TextField(blank=True, default='')
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('run', 'start_id')
+        indexes = [
+            models.Index(fields=['run', 'status'], name='backfillchunk_run_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Chunk [{self.start_id}, {self.end_id}) of run {self.run_id} ({self.status})"
+
+
+class UserRecords(models.Model):
+    """
+    Особисті рекорди і тренди користувача. Оновлюються інкрементально при
+    кожному add/update/delete активності, тож читання не залежить від
+    кількості активностей. Ряди зберігаються компактно як масиви float32.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="records")
+
+    # {'fastest_5k': {'value': ..., 'activity_id': ..., 'date': ...}, ...}
+    records = models.JSONField(default=dict)
+
+    # Денні ряди за останні N днів, що закінчуються series_end (включно)
+    series_end = models.DateField(null=True, blank=True)
+    daily_distance = models.BinaryField(default=bytes)
+    daily_duration = models.BinaryField(default=bytes)
+    daily_load = models.BinaryField(default=bytes)
+    # Експоненційно згладжене навантаження: fitness (42 дні) і fatigue (7 днів)
+    fitness = models.BinaryField(default=bytes)
+    fatigue = models.BinaryField(default=bytes)
+    # Стан EWMA на день перед початком ряду
+    fitness_seed = models.FloatField(default=0.0)
+    fatigue_seed = models.FloatField(default=0.0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Records for user {self.user_id}"
+
+
+class HeatmapTile(models.Model):
+    """
+    Щільність точок треків у тайлі (zoom, x, y) веб-меркатора.
+    user = NULL - глобальна мапа платформи, інакше - персональна.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name="heatmap_tiles"
+    )
+    zoom = models.SmallIntegerField(validators=[MinValueValidator(0)])
+    x = models.IntegerField(validators=[MinValueValidator(0)])
+    y = models.IntegerField(validators=[MinValueValidator(0)])
+
+    # zlib-стиснутий масив int32 розміром 256x256 (знаковий: див. heatmap.py)
+    density = models.BinaryField()
+    point_count = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'zoom', 'x', 'y'],
+                condition=models.Q(user__isnull=False),
+                name='heatmaptile_user_zxy_unique'
+            ),
+            models.UniqueConstraint(
+                fields=['zoom', 'x', 'y'],
+                condition=models.Q(user__isnull=True),
+                name='heatmaptile_global_zxy_unique'
+            ),
+        ]
+
+    def __str__(self):
+        scope = f"user {self.user_id}" if self.user_id else "global"
+        return f"Heatmap tile {self.zoom}/{self.x}/{self.y} ({scope})"
+
+
+class Challenge(models.Model):
+    """
+    Челендж ("проїхати 500 км у березні"): мета для кожного учасника (goal) і,
+    за бажанням, спільна мета групи (group_goal). Зараховуються активності
+    вказаного виду (або будь-якого) зі стартом у [starts_at, ends_at).
+    Лічильники учасників і сумарний прогрес ведуть репозиторії (challenges.py).
+    """
+    METRIC_CHOICES = [
+        ('distance_m', 'Distance (m)'),
+        ('duration_sec', 'Duration (s)'),
+        ('elevation_gain_m', 'Elevation gain (m)'),
+        ('activities', 'Activity count'),
+    ]
+
+    title = models.CharField(max_length=255)
+    description = models.TextField(blank=True, default='')
+    activity_type = models.CharField(max_length=50, choices=Activity.ACTIVITY_TYPES, blank=True, null=True)
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES, default='distance_m')
+    goal = models.FloatField(validators=[MinValueValidator(0.0)])
+    group_goal = models.FloatField(blank=True, null=True, validators=[MinValueValidator(0.0)])
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="challenges_created"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Денормалізовані підсумки: participant_count - при вступі/виході,
+    # completed_count і total_progress агрегує snapshot_challenges (challenges.refresh_totals)
+    participant_count = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    completed_count = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    total_progress = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(ends_at__gt=F('starts_at')),
+                name='challenge_ends_after_start'
+            ),
+            models.CheckConstraint(
+                check=models.Q(goal__gt=0),
+                name='challenge_goal_positive'
+            ),
+        ]
+        indexes = [
+            # Челенджі, у вікно яких потрапляє активність
+            models.Index(fields=['starts_at', 'ends_at'], name='challenge_window_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
+class ChallengeParticipant(models.Model):
+    """Учасник челенджу з прогресом, що оновлюється інкрементально при записі активностей."""
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name="participants")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="challenge_entries")
+    progress = models.FloatField(default=0.0)
+    activity_count = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    joined_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['challenge', 'user'], name='challengeparticipant_unique'),
+        ]
+        indexes = [
+            # Таблиця лідерів - впорядкований скан індексу (keyset), без сортування на запит
+            models.Index(fields=['challenge', '-progress', 'id'], name='challenge_standings_idx'),
+            # Участі користувача (інкрементальне оновлення з запису активності)
+            models.Index(fields=['user', 'challenge'], name='challengeparticipant_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"User {self.user_id} in challenge {self.challenge_id}: {self.progress:.0f}"
+
+
+class ChallengeSnapshot(models.Model):
+    """Знімок таблиці лідерів на момент taken_at (історичні таблиці; final - після завершення)."""
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name="snapshots")
+    taken_at = models.DateTimeField()
+    participant_count = models.IntegerField(default=0)
+    total_progress = models.FloatField(default=0.0)
+    final = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['challenge', '-taken_at'], name='challengesnapshot_taken_idx'),
+        ]
+
+    def __str__(self):
+        return f"Standings of challenge {self.challenge_id} at {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class ChallengeStandingEntry(models.Model):
+    """Рядок знімка: місце і прогрес учасника."""
+    snapshot = models.ForeignKey(ChallengeSnapshot, on_delete=models.CASCADE, related_name="entries")
+    rank = models.IntegerField(validators=[MinValueValidator(1)])
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    progress = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['snapshot', 'rank'], name='challengestanding_snapshot_rank_unique'),
+        ]
+        indexes = [
+            # Місце користувача в останньому знімку ("me" у таблиці лідерів)
+            models.Index(fields=['snapshot', 'user'], name='challengestanding_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.rank} user {self.user_id} in snapshot {self.snapshot_id}"
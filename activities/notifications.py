@@ -0,0 +1,178 @@
+"""
+Сповіщення про kudos, коментарі, відповіді та нових підписників.
+
+Джерело - outbox (споживач 'notifications'). Кожен пакет подій групується в
+пам'яті за (отримувач, тип, ціль), і на групу припадає одне оновлення
+відкритого (непрочитаного і не старшого за NOTIFICATION_GROUP_WINDOW_HOURS)
+рядка Notification або одна вставка. Тисяча kudos на популярну активність у
+пакеті - це один UPDATE, а не тисяча рядків. Зміщення споживача блокується і
+підтверджується в тій самій транзакції, тож кожна подія врахована рівно раз,
+скільки б fanout_notifications не працювало паралельно.
+"""
+import datetime
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import outbox
+from .models import Activity, Comment, Notification
+
+CONSUMER = 'notifications'
+SOURCE_MODELS = ('kudos', 'comment', 'follower')
+MAX_ACTORS = 3
+
+# (recipient_id, kind, target_key)
+GroupKey = Tuple[int, str, str]
+
+
+def group_window() -> datetime.timedelta:
+    return datetime.timedelta(hours=getattr(settings, 'NOTIFICATION_GROUP_WINDOW_HOURS', 24))
+
+
+# --- Групування пакета подій ---
+
+def _event_time(event: dict) -> datetime.datetime:
+    value = (event['payload'] or {}).get('created_at') or event['created_at']
+    return parse_datetime(value) if isinstance(value, str) else value
+
+
+def collect_groups(events: List[dict]) -> Dict[GroupKey, dict]:
+    """Події create -> групи {ключ: {'activity_id', 'actor_ids', 'count', 'latest_at'}}."""
+    created = [e for e in events if e['op'] == outbox.CREATE and e['payload']]
+    activity_ids = {e['payload']['activity_id'] for e in created if e['model'] in ('kudos', 'comment')}
+    parent_ids = {e['payload']['parent_comment_id'] for e in created
+                  if e['model'] == 'comment' and e['payload'].get('parent_comment_id')}
+    # Власники активностей і автори батьківських коментарів - по одному запиту на пакет
+    activity_owner = dict(Activity.objects.filter(id__in=activity_ids).values_list('id', 'user_id'))
+    comment_author = dict(Comment.objects.filter(id__in=parent_ids).values_list('id', 'user_id'))
+
+    groups: Dict[GroupKey, dict] = OrderedDict()
+    for event in created:
+        payload = event['payload']
+        activity_id = None
+        if event['model'] == 'kudos':
+            activity_id = payload['activity_id']
+            recipient, kind, target = activity_owner.get(activity_id), 'kudos', f"activity:{activity_id}"
+            actor = payload['user_id']
+        elif event['model'] == 'comment':
+            activity_id = payload['activity_id']
+            actor = payload['user_id']
+            parent_id = payload.get('parent_comment_id')
+            if parent_id:
+                recipient, kind, target = comment_author.get(parent_id), 'reply', f"comment:{parent_id}"
+            else:
+                recipient, kind, target = activity_owner.get(activity_id), 'comment', f"activity:{activity_id}"
+        elif event['model'] == 'follower':
+            recipient, kind, target = payload['followee_id'], 'follow', f"user:{payload['followee_id']}"
+            actor = payload['follower_id']
+        else:
+            continue
+        if recipient is None or recipient == actor:
+            continue
+
+        group = groups.setdefault((recipient, kind, target), {
+            'activity_id': activity_id, 'actor_ids': [], 'count': 0, 'latest_at': None,
+        })
+        group['count'] += 1
+        if actor in group['actor_ids']:
+            group['actor_ids'].remove(actor)
+        group['actor_ids'].insert(0, actor)
+        event_time = _event_time(event)
+        if group['latest_at'] is None or event_time > group['latest_at']:
+            group['latest_at'] = event_time
+    return groups
+
+
+def apply_groups(groups: Dict[GroupKey, dict]) -> int:
+    """Додає групи пакета до відкритих сповіщень (або створює нові). Повертає кількість рядків."""
+    if not groups:
+        return 0
+    actor_ids = {actor for group in groups.values() for actor in group['actor_ids'][:MAX_ACTORS]}
+    usernames = dict(User.objects.filter(id__in=actor_ids).values_list('id', 'username'))
+
+    cutoff = timezone.now() - group_window()
+    open_rows = Notification.objects.select_for_update().filter(
+        recipient_id__in={key[0] for key in groups},
+        target_key__in={key[2] for key in groups},
+        read_at__isnull=True,
+        latest_at__gte=cutoff,
+    )
+    existing = {(n.recipient_id, n.kind, n.target_key): n for n in open_rows}
+
+    to_update, to_create = [], []
+    for key, group in groups.items():
+        actors = [{'id': a, 'username': usernames.get(a, '')} for a in group['actor_ids'][:MAX_ACTORS]]
+        notification = existing.get(key)
+        if notification is None:
+            to_create.append(Notification(
+                recipient_id=key[0], kind=key[1], target_key=key[2], activity_id=group['activity_id'],
+                count=group['count'], actors=actors, latest_at=group['latest_at'],
+            ))
+            continue
+        previous = [a for a in notification.actors if a['id'] not in group['actor_ids']]
+        notification.actors = (actors + previous)[:MAX_ACTORS]
+        notification.count += group['count']
+        notification.latest_at = max(notification.latest_at, group['latest_at'])
+        to_update.append(notification)
+
+    Notification.objects.bulk_update(to_update, ['actors', 'count', 'latest_at'])
+    Notification.objects.bulk_create(to_create)
+    return len(to_update) + len(to_create)
+
+
+def process_batch(batch_size: int = 1000) -> int:
+    """
+    Один пакет з outbox. Повертає кількість оброблених подій.
+    Зміщення читається під блокуванням у транзакції пакета: паралельний запуск
+    fanout_notifications чекає на коміт і бере вже наступні події.
+    """
+    outbox.sequence()
+    with transaction.atomic():
+        events = outbox.fetch_after(outbox.lock_offset(CONSUMER), limit=batch_size, models=SOURCE_MODELS)
+        if not events:
+            return 0
+        apply_groups(collect_groups(events))
+        outbox.ack(CONSUMER, events[-1]['seq'])
+    return len(events)
+
+
+def process_pending(batch_size: int = 1000) -> int:
+    processed = 0
+    while True:
+        count = process_batch(batch_size)
+        processed += count
+        if count < batch_size:
+            return processed
+
+
+# --- Читання ---
+
+def summary(notification: Notification) -> str:
+    """'alice, bob and 10 others gave kudos to your activity'."""
+    names = [actor['username'] for actor in notification.actors]
+    who = ', '.join(names) or 'Someone'
+    others = notification.count - len(names)
+    if others > 0:
+        who = f"{who} and {others} others"
+    return {
+        'kudos': f"{who} gave kudos to your activity",
+        'comment': f"{who} commented on your activity",
+        'reply': f"{who} replied to your comment",
+        'follow': f"{who} started following you",
+    }[notification.kind]
+
+
+def unread_count(user_id: int) -> int:
+    return Notification.objects.filter(recipient_id=user_id, read_at__isnull=True).count()
+
+
+def mark_read(user_id: int, ids: Optional[List[int]] = None) -> int:
+    queryset = Notification.objects.filter(recipient_id=user_id, read_at__isnull=True)
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    return queryset.update(read_at=timezone.now())
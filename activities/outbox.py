@@ -0,0 +1,194 @@
+"""
+Change data capture через транзакційний outbox.
+
+Репозиторії DataAccessLayer після кожного add/update/delete викликають record*()
+у тій самій транзакції, що й сам запис: подія з'являється тоді й лише тоді,
+коли зміна закомічена. Споживачі (склад аналітики, сповіщення) читають події
+за зростанням seq через fetch_batch()/ack() або команду tail_outbox, зберігаючи
+своє зміщення в OutboxConsumer, - без повних пересканувань таблиць.
+
+id видається при вставці, а коміт може статися набагато пізніше, тож порядок id
+не є порядком комітів: довга транзакція закомітила б подію з id, нижчим за вже
+прочитане зміщення. Тому споживачі читають не за id, а за seq, який sequence()
+видає вже закоміченим подіям під блокуванням рядка секвенсора: видачі йдуть
+одна за одною, і видимі споживачам seq завжди утворюють суцільний префікс.
+
+Видалення користувача - одна подія 'delete' для user: його активності,
+коментарі, kudos і підписки видаляються каскадом (deletion.py) без окремих подій.
+"""
+import datetime
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import OutboxEvent, OutboxConsumer
+
+CREATE, UPDATE, DELETE = 'create', 'update', 'delete'
+
+# Службовий рядок OutboxConsumer: блокування секвенсора і останній виданий seq
+SEQUENCER = '~sequencer'
+
+# Поля, що ніколи не потрапляють у події
+SECRET_FIELDS = {'user': ('password',)}
+
+
+def enabled() -> bool:
+    return getattr(settings, 'OUTBOX_ENABLED', True)
+
+
+def model_label(model) -> str:
+    return model._meta.model_name
+
+
+def row_payload(model, row: dict) -> dict:
+    for name in SECRET_FIELDS.get(model_label(model), ()):
+        row.pop(name, None)
+    return row
+
+
+# --- Запис подій (викликається з репозиторіїв) ---
+
+def record(model, pk, op: str, payload: Optional[dict] = None) -> None:
+    """Одна подія; для create/update без payload рядок читається з БД."""
+    if not enabled():
+        return
+    if payload is None and op != DELETE:
+        row = model.objects.filter(pk=pk).values().first()
+        if row is None:
+            return
+        payload = row_payload(model, row)
+    OutboxEvent.objects.create(model=model_label(model), object_id=str(pk), op=op, payload=payload)
+
+
+def record_queryset(queryset, op: str) -> int:
+    """Події для всіх рядків queryset одним INSERT (після update або перед delete)."""
+    if not enabled():
+        return 0
+    model = queryset.model
+    label = model_label(model)
+    if op == DELETE:
+        events = [
+            OutboxEvent(model=label, object_id=str(pk), op=op)
+            for pk in queryset.values_list('pk', flat=True)
+        ]
+    else:
+        events = [
+            OutboxEvent(model=label, object_id=str(row[model._meta.pk.attname]), op=op, payload=row_payload(model, row))
+            for row in queryset.values()
+        ]
+    OutboxEvent.objects.bulk_create(events, batch_size=1000)
+    return len(events)
+
+
+# --- Порядок комітів ---
+
+def sequence(limit: int = 5000) -> int:
+    """
+    Видає seq закоміченим подіям, що його ще не мають (за зростанням id).
+    Кожен пакет - коротка транзакція під блокуванням рядка секвенсора: наступна
+    видача чекає на коміт попередньої і бачить усі події, закомічені до неї.
+    Повертає кількість упорядкованих подій.
+    """
+    total = 0
+    while True:
+        with transaction.atomic():
+            OutboxConsumer.objects.get_or_create(name=SEQUENCER)
+            state = OutboxConsumer.objects.select_for_update().get(name=SEQUENCER)
+            events = list(OutboxEvent.objects.filter(seq__isnull=True).order_by('id').only('id')[:limit])
+            for position, event in enumerate(events, start=state.last_event_id + 1):
+                event.seq = position
+            if events:
+                OutboxEvent.objects.bulk_update(events, ['seq'], batch_size=1000)
+                state.last_event_id += len(events)
+                state.save(update_fields=['last_event_id', 'updated_at'])
+        total += len(events)
+        if len(events) < limit:
+            return total
+
+
+# --- Читання споживачами ---
+
+def get_offset(consumer: str) -> int:
+    state, _ = OutboxConsumer.objects.get_or_create(name=consumer)
+    return state.last_event_id
+
+
+def lock_offset(consumer: str) -> int:
+    """Зміщення споживача під блокуванням до кінця транзакції (паралельні запуски чекають)."""
+    OutboxConsumer.objects.get_or_create(name=consumer)
+    return OutboxConsumer.objects.select_for_update().get(name=consumer).last_event_id
+
+
+def fetch_after(offset: int, limit: int = 500, models: Optional[Iterable[str]] = None) -> List[dict]:
+    """Упорядковані події з seq після offset."""
+    queryset = OutboxEvent.objects.filter(seq__gt=offset)
+    if models:
+        queryset = queryset.filter(model__in=list(models))
+    return list(
+        queryset.order_by('seq').values('seq', 'id', 'model', 'object_id', 'op', 'payload', 'created_at')[:limit]
+    )
+
+
+def fetch_batch(consumer: str, limit: int = 500, models: Optional[Iterable[str]] = None) -> List[dict]:
+    """Наступні події після зміщення споживача (зміщення не рухається до ack())."""
+    sequence()
+    return fetch_after(get_offset(consumer), limit, models)
+
+
+def ack(consumer: str, last_seq: int) -> None:
+    """Підтверджує доставку всіх подій до last_seq включно (зміщення лише зростає)."""
+    OutboxConsumer.objects.get_or_create(name=consumer)
+    OutboxConsumer.objects.filter(name=consumer, last_event_id__lt=last_seq) \
+        .update(last_event_id=last_seq, updated_at=timezone.now())
+
+
+def min_offset() -> int:
+    """Зміщення найповільнішого споживача: події з seq до нього прочитали всі."""
+    return OutboxConsumer.objects.exclude(name=SEQUENCER) \
+        .aggregate(offset=Min('last_event_id'))['offset'] or 0
+
+
+# --- Стиснення ---
+
+def compact(batch_size: int = 5000, tombstone_days: Optional[int] = None) -> dict:
+    """
+    Лишає лише останню подію кожного об'єкта (payload - повний рядок, тож
+    проміжні update нічого не додають). Прибираються лише події, які вже
+    прочитали всі споживачі: інакше, наприклад, create коментаря, зміненого
+    до розсилки, зник би раніше, ніж його побачили сповіщення. Видалення
+    (tombstone) прибираються через tombstone_days на тій самій умові.
+    """
+    if tombstone_days is None:
+        tombstone_days = getattr(settings, 'OUTBOX_TOMBSTONE_DAYS', 7)
+    table = connection.ops.quote_name(OutboxEvent._meta.db_table)
+    report = {'superseded': 0, 'tombstones': 0}
+    read_by_all = min_offset()
+
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE id IN ("
+                f"SELECT o.id FROM {table} o WHERE o.seq <= %s AND EXISTS ("
+                f"SELECT 1 FROM {table} n WHERE n.model = o.model AND n.object_id = o.object_id "
+                f"AND (n.seq > o.seq OR n.seq IS NULL)) LIMIT %s)",
+                [read_by_all, batch_size]
+            )
+            deleted = cursor.rowcount
+        report['superseded'] += deleted
+        if deleted < batch_size:
+            break
+
+    cutoff = timezone.now() - datetime.timedelta(days=tombstone_days)
+    while True:
+        ids = list(
+            OutboxEvent.objects.filter(op=DELETE, seq__lte=read_by_all, created_at__lt=cutoff)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        OutboxEvent.objects.filter(id__in=ids).delete()
+        report['tombstones'] += len(ids)
+    return report
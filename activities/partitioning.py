@@ -0,0 +1,389 @@
+"""
+Помісячне партиціонування ActivityPoint (PostgreSQL) та політика зберігання треків.
+
+Батьківська таблиця партиціонується за RANGE (recorded_at) з первинним ключем
+(id, recorded_at): одна партиція на календарний місяць плюс DEFAULT-партиція
+для точок місяців, партицій яких ще немає (запізнілі завантаження старих
+треків). Коли партиція місяця створюється, його рядки переносяться з DEFAULT.
+Видалення старих даних - це DROP TABLE партиції, а не каскад рядок за рядком;
+рядки DEFAULT-партиції старіші за межу видаляються пакетами.
+Усе, що видаляє політика, віднімається від теплових карт у тій самій транзакції.
+На інших СУБД (SQLite у розробці) та сама політика виконується пакетними DELETE.
+"""
+import datetime
+import re
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import heatmap, versions
+from .models import Activity, ActivityPoint, ActivityPointRetentionLog
+
+PARENT_TABLE = ActivityPoint._meta.db_table
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+PARTITION_RE = re.compile(rf"^{re.escape(PARENT_TABLE)}_y(\d{{4}})m(\d{{2}})$")
+
+DEFAULT_RETENTION = {
+    'FULL_RESOLUTION_MONTHS': 6,
+    'KEEP_EVERY_NTH': 5,
+    'DROP_AFTER_MONTHS': None,
+    'PARTITIONS_AHEAD': 3,
+}
+DELETE_BATCH_SIZE = 10000
+# Активностей на один DELETE при проріджуванні (обмежує RETURNING у пам'яті)
+DOWNSAMPLE_ACTIVITY_BATCH = 1000
+
+
+def retention_policy() -> dict:
+    return {**DEFAULT_RETENTION, **getattr(settings, 'ACTIVITY_POINT_RETENTION', {})}
+
+
+def is_postgres() -> bool:
+    return connection.vendor == 'postgresql'
+
+
+# --- Календарна арифметика ---
+
+def add_months(year: int, month: int, delta: int) -> Tuple[int, int]:
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def month_start(year: int, month: int) -> datetime.datetime:
+    return datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+
+
+def current_month() -> Tuple[int, int]:
+    now = timezone.now()
+    return now.year, now.month
+
+
+def partition_name(year: int, month: int) -> str:
+    return f"{PARENT_TABLE}_y{year}m{month:02d}"
+
+
+# --- PostgreSQL: керування партиціями ---
+
+def is_partitioned() -> bool:
+    if not is_postgres():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s",
+            [PARENT_TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions() -> List[Tuple[int, int, str]]:
+    """Місячні партиції як (year, month, table_name), відсортовані за часом."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [PARENT_TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions.append((int(match.group(1)), int(match.group(2)), name))
+    return sorted(partitions)
+
+
+def has_default_partition() -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s AND c.relname = %s",
+            [PARENT_TABLE, DEFAULT_PARTITION]
+        )
+        return cursor.fetchone() is not None
+
+
+def create_partition(year: int, month: int) -> bool:
+    """
+    Створює партицію за місяць; False, якщо вона вже існувала.
+    Якщо DEFAULT-партиція вже тримає рядки цього місяця, PostgreSQL не дасть
+    створити партицію поверх них: DEFAULT від'єднується, рядки місяця
+    переносяться в нову партицію, і DEFAULT приєднується назад (одна транзакція).
+    """
+    name = partition_name(year, month)
+    existing = {p[2] for p in list_partitions()}
+    if name in existing:
+        return False
+    next_year, next_month = add_months(year, month, 1)
+    bounds = [month_start(year, month), month_start(next_year, next_month)]
+    qn = connection.ops.quote_name
+    parent, default = qn(PARENT_TABLE), qn(DEFAULT_PARTITION)
+    with transaction.atomic(), connection.cursor() as cursor:
+        stranded = False
+        if has_default_partition():
+            cursor.execute(f"SELECT 1 FROM {default} WHERE recorded_at >= %s AND recorded_at < %s LIMIT 1", bounds)
+            stranded = cursor.fetchone() is not None
+        if stranded:
+            cursor.execute(f"ALTER TABLE {parent} DETACH PARTITION {default}")
+        cursor.execute(f"CREATE TABLE {qn(name)} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)", bounds)
+        if stranded:
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {default} WHERE recorded_at >= %s AND recorded_at < %s RETURNING *) "
+                f"INSERT INTO {parent} SELECT * FROM moved",
+                bounds
+            )
+            cursor.execute(f"ALTER TABLE {parent} ATTACH PARTITION {default} DEFAULT")
+    return True
+
+
+def ensure_partitions(months_ahead: Optional[int] = None) -> List[str]:
+    """Гарантує наявність партицій з поточного місяця на `months_ahead` вперед."""
+    if months_ahead is None:
+        months_ahead = retention_policy()['PARTITIONS_AHEAD']
+    year, month = current_month()
+    created = []
+    for delta in range(months_ahead + 1):
+        y, m = add_months(year, month, delta)
+        if create_partition(y, m):
+            created.append(partition_name(y, m))
+    return created
+
+
+# Одноколонкові індекси звичайної таблиці, які переносяться на партиціоновану
+CARRIED_INDEX_COLUMNS = ('recorded_at', 'activity_id')
+
+
+def _carried_indexes(cursor) -> List[Tuple[str, str]]:
+    """[(ім'я індексу, колонка)] для CARRIED_INDEX_COLUMNS; відсутній індекс отримує ім'я за колонкою."""
+    found = {}
+    for name, info in connection.introspection.get_constraints(cursor, PARENT_TABLE).items():
+        columns = info['columns']
+        if info['index'] and not info['unique'] and not info['primary_key'] and len(columns) == 1:
+            found.setdefault(columns[0], name)
+    return [(found.get(column, f"{PARENT_TABLE}_{column}_idx"), column) for column in CARRIED_INDEX_COLUMNS]
+
+
+def convert_to_partitioned() -> int:
+    """
+    Одноразове перетворення звичайної таблиці ActivityPoint на партиціоновану.
+    Дані копіюються у нові партиції, стара таблиця видаляється.
+    Повертає кількість перенесених рядків.
+    Первинний ключ (id, recorded_at) вимагає часу в кожної точки, тож точки
+    без recorded_at треба виправити або видалити до перетворення (ValueError).
+    """
+    if not is_postgres():
+        raise NotImplementedError("Партиціонування підтримується лише на PostgreSQL")
+    if is_partitioned():
+        return 0
+
+    qn = connection.ops.quote_name
+    legacy = f"{PARENT_TABLE}_legacy"
+    activity_table = Activity._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {qn(PARENT_TABLE)} IN ACCESS EXCLUSIVE MODE")
+        carried = _carried_indexes(cursor)
+        cursor.execute(f"SELECT COUNT(*) FROM {qn(PARENT_TABLE)} WHERE recorded_at IS NULL")
+        untimed = cursor.fetchone()[0]
+        if untimed:
+            raise ValueError(
+                f"{untimed} activity points have no recorded_at; the partitioned table keys rows by "
+                f"(id, recorded_at), so fix or delete them before converting."
+            )
+        cursor.execute(f"ALTER TABLE {qn(PARENT_TABLE)} RENAME TO {qn(legacy)}")
+        cursor.execute(
+            f"CREATE TABLE {qn(PARENT_TABLE)} "
+            f"(LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE (recorded_at)"
+        )
+        # Первинний ключ партиціонованої таблиці мусить містити ключ партиціонування;
+        # його індекс починається з id, тож він же обслуговує пошук точки за id
+        cursor.execute(
+            f"ALTER TABLE {qn(PARENT_TABLE)} ADD CONSTRAINT {qn(PARENT_TABLE + '_pkey')} "
+            f"PRIMARY KEY (id, recorded_at)"
+        )
+        cursor.execute(
+            f"CREATE UNIQUE INDEX {qn(PARENT_TABLE + '_activity_recorded_uniq')} "
+            f"ON {qn(PARENT_TABLE)} (activity_id, recorded_at)"
+        )
+        # Індекси за recorded_at і activity_id - на батьківській таблиці, тож їх
+        # успадковує кожна партиція (і створена пізніше); імена ті самі, що знає Django
+        for name, column in carried:
+            cursor.execute(f"DROP INDEX IF EXISTS {qn(name)}")
+            cursor.execute(f"CREATE INDEX {qn(name)} ON {qn(PARENT_TABLE)} ({qn(column)})")
+        cursor.execute(
+            f"ALTER TABLE {qn(PARENT_TABLE)} ADD CONSTRAINT {qn(PARENT_TABLE + '_activity_fk')} "
+            f"FOREIGN KEY (activity_id) REFERENCES {qn(activity_table)} (id) "
+            f"DEFERRABLE INITIALLY DEFERRED"
+        )
+        cursor.execute(
+            f"CREATE TABLE {qn(DEFAULT_PARTITION)} PARTITION OF {qn(PARENT_TABLE)} DEFAULT"
+        )
+
+        cursor.execute(f"SELECT MIN(recorded_at), MAX(recorded_at) FROM {qn(legacy)}")
+        first, last = cursor.fetchone()
+        year, month = (first.year, first.month) if first else current_month()
+        last_year, last_month = (last.year, last.month) if last else current_month()
+        while (year, month) <= (last_year, last_month):
+            create_partition(year, month)
+            year, month = add_months(year, month, 1)
+        ensure_partitions()
+
+        cursor.execute(f"INSERT INTO {qn(PARENT_TABLE)} SELECT * FROM {qn(legacy)}")
+        moved = cursor.rowcount
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+            f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {qn(legacy)}), false)",
+            [PARENT_TABLE]
+        )
+        cursor.execute(f"DROP TABLE {qn(legacy)}")
+    return moved
+
+
+# --- Політика зберігання ---
+
+def _delete_in_batches(where_sql: str, params: list, table: str = PARENT_TABLE) -> int:
+    qn = connection.ops.quote_name
+    total = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {qn(table)} WHERE id IN ("
+                f"SELECT id FROM {qn(table)} WHERE {where_sql} LIMIT %s) RETURNING activity_id, lat, lon",
+                params + [DELETE_BATCH_SIZE]
+            )
+            rows = cursor.fetchall()
+            heatmap.remove_rows(rows)
+            deleted = len(rows)
+            if deleted:
+                versions.bump(ActivityPoint)
+        total += deleted
+        if deleted < DELETE_BATCH_SIZE:
+            return total
+
+
+def _forget_partition(cursor, table: str):
+    """Віднімає всі точки партиції від теплових карт перед DROP (keyset-пакетами за id)."""
+    qn = connection.ops.quote_name
+    last_id = 0
+    while True:
+        cursor.execute(
+            f"SELECT id, activity_id, lat, lon FROM {qn(table)} WHERE id > %s ORDER BY id LIMIT %s",
+            [last_id, DELETE_BATCH_SIZE]
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        heatmap.remove_rows(row[1:] for row in rows)
+        last_id = rows[-1][0]
+
+
+def drop_months_before(year: int, month: int) -> List[str]:
+    """
+    Видаляє всі точки, записані до початку вказаного місяця.
+    На PostgreSQL - DROP TABLE цілих партицій (і пакетні DELETE старих рядків
+    DEFAULT-партиції), інакше - пакетні DELETE.
+    """
+    dropped = []
+    if is_partitioned():
+        qn = connection.ops.quote_name
+        for y, m, name in list_partitions():
+            if (y, m) < (year, month):
+                with transaction.atomic(), connection.cursor() as cursor:
+                    _forget_partition(cursor, name)
+                    cursor.execute(f"DROP TABLE {qn(name)}")
+                    versions.bump(ActivityPoint)
+                dropped.append(name)
+        if has_default_partition():
+            deleted = _delete_in_batches("recorded_at < %s", [month_start(year, month)], DEFAULT_PARTITION)
+            if deleted:
+                dropped.append(f"{deleted} rows before {year}-{month:02d} from {DEFAULT_PARTITION}")
+    else:
+        deleted = _delete_in_batches("recorded_at < %s", [month_start(year, month)])
+        if deleted:
+            dropped.append(f"{deleted} rows before {year}-{month:02d}")
+    ActivityPointRetentionLog.objects.filter(year__lt=year).delete()
+    ActivityPointRetentionLog.objects.filter(year=year, month__lt=month).delete()
+    return dropped
+
+
+def downsample_month(year: int, month: int, keep_every: int) -> int:
+    """
+    Проріджує трек за місяць: у кожній активності лишається кожна `keep_every`-та
+    точка (перша завжди зберігається). Повертає кількість видалених рядків.
+    """
+    if keep_every <= 1:
+        return 0
+    qn = connection.ops.quote_name
+    next_year, next_month = add_months(year, month, 1)
+    # На партиціонованій таблиці звертаємось напряму до партиції місяця
+    table = PARENT_TABLE
+    if is_partitioned() and partition_name(year, month) in {p[2] for p in list_partitions()}:
+        table = partition_name(year, month)
+    bounds = [month_start(year, month), month_start(next_year, next_month)]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT MIN(activity_id), MAX(activity_id) FROM {qn(table)} WHERE recorded_at >= %s AND recorded_at < %s",
+            bounds
+        )
+        first, last = cursor.fetchone()
+        deleted = 0
+        # Нумерація йде в межах активності, тож діапазони activity_id не змінюють, які точки лишаються
+        for low in range(first or 0, (last or -1) + 1, DOWNSAMPLE_ACTIVITY_BATCH):
+            cursor.execute(
+                f"DELETE FROM {qn(table)} WHERE id IN ("
+                f"  SELECT id FROM ("
+                f"    SELECT id, ROW_NUMBER() OVER (PARTITION BY activity_id ORDER BY recorded_at, id) AS rn"
+                f"    FROM {qn(table)} WHERE recorded_at >= %s AND recorded_at < %s"
+                f"    AND activity_id >= %s AND activity_id < %s"
+                f"  ) numbered WHERE (rn - 1) %% %s <> 0"
+                f") RETURNING activity_id, lat, lon",
+                bounds + [low, low + DOWNSAMPLE_ACTIVITY_BATCH, keep_every]
+            )
+            rows = cursor.fetchall()
+            heatmap.remove_rows(rows)
+            deleted += len(rows)
+        if deleted:
+            versions.bump(ActivityPoint)
+        ActivityPointRetentionLog.objects.create(
+            year=year, month=month, keep_every=keep_every, rows_deleted=deleted
+        )
+    return deleted
+
+
+def apply_retention() -> dict:
+    """
+    Застосовує політику: видаляє місяці старші за DROP_AFTER_MONTHS і проріджує
+    ще не проріджені місяці старші за FULL_RESOLUTION_MONTHS.
+    """
+    policy = retention_policy()
+    year, month = current_month()
+    report = {'dropped': [], 'downsampled': {}}
+
+    oldest_kept = None
+    if policy['DROP_AFTER_MONTHS'] is not None:
+        oldest_kept = add_months(year, month, -policy['DROP_AFTER_MONTHS'])
+        report['dropped'] = drop_months_before(*oldest_kept)
+
+    cutoff = add_months(year, month, -policy['FULL_RESOLUTION_MONTHS'])
+    first = ActivityPoint.objects.filter(recorded_at__isnull=False).order_by('recorded_at') \
+        .values_list('recorded_at', flat=True).first()
+    if first is None:
+        return report
+
+    done = set(ActivityPointRetentionLog.objects.values_list('year', 'month'))
+    y, m = max((first.year, first.month), oldest_kept or (first.year, first.month))
+    while (y, m) < cutoff:
+        next_y, next_m = add_months(y, m, 1)
+        has_points = ActivityPoint.objects.filter(
+            recorded_at__gte=month_start(y, m), recorded_at__lt=month_start(next_y, next_m)
+        ).exists()
+        if has_points and (y, m) not in done:
+            report['downsampled'][f"{y}-{m:02d}"] = downsample_month(y, m, policy['KEEP_EVERY_NTH'])
+        y, m = next_y, next_m
+    return report
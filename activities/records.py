@@ -0,0 +1,313 @@
+"""
+Особисті рекорди і тренди тренувань.
+
+Для кожного користувача тримається один рядок UserRecords: поточні рекорди і
+денні ряди (дистанція, час, навантаження) за останні SERIES_DAYS днів разом з
+EWMA-рядами fitness (42 дні) і fatigue (7 днів). ActivityRepository викликає
+apply_activity_change() при кожному add/update/delete, тому читання - це
+декодування кількох компактних масивів, незалежно від кількості активностей.
+Повний перерахунок з БД потрібен лише коли видалено/змінено активність, що
+тримала рекорд, або для користувача ще немає рядка.
+"""
+import datetime
+import math
+from typing import Optional
+
+import numpy as np
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, FloatField, Q
+from django.utils import timezone
+
+from .models import Activity, UserRecords
+
+SERIES_DAYS = 364  # рівно 52 тижні
+FITNESS_ALPHA = 1 - math.exp(-1 / 42)
+FATIGUE_ALPHA = 1 - math.exp(-1 / 7)
+
+# Навантаження = хвилини * коефіцієнт інтенсивності виду активності
+LOAD_FACTORS = {
+    'running': 1.0,
+    'cycling': 0.8,
+    'walking': 0.4,
+    'swimming': 1.0,
+    'hiking': 0.6,
+    'yoga': 0.3,
+    'gym': 0.6,
+    'crossfit': 1.0,
+    'other': 0.5,
+}
+
+ACTIVITY_FIELDS = (
+    'id', 'user_id', 'activity_type', 'distance_m', 'duration_sec', 'elevation_gain_m', 'start_time'
+)
+
+
+def _projected_time(distance):
+    """Час на дистанцію з середнього темпу активності (не коротшої за цю дистанцію)."""
+    return {
+        'types': ('running',),
+        'filter': Q(distance_m__gte=distance),
+        'expression': ExpressionWrapper(F('duration_sec') * float(distance) / F('distance_m'), output_field=FloatField()),
+        'value': lambda a: a['duration_sec'] * distance / a['distance_m'] if a['distance_m'] >= distance else None,
+        'best': 'min',
+    }
+
+
+def _largest(field, types=None):
+    return {
+        'types': types,
+        'filter': Q(**{f"{field}__gt": 0}),
+        'expression': F(field),
+        'value': lambda a: a[field] if a[field] and a[field] > 0 else None,
+        'best': 'max',
+    }
+
+
+RECORDS = {
+    'fastest_5k': _projected_time(5000),
+    'fastest_10k': _projected_time(10000),
+    'longest_run': _largest('distance_m', ('running',)),
+    'longest_ride': _largest('distance_m', ('cycling',)),
+    'biggest_climb': _largest('elevation_gain_m'),
+    'longest_activity': _largest('duration_sec'),
+}
+
+
+def activity_snapshot(activity_id: int) -> Optional[dict]:
+    """Поля активності, потрібні движку (до або після запису)."""
+    return Activity.objects.filter(id=activity_id).values(*ACTIVITY_FIELDS).first()
+
+
+def activity_day(values: dict) -> datetime.date:
+    start_time = values.get('start_time')
+    return (start_time or timezone.now()).astimezone(datetime.timezone.utc).date()
+
+
+def training_load(values: dict) -> float:
+    return (values['duration_sec'] or 0) / 60.0 * LOAD_FACTORS.get(values['activity_type'], 0.5)
+
+
+def _record_entry(values: dict, value: float) -> dict:
+    return {
+        'value': round(float(value), 2),
+        'activity_id': values['id'],
+        'date': activity_day(values).isoformat(),
+    }
+
+
+def _is_better(name: str, value: float, current: Optional[dict]) -> bool:
+    if current is None:
+        return True
+    if RECORDS[name]['best'] == 'min':
+        return value < current['value']
+    return value > current['value']
+
+
+# --- Компактні ряди ---
+
+def _decode(blob) -> np.ndarray:
+    if not blob:
+        return np.zeros(SERIES_DAYS, dtype=np.float64)
+    return np.frombuffer(bytes(blob), dtype='<f4').astype(np.float64)
+
+
+def _encode(series: np.ndarray) -> bytes:
+    return series.astype('<f4').tobytes()
+
+
+def _ewma(load: np.ndarray, alpha: float, seed: float) -> np.ndarray:
+    out = np.empty_like(load)
+    value = seed
+    for i, daily in enumerate(load):
+        value += alpha * (daily - value)
+        out[i] = value
+    return out
+
+
+class _Series:
+    """Розпаковані масиви UserRecords на час одного оновлення."""
+
+    def __init__(self, summary: UserRecords):
+        self.summary = summary
+        self.end = summary.series_end or timezone.now().date()
+        self.distance = _decode(summary.daily_distance)
+        self.duration = _decode(summary.daily_duration)
+        self.load = _decode(summary.daily_load)
+
+    def shift_to(self, day: datetime.date):
+        """Зсуває вікно вперед; дні, що випадають, згортаються у стартовий стан EWMA."""
+        shift = (day - self.end).days
+        if shift <= 0:
+            return
+        dropped = self.load[:min(shift, SERIES_DAYS)]
+        # Дні між старим кінцем ряду і новим початком без активностей (навантаження 0)
+        gap = max(0, shift - SERIES_DAYS)
+        summary = self.summary
+        summary.fitness_seed = float(_ewma(dropped, FITNESS_ALPHA, summary.fitness_seed)[-1]) * (1 - FITNESS_ALPHA) ** gap
+        summary.fatigue_seed = float(_ewma(dropped, FATIGUE_ALPHA, summary.fatigue_seed)[-1]) * (1 - FATIGUE_ALPHA) ** gap
+        for name in ('distance', 'duration', 'load'):
+            series = getattr(self, name)
+            shifted = np.zeros(SERIES_DAYS, dtype=np.float64)
+            if shift < SERIES_DAYS:
+                shifted[:SERIES_DAYS - shift] = series[shift:]
+            setattr(self, name, shifted)
+        self.end = day
+
+    def add(self, values: dict, sign: int):
+        day = activity_day(values)
+        self.shift_to(day)
+        index = SERIES_DAYS - 1 - (self.end - day).days
+        if index < 0:
+            return  # старше за вікно рядів
+        self.distance[index] += sign * (values['distance_m'] or 0)
+        self.duration[index] += sign * (values['duration_sec'] or 0)
+        self.load[index] += sign * training_load(values)
+
+    def save_into(self, summary: UserRecords):
+        # Похибки float32 при відніманні не повинні давати від'ємних обсягів
+        for series in (self.distance, self.duration, self.load):
+            np.maximum(series, 0, out=series)
+        summary.series_end = self.end
+        summary.daily_distance = _encode(self.distance)
+        summary.daily_duration = _encode(self.duration)
+        summary.daily_load = _encode(self.load)
+        summary.fitness = _encode(_ewma(self.load, FITNESS_ALPHA, summary.fitness_seed))
+        summary.fatigue = _encode(_ewma(self.load, FATIGUE_ALPHA, summary.fatigue_seed))
+
+
+# --- Оновлення ---
+
+def records_from_db(user_id: int) -> dict:
+    """Рекорди з нуля: один запит ORDER BY ... LIMIT 1 на кожен рекорд."""
+    records = {}
+    for name, definition in RECORDS.items():
+        queryset = Activity.objects.filter(definition['filter'], user_id=user_id, deleted_at__isnull=True)
+        if definition['types']:
+            queryset = queryset.filter(activity_type__in=definition['types'])
+        ordering = 'record_value' if definition['best'] == 'min' else '-record_value'
+        best = queryset.annotate(record_value=definition['expression']) \
+            .order_by(ordering, 'id').values(*ACTIVITY_FIELDS, 'record_value').first()
+        if best:
+            records[name] = _record_entry(best, best['record_value'])
+    return records
+
+
+def _locked_summary(user_id: int) -> UserRecords:
+    """
+    Рядок UserRecords під блокуванням до кінця транзакції. Рядок спершу
+    вставляється з ON CONFLICT DO NOTHING: select_for_update().get_or_create()
+    нічого не блокує, поки рядка немає, і два перші записи одного користувача
+    одночасно вставляли б його (IntegrityError у другій транзакції).
+    """
+    UserRecords.objects.bulk_create([UserRecords(user_id=user_id)], ignore_conflicts=True)
+    return UserRecords.objects.select_for_update().get(user_id=user_id)
+
+
+def rebuild_user(user_id: int) -> UserRecords:
+    """Повний перерахунок рекордів і рядів користувача з таблиці Activity."""
+    today = timezone.now().date()
+    window_start = today - datetime.timedelta(days=SERIES_DAYS - 1)
+    with transaction.atomic():
+        summary = _locked_summary(user_id)
+        summary.series_end = today
+        summary.fitness_seed = summary.fatigue_seed = 0.0
+        series = _Series(summary)
+        series.distance[:] = series.duration[:] = series.load[:] = 0
+        recent = Activity.objects.filter(user_id=user_id, deleted_at__isnull=True) \
+            .filter(Q(start_time__date__gte=window_start) | Q(start_time__isnull=True)) \
+            .values(*ACTIVITY_FIELDS)
+        for values in recent:
+            series.add(values, +1)
+        series.save_into(summary)
+        summary.records = records_from_db(user_id)
+        summary.save()
+    return summary
+
+
+def apply_activity_change(old: Optional[dict], new: Optional[dict]) -> None:
+    """
+    Інкрементальне оновлення після запису активності.
+    old - стан до запису (None для add), new - після (None для delete).
+    """
+    values = new or old
+    if values is None:
+        return
+    user_id = values['user_id']
+    with transaction.atomic():
+        summary = _locked_summary(user_id)
+        if summary.series_end is None:
+            # Рядок щойно створено: історія користувача ще не врахована
+            rebuild_user(user_id)
+            return
+
+        series = _Series(summary)
+        records = dict(summary.records)
+        stale_record = False
+        if old:
+            series.add(old, -1)
+            stale_record = any(entry['activity_id'] == old['id'] for entry in records.values())
+        if new:
+            series.add(new, +1)
+            for name, definition in RECORDS.items():
+                if definition['types'] and new['activity_type'] not in definition['types']:
+                    continue
+                value = definition['value'](new)
+                if value is not None and _is_better(name, value, records.get(name)):
+                    records[name] = _record_entry(new, value)
+
+        series.save_into(summary)
+        # Змінено/видалено активність з рекордом - лише тоді перераховуємо рекорди з БД
+        summary.records = records_from_db(user_id) if stale_record else records
+        summary.save()
+
+
+# --- Читання ---
+
+def get_summary(user_id: int) -> UserRecords:
+    return UserRecords.objects.filter(user_id=user_id).first() or rebuild_user(user_id)
+
+
+def get_records(user_id: int) -> dict:
+    return get_summary(user_id).records
+
+
+def get_trends(user_id: int, days: int = 90) -> dict:
+    summary = get_summary(user_id)
+    end = summary.series_end or timezone.now().date()
+    distance, duration, load = (
+        _decode(summary.daily_distance), _decode(summary.daily_duration), _decode(summary.daily_load)
+    )
+    fitness, fatigue = _decode(summary.fitness), _decode(summary.fatigue)
+
+    weekly = []
+    week_sums = np.stack([distance, duration, load]).reshape(3, SERIES_DAYS // 7, 7).sum(axis=2)
+    first_day = end - datetime.timedelta(days=SERIES_DAYS - 1)
+    for week in range(SERIES_DAYS // 7):
+        weekly.append({
+            'week_start': (first_day + datetime.timedelta(days=7 * week)).isoformat(),
+            'distance_m': round(float(week_sums[0, week]), 1),
+            'duration_sec': round(float(week_sums[1, week]), 1),
+            'load': round(float(week_sums[2, week]), 1),
+        })
+
+    # Без нових активностей fitness/fatigue просто згасають до сьогодні
+    idle_days = max(0, (timezone.now().date() - end).days)
+    current_fitness = float(fitness[-1]) * (1 - FITNESS_ALPHA) ** idle_days
+    current_fatigue = float(fatigue[-1]) * (1 - FATIGUE_ALPHA) ** idle_days
+
+    days = max(1, min(days, SERIES_DAYS))
+    return {
+        'series_end': end.isoformat(),
+        'weekly': weekly,
+        'daily': {
+            'start': (end - datetime.timedelta(days=days - 1)).isoformat(),
+            'fitness': [round(float(v), 2) for v in fitness[-days:]],
+            'fatigue': [round(float(v), 2) for v in fatigue[-days:]],
+            'form': [round(float(v), 2) for v in (fitness - fatigue)[-days:]],
+        },
+        'current': {
+            'fitness': round(current_fitness, 2),
+            'fatigue': round(current_fatigue, 2),
+            'form': round(current_fitness - current_fatigue, 2),
+        },
+    }
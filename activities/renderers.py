@@ -0,0 +1,48 @@
+"""
+Компактні формати відповіді (content negotiation через Accept або ?format=).
+
+- ColumnarJSONRenderer: списки як колонки {"count": n, "columns": {"lat": [...], ...}} -
+  для масивів точок треку це в рази менше за список об'єктів.
+- MessagePackRenderer: бінарний MessagePack (потрібен пакет `msgpack`).
+"""
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+def to_columns(rows):
+    """Список однакових словників -> словник колонок."""
+    columns = {}
+    for index, row in enumerate(rows):
+        for key, value in row.items():
+            # Поле, якого не було в попередніх рядках, доповнюється None
+            columns.setdefault(key, [None] * index).append(value)
+        for key, column in columns.items():
+            if len(column) <= index:
+                column.append(None)
+    return {"count": len(rows), "columns": columns}
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = 'application/vnd.fitness.columns+json'
+    format = 'columns'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, list):
+            data = to_columns(data)
+        elif isinstance(data, dict) and isinstance(data.get('results'), list):
+            # Пагіновані відповіді: колонками стають лише 'results'
+            data = {**data, 'results': to_columns(data['results'])}
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        import msgpack
+
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True, default=str)
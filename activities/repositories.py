@@ -1,11 +1,19 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
 from .models import (
-    Activity, Profile, Comment, Kudos, Follower, ActivityPoint, UserMonthlyStats
+    Activity, Profile, Comment, Kudos, Follower, ActivityPoint, UserMonthlyStats, DeletionJob,
+    Challenge, ChallengeParticipant
 )
+from .dedup import FINGERPRINT_FIELDS, compute_fingerprint
+from . import authentication, challenges, deletion, estimation, heatmap, outbox, records, routes, spatial, versions
 from django.db.models import Sum, Count, Avg, Max, F  # For aggregation
 
+# Колекції, чий visible() фільтрує за Activity.deleted_at: м'яке видалення активності змінює їх усі
+ACTIVITY_SCOPED_MODELS = (Activity, ActivityPoint, Comment, Kudos)
+
 
 class BaseRepository:
     """
@@ -16,7 +24,7 @@ class BaseRepository:
     def get_by_id(self, model_id: int):
         raise NotImplementedError
 
-    def get_all(self):
+    def get_all(self, fields: Optional[List[str]] = None):
         raise NotImplementedError
 
     def add(self, **kwargs):
@@ -28,39 +36,104 @@ class BaseRepository:
     def delete(self, **kwargs) -> bool:
         raise NotImplementedError
 
+    # Кожен запис репозиторію додає подію в outbox у тій самій транзакції (див. outbox.py),
+    # а записи Activity, Profile і ActivityPoint ще й підвищують версію колекції (versions.py)
+
+    @staticmethod
+    def project(queryset, fields: Optional[List[str]] = None):
+        """Вибирає з БД лише потрібні колонки (?fields= / ?exclude= у API)."""
+        return queryset.only(*fields) if fields else queryset
+
+    @staticmethod
+    def rows(queryset, columns: List[str]):
+        """Сирі кортежі колонок для швидкого шляху серіалізації (без створення моделей)."""
+        return queryset.values_list(*columns)
+
+    @staticmethod
+    def parent_activity_visible(kwargs: dict) -> bool:
+        """Чи не прихована активність з kwargs ('activity' або 'activity_id'), до якої пишеться дочірній рядок."""
+        activity = kwargs.get('activity')
+        activity_id = activity.pk if activity is not None else kwargs.get('activity_id')
+        return Activity.objects.filter(id=activity_id, deleted_at__isnull=True).exists()
+
 
 # --- РЕПОЗИТОРІЙ 1: USER ---
 class UserRepository(BaseRepository):
 
+    @staticmethod
+    def visible():
+        # Користувачі в черзі на видалення вже приховані
+        return User.objects.exclude(id__in=deletion.pending_ids('user'))
+
     def get_by_id(self, model_id: int) -> Optional[User]:
         try:
-            return User.objects.get(id=model_id)
+            return self.visible().get(id=model_id)
         except User.DoesNotExist:
             return None
 
-    def get_all(self) -> List[User]:
-        return User.objects.all()
+    def get_all(self, fields: Optional[List[str]] = None) -> List[User]:
+        return self.project(self.visible(), fields)
 
     def add(self, **kwargs) -> User:
         # Ваш UserSerializer.create() подбає про хешування
-        return User.objects.create_user(**kwargs)
+        with transaction.atomic():
+            user = User.objects.create_user(**kwargs)
+            outbox.record(User, user.pk, outbox.CREATE)
+        return user
 
     def update(self, model_id: int, **kwargs) -> bool:
         if 'password' in kwargs and kwargs['password'] is None:
             del kwargs['password']
 
-        # Оновлюємо звичайні поля
-        count = User.objects.filter(id=model_id).update(**kwargs)
-
-        if 'password' in kwargs and kwargs['password'] is not None:
-            user = self.get_by_id(model_id)
-            if user:
-                user.set_password(kwargs['password'])
-                user.save()
+        with transaction.atomic():
+            # Оновлюємо звичайні поля
+            count = User.objects.filter(id=model_id).update(**kwargs)
+
+            if 'password' in kwargs and kwargs['password'] is not None:
+                user = self.get_by_id(model_id)
+                if user:
+                    user.set_password(kwargs['password'])
+                    user.save()
+            if count:
+                outbox.record(User, model_id, outbox.UPDATE)
+                # Пароль, логін чи is_active змінились - кешована ідентичність застаріла
+                transaction.on_commit(lambda: authentication.invalidate_user(model_id))
         return count > 0
 
     def delete(self, **kwargs) -> bool:
-        count, _ = User.objects.filter(id=kwargs.get('id')).delete()
+        return self.schedule_delete(kwargs.get('id')) is not None
+
+    def schedule_delete(self, model_id: int, requested_by_id: Optional[int] = None) -> Optional[DeletionJob]:
+        """
+        М'яке видалення: користувач деактивується, його активності ховаються,
+        а каскад видаляє purge_deletions пакетами (див. deletion.py).
+        """
+        with transaction.atomic():
+            if not User.objects.filter(id=model_id).update(is_active=False):
+                return None
+            transaction.on_commit(lambda: authentication.invalidate_user(model_id))
+            now = timezone.now()
+            hidden = Activity.objects.filter(user_id=model_id, deleted_at__isnull=True).update(
+                deleted_at=now, updated_at=now, idempotency_key=None, fingerprint=None
+            )
+            outbox.record(User, model_id, outbox.DELETE)
+            challenges.withdraw_user(model_id)
+            if hidden:
+                routes.remove_activities(Activity.objects.filter(user_id=model_id).values('id'))
+                for model in ACTIVITY_SCOPED_MODELS:
+                    versions.bump(model)
+            return deletion.schedule('user', model_id, requested_by_id)
+
+    def issue_token(self, user_id: int) -> str:
+        """Токен API користувача (один на користувача, створюється при першому вході)."""
+        token, _ = Token.objects.get_or_create(user_id=user_id)
+        return token.key
+
+    def logout(self, user_id: int) -> bool:
+        """Відкликає токен користувача (і всі кешовані копії його ідентичності)."""
+        with transaction.atomic():
+            count, _ = Token.objects.filter(user_id=user_id).delete()
+            transaction.on_commit(lambda: authentication.invalidate_user(user_id))
         return count > 0
 
     def get_user_stats_report(self):
@@ -84,20 +157,87 @@ class ProfileRepository(BaseRepository):
         except Profile.DoesNotExist:
             return None
 
-    def get_all(self) -> List[Profile]:
-        return Profile.objects.all()
+    @staticmethod
+    def get_own(user: User) -> Optional[Profile]:
+        """
+        Профіль автентифікованого користувача: CachedTokenAuthentication уже
+        приклеїв його до request.user з кешу ідентичності (без запиту до БД).
+        """
+        try:
+            return user.profile
+        except Profile.DoesNotExist:
+            return None
+
+    def get_all(self, fields: Optional[List[str]] = None) -> List[Profile]:
+        return self.project(Profile.objects.all(), fields)
+
+    def get_version(self, model_id: int):
+        """updated_at профілю без читання решти колонок (умовні GET)."""
+        return Profile.objects.filter(user_id=model_id).values_list('updated_at', flat=True).first()
+
+    def nearby(self, lat: float, lon: float, radius_m: float, limit: int, after=None,
+               exclude_user_id: Optional[int] = None) -> Tuple[List[Tuple[Profile, float]], Optional[str]]:
+        """
+        Атлети, чиї активності стартували в радіусі (відстань - до найближчого
+        старту), і курсор наступної сторінки (див. spatial.nearest).
+        """
+        starts = ActivityRepository.visible().filter(user__profile__isnull=False)
+        if exclude_user_id is not None:
+            starts = starts.exclude(user_id=exclude_user_id)
+        page, next_cursor = spatial.nearest(starts, lat, lon, radius_m, limit, after=after, key='user_id')
+        profiles = Profile.objects.in_bulk([user_id for user_id, _ in page], field_name='user_id')
+        return [(profiles[user_id], distance) for user_id, distance in page if user_id in profiles], next_cursor
+
+    @staticmethod
+    def same_city(city: str, country: Optional[str] = None, exclude_user_id: Optional[int] = None):
+        """Профілі з того ж міста (і країни) - queryset для курсорної пагінації за user_id."""
+        queryset = spatial.same_location(Profile.objects.all(), city, country)
+        if exclude_user_id is not None:
+            queryset = queryset.exclude(user_id=exclude_user_id)
+        return queryset
+
+    @staticmethod
+    def estimation_inputs(user_id: int) -> Optional[dict]:
+        return Profile.objects.filter(user_id=user_id).values(*estimation.PROFILE_INPUT_FIELDS).first()
+
+    def on_change(self, user_id: int, old: Optional[dict], new: Optional[dict]):
+        """Оцінки калорій залежать від ваги/зросту/віку/статі - лише їхня зміна їх інвалідує."""
+        if estimation.profile_inputs_changed(old, new):
+            estimation.invalidate_user(user_id)
+        # Профіль кешується разом з ідентичністю користувача
+        transaction.on_commit(lambda: authentication.invalidate_user(user_id))
 
     def add(self, **kwargs) -> Profile:
         # kwargs має містити 'user' або 'user_id'
-        return Profile.objects.create(**kwargs)
+        with transaction.atomic():
+            profile = Profile.objects.create(**kwargs)
+            self.on_change(profile.user_id, None, self.estimation_inputs(profile.user_id))
+            outbox.record(Profile, profile.pk, outbox.CREATE)
+            versions.bump(Profile)
+        return profile
 
     def update(self, model_id: int, **kwargs) -> bool:
         # 'model_id' тут - це user_id
-        count = Profile.objects.filter(user_id=model_id).update(**kwargs)
+        with transaction.atomic():
+            old = self.estimation_inputs(model_id)
+            queryset = Profile.objects.filter(user_id=model_id)
+            count = queryset.update(updated_at=timezone.now(), **kwargs)
+            if count:
+                self.on_change(model_id, old, self.estimation_inputs(model_id))
+            outbox.record_queryset(queryset, outbox.UPDATE)
+            if count:
+                versions.bump(Profile)
         return count > 0
 
     def delete(self, **kwargs) -> bool:
-        count, _ = Profile.objects.filter(user_id=kwargs.get('id')).delete()
+        with transaction.atomic():
+            old = self.estimation_inputs(kwargs.get('id'))
+            queryset = Profile.objects.filter(user_id=kwargs.get('id'))
+            outbox.record_queryset(queryset, outbox.DELETE)
+            count, _ = queryset.delete()
+            if count:
+                self.on_change(kwargs.get('id'), old, None)
+                versions.bump(Profile)
         return count > 0
 
     def get_global_profiles_stats_report(self):
@@ -115,29 +255,148 @@ class ProfileRepository(BaseRepository):
 # --- РЕПОЗИТОРІЙ 3: ACTIVITY ---
 class ActivityRepository(BaseRepository):
 
+    @staticmethod
+    def visible():
+        # М'яко видалені активності чекають на purge_deletions
+        return Activity.objects.filter(deleted_at__isnull=True)
+
     def get_by_id(self, model_id: int) -> Optional[Activity]:
         try:
-            return Activity.objects.get(id=model_id)
+            return self.visible().get(id=model_id)
         except Activity.DoesNotExist:
             return None
 
-    def get_all(self) -> List[Activity]:
-        return Activity.objects.all()
+    def get_all(self, fields: Optional[List[str]] = None) -> List[Activity]:
+        return self.project(self.visible(), fields)
+
+    def get_version(self, model_id: int):
+        """updated_at активності без читання решти колонок (умовні GET)."""
+        return self.visible().filter(id=model_id).values_list('updated_at', flat=True).first()
+
+    def add(self, idempotency_key: Optional[str] = None, points: Optional[list] = None, **kwargs) -> Activity:
+        activity, _ = self.get_or_add(idempotency_key=idempotency_key, points=points, **kwargs)
+        return activity
+
+    def get_or_add(self, idempotency_key: Optional[str] = None, points: Optional[list] = None,
+                   **kwargs) -> Tuple[Activity, bool]:
+        """
+        Ідемпотентне створення активності (разом з треком, якщо він переданий).
+        Повертає (activity, created). Дублікат шукається спершу за ключем
+        ідемпотентності, потім за відбитком треку - обидва пошуки йдуть по індексу.
+        """
+        user_id = kwargs['user'].id if 'user' in kwargs else kwargs.get('user_id')
+        points = points or []
+        activity_type = kwargs.get('activity_type', Activity._meta.get_field('activity_type').default)
+        fingerprint = compute_fingerprint(activity_type, kwargs.get('start_time'), kwargs.get('duration_sec'), points)
 
-    def add(self, **kwargs) -> Activity:
-        return Activity.objects.create(**kwargs)
+        duplicate = self.find_duplicate(user_id, idempotency_key, fingerprint)
+        if duplicate:
+            return duplicate, False
+
+        try:
+            with transaction.atomic():
+                activity = Activity.objects.create(
+                    idempotency_key=idempotency_key, fingerprint=fingerprint, **kwargs
+                )
+                if points:
+                    ActivityPointRepository().add_bulk(activity.id, points)
+                    # add_bulk заповнив геоіндекс (start_lat, ...) напряму в БД
+                    activity.refresh_from_db(fields=[*spatial.INDEX_FIELDS, 'updated_at'])
+                    # Групування "той самий маршрут" - одразу при завантаженні треку
+                    routes.index_activities([activity.id])
+                self.on_change(None, records.activity_snapshot(activity.id))
+                outbox.record(Activity, activity.id, outbox.CREATE)
+                versions.bump(Activity)
+        except IntegrityError:
+            # Паралельний ретрай з тим самим ключем встиг створити запис першим
+            duplicate = self.find_duplicate(user_id, idempotency_key, None)
+            if duplicate is None:
+                raise
+            return duplicate, False
+        return activity, True
+
+    def nearby(self, lat: float, lon: float, radius_m: float, limit: int, after=None,
+               activity_type: Optional[str] = None) -> Tuple[List[Tuple[Activity, float]], Optional[str]]:
+        """Активності зі стартом у радіусі, найближчі першими, і курсор наступної сторінки."""
+        queryset = self.visible()
+        if activity_type:
+            queryset = queryset.filter(activity_type=activity_type)
+        page, next_cursor = spatial.nearest(queryset, lat, lon, radius_m, limit, after=after)
+        activities = self.visible().in_bulk([activity_id for activity_id, _ in page])
+        return [(activities[activity_id], distance) for activity_id, distance in page
+                if activity_id in activities], next_cursor
+
+    def find_duplicate(self, user_id: int, idempotency_key: Optional[str],
+                       fingerprint: Optional[str]) -> Optional[Activity]:
+        if idempotency_key:
+            duplicate = self.visible().filter(user_id=user_id, idempotency_key=idempotency_key).first()
+            if duplicate:
+                return duplicate
+        if fingerprint:
+            return self.visible().filter(user_id=user_id, fingerprint=fingerprint).first()
+        return None
+
+    @staticmethod
+    def track_fingerprint(values: dict) -> Optional[str]:
+        """Відбиток збереженої активності (values - records.activity_snapshot) з її треку в БД."""
+        points = ActivityPoint.objects.filter(activity_id=values['id']).order_by('recorded_at', 'id').values('lat', 'lon')
+        return compute_fingerprint(values['activity_type'], values['start_time'], values['duration_sec'], points)
 
     def update(self, model_id: int, **kwargs) -> bool:
-        count = Activity.objects.filter(id=model_id).update(**kwargs)
+        with transaction.atomic():
+            old = records.activity_snapshot(model_id)
+            count = self.visible().filter(id=model_id).update(updated_at=timezone.now(), **kwargs)
+            if count:
+                new = records.activity_snapshot(model_id)
+                # Інші вид, час старту чи тривалість (зокрема live.finalize) - відбиток застарів
+                if any(old[name] != new[name] for name in FINGERPRINT_FIELDS):
+                    Activity.objects.filter(id=model_id).update(fingerprint=self.track_fingerprint(new))
+                self.on_change(old, new)
+                outbox.record(Activity, model_id, outbox.UPDATE)
+                versions.bump(Activity)
         return count > 0
 
     def delete(self, **kwargs) -> bool:
-        count, _ = Activity.objects.filter(id=kwargs.get('id')).delete()
-        return count > 0
+        return self.schedule_delete(kwargs.get('id')) is not None
+
+    def schedule_delete(self, model_id: int, requested_by_id: Optional[int] = None) -> Optional[DeletionJob]:
+        """
+        М'яке видалення: активність одразу зникає з API, точки/коментарі/kudos
+        видаляє purge_deletions пакетами (див. deletion.py).
+        Ключ ідемпотентності і відбиток звільняються для повторного завантаження.
+        """
+        with transaction.atomic():
+            old = records.activity_snapshot(model_id)
+            now = timezone.now()
+            count = self.visible().filter(id=model_id).update(
+                deleted_at=now, updated_at=now, idempotency_key=None, fingerprint=None
+            )
+            if not count:
+                return None
+            self.on_change(old, None)
+            outbox.record(Activity, model_id, outbox.DELETE)
+            for model in ACTIVITY_SCOPED_MODELS:
+                versions.bump(model)
+            return deletion.schedule('activity', model_id, requested_by_id)
+
+    def on_change(self, old: Optional[dict], new: Optional[dict]):
+        """
+        Єдина точка для похідних даних, що оновлюються інкрементально при записі активності.
+        old - стан до запису (None для add), new - після (None для delete).
+        """
+        records.apply_activity_change(old, new)
+        challenges.apply_activity_change(old, new)
+        if estimation.activity_inputs_changed(old, new):
+            estimation.invalidate_activities([new['id']])
+        # Групи маршрутів окремі для кожного виду; видалена активність виходить із групи
+        if old and new is None:
+            routes.remove_activities([old['id']])
+        elif old and new['activity_type'] != old['activity_type']:
+            routes.index_after_commit([old['id']])
 
     def get_global_stats_report(self):
         """Звіт: Агрегована статистика по всіх активностях"""
-        return Activity.objects.aggregate(
+        return self.visible().aggregate(
             total_activities=Count('id'),
             total_distance_meters=Sum('distance_m'),
             total_duration_seconds=Sum('duration_sec'),
@@ -148,29 +407,50 @@ class ActivityRepository(BaseRepository):
 # --- РЕПОЗИТОРІЙ 4: COMMENT ---
 class CommentRepository(BaseRepository):
 
+    @staticmethod
+    def visible():
+        # Коментарі м'яко видаленої активності зникають разом з нею (purge_deletions видалить їх пізніше)
+        return Comment.objects.filter(activity__deleted_at__isnull=True)
+
     def get_by_id(self, model_id: int) -> Optional[Comment]:
         try:
-            return Comment.objects.get(id=model_id)
+            return self.visible().get(id=model_id)
         except Comment.DoesNotExist:
             return None
 
-    def get_all(self) -> List[Comment]:
-        return Comment.objects.all()
+    def get_all(self, fields: Optional[List[str]] = None) -> List[Comment]:
+        return self.project(self.visible(), fields)
 
-    def add(self, **kwargs) -> Comment:
-        return Comment.objects.create(**kwargs)
+    def add(self, **kwargs) -> Optional[Comment]:
+        # None - активності немає або вона прихована
+        if not self.parent_activity_visible(kwargs):
+            return None
+        with transaction.atomic():
+            comment = Comment.objects.create(**kwargs)
+            outbox.record(Comment, comment.pk, outbox.CREATE)
+        return comment
 
     def update(self, model_id: int, **kwargs) -> bool:
-        count = Comment.objects.filter(id=model_id).update(**kwargs)
+        with transaction.atomic():
+            count = Comment.objects.filter(id=model_id).update(**kwargs)
+            if count:
+                outbox.record(Comment, model_id, outbox.UPDATE)
         return count > 0
 
     def delete(self, **kwargs) -> bool:
-        count, _ = Comment.objects.filter(id=kwargs.get('id')).delete()
+        with transaction.atomic():
+            # Гілка відповідей видаляється каскадом - подія для кожного коментаря в ній
+            thread, frontier = [], [kwargs.get('id')]
+            while frontier:
+                thread += frontier
+                frontier = list(Comment.objects.filter(parent_comment_id__in=frontier).values_list('id', flat=True))
+            outbox.record_queryset(Comment.objects.filter(id__in=thread), outbox.DELETE)
+            count, _ = Comment.objects.filter(id=kwargs.get('id')).delete()
         return count > 0
 
     def get_comment_stats_report(self):
         """Звіт: Найбільш коментовані активності"""
-        return Comment.objects.values('activity_id').annotate(
+        return self.visible().values('activity_id').annotate(
             comment_count=Count('id')
         ).order_by('-comment_count')
 
@@ -178,25 +458,131 @@ class CommentRepository(BaseRepository):
 # --- РЕПОЗИТОРІЙ 5: KUDOS ---
 class KudosRepository(BaseRepository):
 
+    @staticmethod
+    def visible():
+        return Kudos.objects.filter(activity__deleted_at__isnull=True)
+
     def get_by_id(self, model_id: int) -> Optional[Kudos]:
         try:
-            return Kudos.objects.get(id=model_id)
+            return self.visible().get(id=model_id)
         except Kudos.DoesNotExist:
             return None
 
-    def get_all(self) -> List[Kudos]:
-        return Kudos.objects.all()
+    def get_all(self, fields: Optional[List[str]] = None) -> List[Kudos]:
+        return self.project(self.visible(), fields)
 
-    def add(self, **kwargs) -> Kudos:
-        return Kudos.objects.create(**kwargs)
+    def add(self, **kwargs) -> Optional[Kudos]:
+        # kwargs: {'activity': Activity_obj, 'user': User_obj}; повторний kudos повертає існуючий
+        activity_id = kwargs['activity'].id if 'activity' in kwargs else kwargs.get('activity_id')
+        user_id = kwargs['user'].id if 'user' in kwargs else kwargs.get('user_id')
+        kudos_id, _ = self.give(activity_id, user_id)
+        if kudos_id is None:
+            return Kudos.objects.filter(activity_id=activity_id, user_id=user_id).first()
+        return self.get_by_id(kudos_id)
 
     def update(self, model_id: int, **kwargs) -> bool:
-        count = Kudos.objects.filter(id=model_id).update(**kwargs)
+        with transaction.atomic():
+            count = Kudos.objects.filter(id=model_id).update(**kwargs)
+            if count:
+                outbox.record(Kudos, model_id, outbox.UPDATE)
         return count > 0
 
     def delete(self, **kwargs) -> bool:
-        count, _ = Kudos.objects.filter(id=kwargs.get('id')).delete()
-        return count > 0
+        # Через take_back, щоб Activity.kudos_count лишався узгодженим
+        keys = Kudos.objects.filter(id=kwargs.get('id')).values_list('activity_id', 'user_id').first()
+        if keys is None:
+            return False
+        deleted, _ = self.take_back(*keys)
+        return deleted
+
+    def give(self, activity_id: int, user_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Поставити kudos без перехоплення IntegrityError: INSERT ... ON CONFLICT DO NOTHING
+        разом з оновленням Activity.kudos_count.
+        Повертає (id нового kudos або None, якщо вже був; kudos_count або None, якщо активності немає).
+        """
+        qn = connection.ops.quote_name
+        kudos_table, activity_table = qn(Kudos._meta.db_table), qn(Activity._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        # kudos_count входить у представлення активності - разом з ним змінюється її версія
+        insert_sql = (
+            f"INSERT INTO {kudos_table} (activity_id, user_id, created_at) "
+            f"SELECT %s, %s, %s WHERE EXISTS (SELECT 1 FROM {activity_table} WHERE id = %s AND deleted_at IS NULL) "
+            f"ON CONFLICT (activity_id, user_id) DO NOTHING RETURNING id"
+        )
+        insert_params = [activity_id, user_id, now, activity_id]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Одна інструкція: вставка, інкремент лічильника і поточне значення
+                cursor.execute(
+                    f"WITH ins AS ({insert_sql}), "
+                    f"upd AS (UPDATE {activity_table} SET kudos_count = kudos_count + 1, updated_at = %s "
+                    f"        WHERE id = %s AND EXISTS (SELECT 1 FROM ins) RETURNING kudos_count) "
+                    f"SELECT (SELECT id FROM ins), COALESCE((SELECT kudos_count FROM upd), "
+                    f"       (SELECT kudos_count FROM {activity_table} WHERE id = %s AND deleted_at IS NULL))",
+                    insert_params + [now, activity_id, activity_id]
+                )
+                kudos_id, kudos_count = cursor.fetchone()
+            else:
+                cursor.execute(insert_sql, insert_params)
+                row = cursor.fetchone()
+                kudos_id = row[0] if row else None
+                if kudos_id is not None:
+                    cursor.execute(
+                        f"UPDATE {activity_table} SET kudos_count = kudos_count + 1, updated_at = %s WHERE id = %s",
+                        [now, activity_id]
+                    )
+                cursor.execute(
+                    f"SELECT kudos_count FROM {activity_table} WHERE id = %s AND deleted_at IS NULL", [activity_id]
+                )
+                row = cursor.fetchone()
+                kudos_count = row[0] if row else None
+            if kudos_id is not None:
+                outbox.record(Kudos, kudos_id, outbox.CREATE)
+                versions.bump(Activity)
+        return kudos_id, kudos_count
+
+    def take_back(self, activity_id: int, user_id: int) -> Tuple[bool, Optional[int]]:
+        """
+        Зняти kudos через DELETE ... RETURNING разом з декрементом лічильника.
+        Повертає (чи був kudos видалений; kudos_count або None, якщо активності немає).
+        """
+        qn = connection.ops.quote_name
+        kudos_table, activity_table = qn(Kudos._meta.db_table), qn(Activity._meta.db_table)
+        delete_sql = f"DELETE FROM {kudos_table} WHERE activity_id = %s AND user_id = %s RETURNING id"
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"WITH del AS ({delete_sql}), "
+                    f"upd AS (UPDATE {activity_table} SET kudos_count = GREATEST(kudos_count - 1, 0), updated_at = %s "
+                    f"        WHERE id = %s AND EXISTS (SELECT 1 FROM del) RETURNING kudos_count) "
+                    f"SELECT (SELECT id FROM del), COALESCE((SELECT kudos_count FROM upd), "
+                    f"       (SELECT kudos_count FROM {activity_table} WHERE id = %s AND deleted_at IS NULL))",
+                    [activity_id, user_id, now, activity_id, activity_id]
+                )
+                kudos_id, kudos_count = cursor.fetchone()
+            else:
+                cursor.execute(delete_sql, [activity_id, user_id])
+                row = cursor.fetchone()
+                kudos_id = row[0] if row else None
+                if kudos_id is not None:
+                    cursor.execute(
+                        f"UPDATE {activity_table} SET kudos_count = MAX(kudos_count - 1, 0), updated_at = %s "
+                        f"WHERE id = %s",
+                        [now, activity_id]
+                    )
+                cursor.execute(
+                    f"SELECT kudos_count FROM {activity_table} WHERE id = %s AND deleted_at IS NULL", [activity_id]
+                )
+                row = cursor.fetchone()
+                kudos_count = row[0] if row else None
+            if kudos_id is not None:
+                outbox.record(Kudos, kudos_id, outbox.DELETE)
+                versions.bump(Activity)
+        return kudos_id is not None, kudos_count
 
     def get_kudos_stats_report(self):
         """Звіт: Активності з найбільшою кількістю 'kudos'"""
@@ -217,23 +603,58 @@ class FollowerRepository(BaseRepository):
         except Follower.DoesNotExist:
             return None
 
-    def get_all(self) -> List[Follower]:
-        return Follower.objects.all()
+    def get_all(self, fields: Optional[List[str]] = None) -> List[Follower]:
+        return self.project(Follower.objects.all(), fields)
 
     def add(self, **kwargs) -> Follower:
         # kwargs: {'follower': User_obj, 'followee': User_obj}
-        return Follower.objects.create(**kwargs)
+        with transaction.atomic():
+            follow = Follower.objects.create(**kwargs)
+            outbox.record(Follower, follow.pk, outbox.CREATE)
+        return follow
 
     def update(self, model_id: int, **kwargs) -> bool:
         raise NotImplementedError("Follower не оновлюється, а видаляється/створюється")
 
     def delete(self, **kwargs) -> bool:
         # kwargs: {'follower_id': 1, 'followee_id': 2}
-        count, _ = Follower.objects.filter(
-            follower_id=kwargs.get('follower_id'),
-            followee_id=kwargs.get('followee_id')
-        ).delete()
-        return count > 0
+        return self.unfollow(kwargs.get('follower_id'), kwargs.get('followee_id'))
+
+    def follow(self, follower_id: int, followee_id: int) -> Tuple[Optional[int], bool]:
+        """
+        Підписка одним INSERT ... ON CONFLICT DO NOTHING.
+        Повертає (id нової підписки або None; чи існує followee).
+        """
+        qn = connection.ops.quote_name
+        follower_table, user_table = qn(Follower._meta.db_table), qn(User._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {follower_table} (follower_id, followee_id, created_at) "
+                f"SELECT %s, %s, %s WHERE EXISTS (SELECT 1 FROM {user_table} WHERE id = %s) "
+                f"ON CONFLICT (follower_id, followee_id) DO NOTHING RETURNING id",
+                [follower_id, followee_id, now, followee_id]
+            )
+            row = cursor.fetchone()
+            if row:
+                outbox.record(Follower, row[0], outbox.CREATE)
+        if row:
+            return row[0], True
+        return None, User.objects.filter(id=followee_id).exists()
+
+    def unfollow(self, follower_id: int, followee_id: int) -> bool:
+        """Відписка одним DELETE ... RETURNING. Повертає, чи підписка існувала."""
+        qn = connection.ops.quote_name
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {qn(Follower._meta.db_table)} "
+                f"WHERE follower_id = %s AND followee_id = %s RETURNING id",
+                [follower_id, followee_id]
+            )
+            row = cursor.fetchone()
+            if row:
+                outbox.record(Follower, row[0], outbox.DELETE)
+        return row is not None
 
     def get_follower_stats_report(self):
         """Звіт: Топ-10 найпопулярніших користувачів (кого найбільше фоловлять)"""
@@ -245,26 +666,114 @@ class FollowerRepository(BaseRepository):
 # --- РЕПОЗИТОРІЙ 7: ACTIVITYPOINT ---
 class ActivityPointRepository(BaseRepository):
 
+    @staticmethod
+    def visible():
+        return ActivityPoint.objects.filter(activity__deleted_at__isnull=True)
+
     def get_by_id(self, model_id: int) -> Optional[ActivityPoint]:
         try:
-            return ActivityPoint.objects.get(id=model_id)
+            return self.visible().get(id=model_id)
         except ActivityPoint.DoesNotExist:
             return None
 
-    def get_all(self) -> List[ActivityPoint]:
-        return ActivityPoint.objects.all()
+    def get_all(self, fields: Optional[List[str]] = None) -> List[ActivityPoint]:
+        return self.project(self.visible(), fields)
 
-    def add(self, **kwargs) -> ActivityPoint:
-        return ActivityPoint.objects.create(**kwargs)
+    def add(self, **kwargs) -> Optional[ActivityPoint]:
+        # None - активності немає або вона прихована
+        if not self.parent_activity_visible(kwargs):
+            return None
+        # Повторна відправка тієї ж точки повертає вже збережену
+        if kwargs.get('recorded_at') is not None:
+            lookup = {k: kwargs[k] for k in ('activity', 'activity_id') if k in kwargs}
+            existing = ActivityPoint.objects.filter(recorded_at=kwargs['recorded_at'], **lookup).first()
+            if existing:
+                return existing
+        with transaction.atomic():
+            point = ActivityPoint.objects.create(**kwargs)
+            estimation.invalidate_activities([point.activity_id])
+            routes.index_after_commit([point.activity_id])
+            spatial.extend_index(point.activity_id, [(point.lat, point.lon)])
+            outbox.record(ActivityPoint, point.pk, outbox.CREATE)
+            versions.bump(ActivityPoint)
+        return point
+
+    def add_bulk(self, activity_id: int, points: list, batch_size: int = 1000) -> int:
+        """
+        Пакетне збереження треку. Точки, що вже є (activity, recorded_at),
+        пропускаються на рівні БД (ON CONFLICT DO NOTHING). До прихованої
+        активності нічого не дописується (0).
+        """
+        if not self.parent_activity_visible({'activity_id': activity_id}):
+            return 0
+        objs = [ActivityPoint(activity_id=activity_id, **point) for point in points]
+        with transaction.atomic():
+            ActivityPoint.objects.bulk_create(objs, batch_size=batch_size, ignore_conflicts=True)
+            # id з ignore_conflicts повертає не кожна СУБД - події з рядків треку в БД.
+            # Дозапис треку пакетами (live-трекінг) не повторює подій для раніше збережених точок
+            saved = ActivityPoint.objects.filter(activity_id=activity_id)
+            recorded = [obj.recorded_at for obj in objs]
+            appended = objs and None not in recorded
+            if appended:
+                saved = saved.filter(recorded_at__in=recorded)
+            outbox.record_queryset(saved, outbox.CREATE)
+            # Точка старту і рамка треку для пошуку поблизу: дозапис лише розширює рамку
+            if appended:
+                spatial.extend_index(activity_id, saved.values_list('lat', 'lon'))
+            else:
+                spatial.index_activities([activity_id])
+            versions.bump(ActivityPoint)
+        return len(objs)
 
     def update(self, model_id: int, **kwargs) -> bool:
-        count = ActivityPoint.objects.filter(id=model_id).update(**kwargs)
+        with transaction.atomic():
+            queryset = ActivityPoint.objects.filter(id=model_id)
+            # Трек змінився - оцінка і відбиток маршруту активності (до і після переносу точки) застаріли
+            before = list(queryset.select_for_update().values_list('activity_id', 'lat', 'lon'))
+            activity_ids = [row[0] for row in before]
+            count = queryset.update(**kwargs)
+            if count:
+                # Старе місце точки - з теплової карти; нове додасть build_heatmap з події update
+                heatmap.remove_rows(before)
+                activity_ids += list(queryset.values_list('activity_id', flat=True))
+                estimation.invalidate_activities(activity_ids)
+                routes.index_after_commit(activity_ids)
+                spatial.index_activities(activity_ids)
+                outbox.record(ActivityPoint, model_id, outbox.UPDATE)
+                versions.bump(ActivityPoint)
         return count > 0
 
     def delete(self, **kwargs) -> bool:
-        count, _ = ActivityPoint.objects.filter(id=kwargs.get('id')).delete()
+        with transaction.atomic():
+            queryset = ActivityPoint.objects.filter(id=kwargs.get('id'))
+            before = list(queryset.select_for_update().values_list('activity_id', 'lat', 'lon'))
+            activity_ids = [row[0] for row in before]
+            count, _ = queryset.delete()
+            if count:
+                heatmap.remove_rows(before)
+                estimation.invalidate_activities(activity_ids)
+                routes.index_after_commit(activity_ids)
+                spatial.index_activities(activity_ids)
+                outbox.record(ActivityPoint, kwargs.get('id'), outbox.DELETE)
+                versions.bump(ActivityPoint)
         return count > 0
 
+    def delete_many(self, ids: List[int]) -> int:
+        """Видалення пакета точок одним DELETE; похідні дані активностей оновлюються раз на пакет."""
+        with transaction.atomic():
+            queryset = ActivityPoint.objects.filter(id__in=ids)
+            before = list(queryset.select_for_update().values_list('activity_id', 'lat', 'lon'))
+            activity_ids = {row[0] for row in before}
+            outbox.record_queryset(queryset, outbox.DELETE)
+            count, _ = queryset.delete()
+            if count:
+                heatmap.remove_rows(before)
+                estimation.invalidate_activities(activity_ids)
+                routes.index_after_commit(activity_ids)
+                spatial.index_activities(activity_ids)
+                versions.bump(ActivityPoint)
+        return count
+
 
 # --- РЕПОЗИТОРІЙ 8: USERMONTHLYSTATS ---
 class UserMonthlyStatsRepository(BaseRepository):
@@ -278,11 +787,14 @@ class UserMonthlyStatsRepository(BaseRepository):
         except UserMonthlyStats.DoesNotExist:
             return None
 
-    def get_all(self) -> List[UserMonthlyStats]:
-        return UserMonthlyStats.objects.all()
+    def get_all(self, fields: Optional[List[str]] = None) -> List[UserMonthlyStats]:
+        return self.project(UserMonthlyStats.objects.all(), fields)
 
     def add(self, **kwargs) -> UserMonthlyStats:
-        return UserMonthlyStats.objects.create(**kwargs)
+        with transaction.atomic():
+            stats = UserMonthlyStats.objects.create(**kwargs)
+            outbox.record(UserMonthlyStats, stats.pk, outbox.CREATE)
+        return stats
 
     def update(self, model_id, **kwargs):
         user = kwargs.get('user')
@@ -292,20 +804,25 @@ class UserMonthlyStatsRepository(BaseRepository):
         if not all([user, year, month]):
             raise ValueError("Для оновлення UserMonthlyStats потрібні user, year, month")
 
-        stats, created = UserMonthlyStats.objects.update_or_create(
-            user=user,
-            year=year,
-            month=month,
-            defaults=kwargs
-        )
+        with transaction.atomic():
+            stats, created = UserMonthlyStats.objects.update_or_create(
+                user=user,
+                year=year,
+                month=month,
+                defaults=kwargs
+            )
+            outbox.record(UserMonthlyStats, stats.pk, outbox.CREATE if created else outbox.UPDATE)
         return not created
 
     def delete(self, **kwargs) -> bool:
-        count, _ = UserMonthlyStats.objects.filter(
-            user_id=kwargs.get('user_id'),
-            year=kwargs.get('year'),
-            month=kwargs.get('month')
-        ).delete()
+        with transaction.atomic():
+            queryset = UserMonthlyStats.objects.filter(
+                user_id=kwargs.get('user_id'),
+                year=kwargs.get('year'),
+                month=kwargs.get('month')
+            )
+            outbox.record_queryset(queryset, outbox.DELETE)
+            count, _ = queryset.delete()
         return count > 0
 
     def get_distance_leaderboard_report(self):
@@ -315,6 +832,61 @@ class UserMonthlyStatsRepository(BaseRepository):
         ).order_by('-total_distance')
 
 
+# --- РЕПОЗИТОРІЙ 9: CHALLENGE ---
+class ChallengeRepository(BaseRepository):
+
+    def get_by_id(self, model_id: int) -> Optional[Challenge]:
+        try:
+            return Challenge.objects.get(id=model_id)
+        except Challenge.DoesNotExist:
+            return None
+
+    def get_all(self, fields: Optional[List[str]] = None) -> List[Challenge]:
+        return self.project(Challenge.objects.order_by('-starts_at', '-id'), fields)
+
+    def add(self, **kwargs) -> Challenge:
+        with transaction.atomic():
+            challenge = Challenge.objects.create(**kwargs)
+            outbox.record(Challenge, challenge.pk, outbox.CREATE)
+        return challenge
+
+    def update(self, model_id: int, **kwargs) -> bool:
+        with transaction.atomic():
+            queryset = Challenge.objects.filter(id=model_id)
+            old = queryset.values(*challenges.RULE_FIELDS).first()
+            count = queryset.update(**kwargs)
+            if count:
+                # Інші вид, метрика, вікно чи мета - прогрес учасників перераховується
+                if queryset.values(*challenges.RULE_FIELDS).first() != old:
+                    challenges.recompute(queryset.get())
+                outbox.record(Challenge, model_id, outbox.UPDATE)
+        return count > 0
+
+    def delete(self, **kwargs) -> bool:
+        with transaction.atomic():
+            count, _ = Challenge.objects.filter(id=kwargs.get('id')).delete()
+            if count:
+                outbox.record(Challenge, kwargs.get('id'), outbox.DELETE)
+        return count > 0
+
+    def join(self, challenge: Challenge, user_id: int) -> Tuple[ChallengeParticipant, bool]:
+        """Ідемпотентне приєднання; повертає (учасник, чи створено)."""
+        with transaction.atomic():
+            participant, created = challenges.join(challenge, user_id)
+            if created:
+                outbox.record(ChallengeParticipant, participant.pk, outbox.CREATE)
+        return participant, created
+
+    def leave(self, challenge_id: int, user_id: int) -> bool:
+        with transaction.atomic():
+            participant_id = ChallengeParticipant.objects.filter(challenge_id=challenge_id, user_id=user_id) \
+                .values_list('id', flat=True).first()
+            left = challenges.leave(challenge_id, user_id)
+            if left:
+                outbox.record(ChallengeParticipant, participant_id, outbox.DELETE)
+        return left
+
+
 # --- ЄДИНА ТОЧКА ДОСТУПУ (DataAccessLayer) ---
 class DataAccessLayer:
     def __init__(self):
@@ -326,6 +898,7 @@ class DataAccessLayer:
         self.followers = FollowerRepository()
         self.kudos = KudosRepository()
         self.user_stats = UserMonthlyStatsRepository()
+        self.challenges = ChallengeRepository()
 
     def __enter__(self):
         return self
@@ -0,0 +1,243 @@
+"""
+Схожість маршрутів і групування повторних активностей ("той самий маршрут").
+
+Попарне порівняння треків квадратичне, тому пошук іде в три кроки:
+  1. відбиток: трек -> множина geohash-клітинок (~150 м) -> MinHash-підпис
+     з ROUTE_SIGNATURE_SIZE мінімумів незалежних хешів (оцінка Жаккара);
+  2. LSH: підпис ріжеться на смуги, хеш кожної смуги - кошик RouteBucket.
+     Кандидати - активності того ж виду зі спільним кошиком (один індексований
+     запит), найбільше збігів - першими;
+  3. перевірка: дискретна відстань Фреше між перевибраними до ROUTE_PATH_POINTS
+     точок треками, векторизовано по всіх кандидатах (антидіагоналями матриці).
+
+Активність потрапляє в групу найближчого кандидата, якщо відхилення не
+перевищує ROUTE_MATCH_MAX_DEVIATION_M, інакше відкриває нову групу.
+Індексація відбувається при завантаженні треку. Зміна точок чи виду активності
+прибирає відбиток у транзакції запису, а новий будується одразу після коміту
+(index_after_commit): повільне зіставлення треків не тримає блокувань запису.
+Якщо побудова після коміту не вдалась, відбиток добудує get_sketch() при
+запиті /similar/ або backfill 'routes'.
+"""
+import hashlib
+from functools import partial
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .geo import geohash_int, haversine_m
+from .models import Activity, ActivityPoint, RouteBucket, RouteGroup, RouteSketch
+
+ENGINE_VERSION = 1
+
+GEOHASH_PRECISION = 7          # клітинка ~153 x 153 м
+ROUTE_SIGNATURE_SIZE = 64
+LSH_BANDS = 16                 # 16 смуг по 4 хеші: поріг схожості Жаккара ~0.5
+ROUTE_PATH_POINTS = 64
+MIN_TRACK_POINTS = 10
+MIN_ROUTE_LENGTH_M = 300.0
+MAX_CANDIDATES = 50
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+# Сталі зерна хешів підпису (однакові в усіх процесах)
+_SEEDS = np.frombuffer(
+    b''.join(hashlib.blake2b(f"route-minhash-{i}".encode(), digest_size=8).digest() for i in range(ROUTE_SIGNATURE_SIZE)),
+    dtype='<u8',
+).astype(np.uint64)
+
+
+def max_deviation_m() -> float:
+    return getattr(settings, 'ROUTE_MATCH_MAX_DEVIATION_M', 150.0)
+
+
+# --- Відбиток треку ---
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64: незалежний від платформи хеш uint64 (переповнення - за модулем 2^64)."""
+    with np.errstate(over='ignore'):
+        z = values + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return (z ^ (z >> np.uint64(31))) & _MASK64
+
+
+def minhash(cells: np.ndarray) -> np.ndarray:
+    """MinHash-підпис множини клітинок: мінімум кожного з ROUTE_SIGNATURE_SIZE хешів."""
+    cells = np.unique(cells).astype(np.uint64)
+    return _mix64(cells[None, :] ^ _SEEDS[:, None]).min(axis=1)
+
+
+def band_keys(signature: np.ndarray) -> List[int]:
+    """Ключі LSH-кошиків: хеш (номер смуги, значення смуги) як знакове 64-бітне число."""
+    keys = []
+    for band, values in enumerate(np.array_split(signature.astype('<u8'), LSH_BANDS)):
+        digest = hashlib.blake2b(bytes([band]) + values.tobytes(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+def resample(lat: np.ndarray, lon: np.ndarray, count: int = ROUTE_PATH_POINTS):
+    """Трек -> count точок, рівновіддалених уздовж шляху. Повертає (шлях (count, 2), довжина м)."""
+    steps = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    along = np.concatenate(([0.0], np.cumsum(steps)))
+    targets = np.linspace(0.0, along[-1], count)
+    path = np.column_stack((np.interp(targets, along, lat), np.interp(targets, along, lon)))
+    return path, float(along[-1])
+
+
+def discrete_frechet(path: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """
+    Дискретна відстань Фреше (м) між path (n, 2) і кожним з others (C, m, 2).
+    Динаміка рахується антидіагоналями: n + m кроків numpy на всі кандидати разом.
+    """
+    n, m = len(path), others.shape[1]
+    dist = haversine_m(path[None, :, None, 0], path[None, :, None, 1], others[:, None, :, 0], others[:, None, :, 1])
+    # ca[:, i, j] - для префіксів довжини i і j; рядок і стовпчик 0 - межа
+    ca = np.full((len(others), n + 1, m + 1), np.inf)
+    ca[:, 0, 0] = 0.0
+    for diagonal in range(2, n + m + 1):
+        i = np.arange(max(1, diagonal - m), min(n, diagonal - 1) + 1)
+        j = diagonal - i
+        reach = np.minimum(np.minimum(ca[:, i - 1, j], ca[:, i - 1, j - 1]), ca[:, i, j - 1])
+        ca[:, i, j] = np.maximum(dist[:, i - 1, j - 1], reach)
+    return ca[:, n, m]
+
+
+def load_tracks(activity_ids: Iterable[int]) -> Dict[int, tuple]:
+    """Координати треків пакета одним запитом: {activity_id: (lat, lon)}."""
+    rows = np.array(list(
+        ActivityPoint.objects.filter(activity_id__in=list(activity_ids))
+        .order_by('activity_id', 'recorded_at', 'id').values_list('activity_id', 'lat', 'lon')
+    ), dtype=np.float64).reshape(-1, 3)
+    tracks = {}
+    if len(rows):
+        starts = np.flatnonzero(np.diff(rows[:, 0], prepend=-1))
+        for chunk in np.split(rows, starts[1:]):
+            tracks[int(chunk[0, 0])] = (chunk[:, 1], chunk[:, 2])
+    return tracks
+
+
+# --- Індексація ---
+
+def _find_group(activity_id: int, activity_type: str, path: np.ndarray, keys: List[int]) -> Optional[int]:
+    """Група найближчого кандидата з LSH-кошиків або None."""
+    candidates = list(
+        RouteBucket.objects.filter(key__in=keys, activity__activity_type=activity_type,
+                                   activity__deleted_at__isnull=True)
+        .exclude(activity_id=activity_id)
+        .values('activity_id').annotate(hits=Count('id')).order_by('-hits', 'activity_id')
+        .values_list('activity_id', flat=True)[:MAX_CANDIDATES]
+    )
+    if not candidates:
+        return None
+    sketches = list(
+        RouteSketch.objects.filter(activity_id__in=candidates, group__isnull=False).values_list('group_id', 'path')
+    )
+    if not sketches:
+        return None
+    others = np.stack([np.frombuffer(bytes(raw), dtype='<f4').reshape(-1, 2) for _, raw in sketches]).astype(np.float64)
+    deviation = discrete_frechet(path, others)
+    best = int(np.argmin(deviation))
+    return sketches[best][0] if deviation[best] <= max_deviation_m() else None
+
+
+def index_activities(activity_ids: Iterable[int]) -> int:
+    """
+    (Пере)будовує відбитки і групи для активностей. Треки без достатньої кількості
+    точок або коротші за MIN_ROUTE_LENGTH_M не індексуються. Повертає кількість відбитків.
+    """
+    activities = dict(
+        Activity.objects.filter(id__in=list(activity_ids), deleted_at__isnull=True).values_list('id', 'activity_type')
+    )
+    tracks = load_tracks(activities)
+    indexed = 0
+    for activity_id, activity_type in activities.items():
+        lat, lon = tracks.get(activity_id, (np.empty(0), np.empty(0)))
+        with transaction.atomic():
+            remove_activities([activity_id])
+            if len(lat) < MIN_TRACK_POINTS:
+                continue
+            path, length = resample(lat, lon)
+            if length < MIN_ROUTE_LENGTH_M:
+                continue
+            signature = minhash(geohash_int(lat, lon, GEOHASH_PRECISION))
+            keys = band_keys(signature)
+            group_id = _find_group(activity_id, activity_type, path, keys)
+            if group_id is None:
+                group_id = RouteGroup.objects.create(activity_type=activity_type).id
+            RouteSketch.objects.create(
+                activity_id=activity_id, group_id=group_id,
+                signature=signature.astype('<u8').tobytes(),
+                path=path.astype('<f4').tobytes(), length_m=length, engine_version=ENGINE_VERSION,
+            )
+            RouteBucket.objects.bulk_create([RouteBucket(activity_id=activity_id, key=key) for key in keys])
+        indexed += 1
+    return indexed
+
+
+def index_after_commit(activity_ids: Iterable[int]) -> None:
+    """
+    Для запису, що змінює трек: застарілий відбиток зникає в поточній
+    транзакції, новий будується після її коміту. Помилка побудови лише
+    логується - запис уже закомічено.
+    """
+    activity_ids = sorted(set(activity_ids))
+    if not activity_ids:
+        return
+    remove_activities(activity_ids)
+    transaction.on_commit(partial(index_activities, activity_ids), robust=True)
+
+
+def remove_activities(activity_ids) -> None:
+    """Прибирає відбитки (список id або підзапит) і групи, що лишились порожніми."""
+    sketches = RouteSketch.objects.filter(activity_id__in=activity_ids)
+    group_ids = set(sketches.exclude(group__isnull=True).values_list('group_id', flat=True))
+    RouteBucket.objects.filter(activity_id__in=activity_ids).delete()
+    sketches.delete()
+    if group_ids:
+        RouteGroup.objects.filter(id__in=group_ids).annotate(size=Count('members')).filter(size=0).delete()
+
+
+# --- Читання ---
+
+def get_sketch(activity_id: int) -> Optional[RouteSketch]:
+    """Відбиток активності; якщо його немає (побудова після коміту не вдалась) або він старої версії - будується зараз."""
+    sketch = RouteSketch.objects.filter(activity_id=activity_id).first()
+    if sketch is None or sketch.engine_version != ENGINE_VERSION:
+        index_activities([activity_id])
+        sketch = RouteSketch.objects.filter(activity_id=activity_id).first()
+    return sketch
+
+
+def similar(activity_id: int, user_id: Optional[int] = None, limit: int = 20) -> dict:
+    """
+    Інші активності тієї ж групи маршруту, найшвидші першими, і місце цієї
+    активності за часом серед них. user_id обмежує вибірку активностями користувача.
+    """
+    activity = Activity.objects.filter(id=activity_id).values('id', 'duration_sec').first()
+    sketch = get_sketch(activity_id)
+    result = {'activity': activity_id, 'route_group': None, 'group_size': 1, 'rank': 1, 'similar': []}
+    if sketch is None or sketch.group_id is None:
+        return result
+
+    members = Activity.objects.filter(route__group_id=sketch.group_id, deleted_at__isnull=True)
+    if user_id is not None:
+        members = members.filter(user_id=user_id)
+    rows = list(
+        members.exclude(id=activity_id).order_by('duration_sec', 'id')
+        .values('id', 'user_id', 'start_time', 'duration_sec', 'distance_m', 'route__length_m')[:limit]
+    )
+    for row in rows:
+        row['user'] = row.pop('user_id')
+        row['route_length_m'] = round(row.pop('route__length_m'), 1)
+        row['pace_sec_per_km'] = round(row['duration_sec'] / row['distance_m'] * 1000, 1) if row['distance_m'] else None
+    result.update(
+        route_group=sketch.group_id,
+        group_size=members.count(),
+        rank=members.exclude(id=activity_id).filter(duration_sec__lt=activity['duration_sec']).count() + 1,
+        similar=rows,
+    )
+    return result
+
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import consumers
+
+# WebSocket-маршрути (підключаються в lab_3_with_Django/asgi.py)
+websocket_urlpatterns = [
+    path('ws/activities/<int:activity_id>/live/', consumers.LiveWatchConsumer.as_asgi()),
+    path('ws/activities/<int:activity_id>/live/publish/', consumers.LiveBeaconConsumer.as_asgi()),
+]
@@ -8,26 +8,92 @@ from .models import (
     Kudos,
     Follower,
     ActivityPoint,
-    UserMonthlyStats
+    UserMonthlyStats,
+    DeletionJob,
+    Notification,
+    ActivityEstimate,
+    Challenge,
+    ChallengeParticipant,
+    ChallengeSnapshot
 )
+from . import notifications
 
-class UserSerializer(serializers.ModelSerializer):
+def parse_field_list(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def sparse_fieldset(request, available):
+    """
+    Field names left after ?fields=a,b / ?exclude=c (order kept, 'id' always kept).
+    Unknown names are ignored.
+    """
+    include = set(parse_field_list(request.query_params.get('fields')))
+    exclude = set(parse_field_list(request.query_params.get('exclude')))
+    return [
+        name for name in available
+        if name == 'id' or ((not include or name in include) and name not in exclude)
+    ]
+
+
+class RepositoryModelSerializer(serializers.ModelSerializer):
+    """
+    Routes serializer.save(repository=...) through the DataAccessLayer
+    instead of the default Model.objects.create() / instance.save().
+    On GET requests it also honours sparse fieldsets (?fields= / ?exclude=).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None and request.method == 'GET' and (
+                'fields' in request.query_params or 'exclude' in request.query_params):
+            keep = set(sparse_fieldset(request, list(self.fields)))
+            for name in list(self.fields):
+                if name not in keep:
+                    self.fields.pop(name)
+
+    def create(self, validated_data):
+        repository = validated_data.pop('repository', None)
+        if repository is None:
+            return super().create(validated_data)
+        return repository.add(**validated_data)
+
+    def update(self, instance, validated_data):
+        repository = validated_data.pop('repository', None)
+        model_id = validated_data.pop('model_id', instance.pk)
+        if repository is None:
+            return super().update(instance, validated_data)
+        repository.update(model_id, **validated_data)
+        instance.refresh_from_db()
+        return instance
+
+class VisibleActivityField(serializers.PrimaryKeyRelatedField):
+    """Activity reference for child rows; soft-deleted activities are rejected as unknown (400)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(queryset=Activity.objects.filter(deleted_at__isnull=True), **kwargs)
+
+
+class UserSerializer(RepositoryModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'password']
         extra_kwargs = {'password': {'write_only': True}}
 
     def create(self, validated_data):
-        # Your create method is perfect, no changes needed.
-        user = User.objects.create_user(
+        # Registration goes through UserRepository.add() when a repository is passed
+        repository = validated_data.pop('repository', None)
+        fields = dict(
             username=validated_data['username'],
             email=validated_data.get('email', ''), # .get() is safer
             password=validated_data['password']
         )
-        return user
+        if repository is not None:
+            return repository.add(**fields)
+        return User.objects.create_user(**fields)
 
 # --- YOU WERE MISSING THIS ---
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(RepositoryModelSerializer):
     class Meta:
         model = Profile
         fields = '__all__'
@@ -37,42 +103,127 @@ class ProfileSerializer(serializers.ModelSerializer):
 
 # --- All other serializers, now more secure ---
 
-class ActivitySerializer(serializers.ModelSerializer):
+class TrackPointSerializer(serializers.ModelSerializer):
+    """A track point uploaded together with its activity."""
+    class Meta:
+        model = ActivityPoint
+        fields = ['lat', 'lon', 'recorded_at', 'ele', 'speed', 'cadence']
+
+class ActivitySerializer(RepositoryModelSerializer):
+    # Optional track, stored in one batch and used for the duplicate fingerprint
+    points = TrackPointSerializer(many=True, write_only=True, required=False)
+
     class Meta:
         model = Activity
         fields = '__all__'
         # This is the security fix:
         # Prevent users from creating activities for others.
-        read_only_fields = ('user',)
+        # The idempotency key comes from the 'Idempotency-Key' header.
+        # Soft delete goes through DELETE only (deleted_at), updated_at is the row version.
+        read_only_fields = (
+            'user', 'idempotency_key', 'fingerprint', 'kudos_count', 'deleted_at', 'updated_at',
+            'start_lat', 'start_lon', 'min_lat', 'min_lon', 'max_lat', 'max_lon', 'start_geohash',
+        )
+
+    def update(self, instance, validated_data):
+        # The track is only accepted on upload
+        validated_data.pop('points', None)
+        return super().update(instance, validated_data)
+
+class CommentSerializer(RepositoryModelSerializer):
+    activity = VisibleActivityField()
 
-class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = '__all__'
         # Prevent users from posting comments as others.
         read_only_fields = ('user',)
 
-class KudosSerializer(serializers.ModelSerializer):
+class KudosSerializer(RepositoryModelSerializer):
+    activity = VisibleActivityField()
+
     class Meta:
         model = Kudos
         fields = '__all__'
         # Prevent users from giving kudos as others.
         read_only_fields = ('user',)
 
-class FollowerSerializer(serializers.ModelSerializer):
+class FollowerSerializer(RepositoryModelSerializer):
     class Meta:
         model = Follower
         fields = '__all__'
         # 'follower' should be set by the server from request.user
         read_only_fields = ('follower',)
 
-class ActivityPointSerializer(serializers.ModelSerializer):
+class ActivityPointSerializer(RepositoryModelSerializer):
+    activity = VisibleActivityField()
+
     class Meta:
         model = ActivityPoint
         fields = '__all__'
+        # A re-sent point is returned as-is by the repository, not rejected
+        validators = []
 
-class UserMonthlyStatsSerializer(serializers.ModelSerializer):
+class UserMonthlyStatsSerializer(RepositoryModelSerializer):
     class Meta:
         model = UserMonthlyStats
         fields = '__all__'
-        read_only_fields = ('user',)
\ No newline at end of file
+        read_only_fields = ('user',)
+
+class DeletionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeletionJob
+        fields = '__all__'
+        # Progress is reported by the purge worker, never written through the API
+        read_only_fields = [f.name for f in DeletionJob._meta.fields]
+
+class NotificationSerializer(serializers.ModelSerializer):
+    summary = serializers.SerializerMethodField()
+    unread = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Notification
+        fields = ['id', 'kind', 'target_key', 'activity', 'count', 'actors', 'summary',
+                  'latest_at', 'created_at', 'read_at', 'unread']
+        read_only_fields = fields
+
+    def get_summary(self, obj):
+        return notifications.summary(obj)
+
+    def get_unread(self, obj):
+        return obj.read_at is None
+
+class ActivityEstimateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ActivityEstimate
+        exclude = ['stale']
+        read_only_fields = ['activity', 'calories_kcal', 'active_calories_kcal', 'met_avg', 'met_minutes',
+                            'relative_intensity', 'moving_time_sec', 'source', 'engine_version', 'computed_at']
+
+class ChallengeSerializer(RepositoryModelSerializer):
+    class Meta:
+        model = Challenge
+        fields = '__all__'
+        # Totals are maintained from the activity write path, the owner from request.user
+        read_only_fields = ('created_by', 'created_at', 'participant_count', 'completed_count', 'total_progress')
+
+    def validate(self, attrs):
+        starts_at = attrs.get('starts_at', getattr(self.instance, 'starts_at', None))
+        ends_at = attrs.get('ends_at', getattr(self.instance, 'ends_at', None))
+        if starts_at and ends_at and ends_at <= starts_at:
+            raise serializers.ValidationError({"ends_at": "ends_at must be after starts_at."})
+        if attrs.get('goal') is not None and attrs['goal'] <= 0:
+            raise serializers.ValidationError({"goal": "goal must be positive."})
+        return attrs
+
+class ChallengeParticipantSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChallengeParticipant
+        fields = '__all__'
+        read_only_fields = [f.name for f in ChallengeParticipant._meta.fields]
+
+class ChallengeSnapshotSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChallengeSnapshot
+        fields = '__all__'
+        read_only_fields = [f.name for f in ChallengeSnapshot._meta.fields]
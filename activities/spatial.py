@@ -0,0 +1,197 @@
+"""
+Пошук поблизу: активності, що стартували в радіусі від точки, і атлети поруч.
+
+Без індексу такий запит читав би всі ActivityPoint. Тому при збереженні точок
+треку Activity отримує точку старту, рамку треку і geohash старту
+(start_geohash, GEOHASH_PRECISION символів, звичайний B-tree індекс).
+Дозапис точок (add, add_bulk, live-трекінг) лише розширює рамку
+LEAST/GREATEST з тією, що вже в рядку, і перечитує першу точку по індексу
+(activity, recorded_at) - ціна не залежить від довжини треку. Повний
+перерахунок - тільки коли точки змінюють або видаляють.
+Пошук іде у два проходи:
+  1. кандидати: клітинка geohash точки запиту, не менша за радіус, і вісім
+     сусідніх. Префікс 'u4pr' - це діапазон start_geohash >= 'u4pr' AND
+     < 'u4pr~', тож пошук - кілька діапазонних сканів індексу однаково в
+     PostgreSQL і SQLite (без PostGIS); далі грубий фільтр рамкою кола;
+  2. уточнення в тому ж запиті: відстань haversine виразом SQL (у SQLite
+     SIN/COS/ASIN реєструє Django), відсів за радіусом і курсором,
+     ORDER BY (відстань, id) LIMIT - у Python приходить лише сторінка.
+Курсор сторінки - непрозора пара (відстань, id) останнього елемента.
+"""
+import base64
+import json
+import math
+from typing import Iterable, List, Optional, Tuple
+
+from django.db.models import F, Max, Min, OuterRef, Q, Subquery, Value
+from django.db.models.functions import ASin, Coalesce, Cos, Greatest, Least, Lower, Power, Radians, Sin, Sqrt
+from django.utils import timezone
+
+from . import versions
+from .geo import EARTH_RADIUS_M, geohash, geohash_cell_size_m, geohash_neighbourhood
+from .models import Activity, ActivityPoint
+
+GEOHASH_PRECISION = 9          # клітинка ~5 x 5 м - точність зберігання
+DEFAULT_RADIUS_M = 5000.0
+MAX_RADIUS_M = 100000.0
+
+# Поля Activity, які веде цей модуль
+INDEX_FIELDS = ('start_lat', 'start_lon', 'min_lat', 'min_lon', 'max_lat', 'max_lon', 'start_geohash')
+
+
+# --- Індексація ---
+
+def index_activities(activity_ids: Iterable[int]) -> int:
+    """
+    Перераховує точку старту, рамку і geohash активностей з їх точок (два
+    агрегатні запити на пакет). Активність без точок отримує порожні поля.
+    Викликається репозиторієм точок у транзакції зміни чи видалення точок.
+    """
+    activity_ids = set(activity_ids)
+    if not activity_ids:
+        return 0
+    bounds = {
+        row.pop('activity_id'): row for row in
+        ActivityPoint.objects.filter(activity_id__in=activity_ids).order_by().values('activity_id')
+        .annotate(min_lat=Min('lat'), min_lon=Min('lon'), max_lat=Max('lat'), max_lon=Max('lon'))
+    }
+    first = ActivityPoint.objects.filter(activity_id=OuterRef('id')).order_by('recorded_at', 'id')
+    starts = Activity.objects.filter(id__in=bounds).annotate(
+        first_lat=Subquery(first.values('lat')[:1]), first_lon=Subquery(first.values('lon')[:1]),
+    ).values_list('id', 'first_lat', 'first_lon')
+
+    empty = dict.fromkeys(INDEX_FIELDS)
+    fields = {activity_id: empty for activity_id in activity_ids}
+    for activity_id, lat, lon in starts:
+        fields[activity_id] = dict(bounds[activity_id], start_lat=lat, start_lon=lon,
+                                   start_geohash=geohash(lat, lon, GEOHASH_PRECISION))
+
+    now = timezone.now()
+    updated = 0
+    for activity_id, values in fields.items():
+        # Поля видно в API, тож разом з ними змінюється і версія рядка (ETag)
+        updated += Activity.objects.filter(id=activity_id).update(updated_at=now, **values)
+    if updated:
+        versions.bump(Activity)
+    return updated
+
+
+def extend_index(activity_id: int, points: Iterable[Tuple[float, float]]) -> int:
+    """
+    Геоіндекс після дозапису точок points [(lat, lon)]: рамка розширюється в
+    самому UPDATE, старт - перша точка з індексу (activity, recorded_at).
+    Рядок (і його версія) не змінюється, якщо точки лягли в рамку, а старт той самий.
+    """
+    lats, lons = [], []
+    for lat, lon in points:
+        lats.append(lat)
+        lons.append(lon)
+    if not lats:
+        return 0
+    first = ActivityPoint.objects.filter(activity_id=activity_id).order_by('recorded_at', 'id') \
+        .values_list('lat', 'lon').first()
+    if first is None:
+        return 0
+    start_lat, start_lon = first
+    box = {'min_lat': min(lats), 'min_lon': min(lons), 'max_lat': max(lats), 'max_lon': max(lons)}
+    changed = (
+        Q(min_lat__isnull=True) | Q(min_lat__gt=box['min_lat']) | Q(min_lon__gt=box['min_lon'])
+        | Q(max_lat__lt=box['max_lat']) | Q(max_lon__lt=box['max_lon'])
+        | ~Q(start_lat=start_lat) | ~Q(start_lon=start_lon)
+    )
+    # COALESCE: у SQLite LEAST/GREATEST з NULL дає NULL (рамки ще не було)
+    extended = {
+        name: Coalesce(bound(name, Value(box[name])), Value(box[name]))
+        for name, bound in (('min_lat', Least), ('min_lon', Least), ('max_lat', Greatest), ('max_lon', Greatest))
+    }
+    updated = Activity.objects.filter(changed, id=activity_id).update(
+        updated_at=timezone.now(), start_lat=start_lat, start_lon=start_lon,
+        start_geohash=geohash(start_lat, start_lon, GEOHASH_PRECISION), **extended,
+    )
+    if updated:
+        versions.bump(Activity)
+    return updated
+
+
+# --- Курсор ---
+
+def encode_cursor(distance_m: float, row_id: int) -> str:
+    # repr float повертає те саме число після розбору - порівняння курсора точне
+    raw = json.dumps([distance_m, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """(відстань, id) з курсора; ValueError - курсор пошкоджений."""
+    try:
+        distance_m, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(distance_m), int(row_id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+
+
+# --- Пошук ---
+
+def precision_for(radius_m: float, lat: float) -> int:
+    """Найдрібніша точність geohash, клітинка якої не менша за радіус (тоді 3 x 3 клітинки покривають коло)."""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        if min(geohash_cell_size_m(precision, lat)) >= radius_m:
+            return precision
+    return 1
+
+
+def candidates(queryset, lat: float, lon: float, radius_m: float):
+    """Кандидати з індексу: queryset, обмежений клітинками geohash і рамкою кола."""
+    cells = Q()
+    for cell in geohash_neighbourhood(lat, lon, precision_for(radius_m, lat)):
+        cells |= Q(start_geohash__gte=cell, start_geohash__lt=cell + '~')
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    queryset = queryset.filter(cells, start_lat__range=(lat - d_lat, lat + d_lat))
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat > 1e-6:
+        d_lon = math.degrees(radius_m / (EARTH_RADIUS_M * cos_lat))
+        # Через 180-й меридіан рамку не обрізаємо - це робить уточнення
+        if -180.0 <= lon - d_lon and lon + d_lon <= 180.0:
+            queryset = queryset.filter(start_lon__range=(lon - d_lon, lon + d_lon))
+    return queryset
+
+
+def distance_m(lat: float, lon: float):
+    """Вираз SQL: відстань haversine від (lat, lon) до точки старту активності, м."""
+    lat_r, lon_r = math.radians(lat), math.radians(lon)
+    a = Power(Sin((Radians(F('start_lat')) - lat_r) / 2), 2) \
+        + math.cos(lat_r) * Cos(Radians(F('start_lat'))) * Power(Sin((Radians(F('start_lon')) - lon_r) / 2), 2)
+    return 2 * EARTH_RADIUS_M * ASin(Sqrt(Least(a, Value(1.0))))
+
+
+def nearest(queryset, lat: float, lon: float, radius_m: float, limit: int,
+            after: Optional[Tuple[float, int]] = None, key: str = 'id') -> Tuple[List[Tuple[int, float]], Optional[str]]:
+    """
+    Сторінка [(key, відстань м)] у радіусі, найближчі першими, після курсора
+    after, і курсор наступної сторінки (None - далі нічого). key - колонка
+    результату; для 'user_id' кожен атлет іде один раз, за найближчим стартом
+    (GROUP BY з MIN відстані). Відстань, радіус і курсор рахує БД.
+    """
+    queryset = candidates(queryset, lat, lon, radius_m).order_by()
+    if key == 'id':
+        queryset = queryset.annotate(distance=distance_m(lat, lon))
+    else:
+        queryset = queryset.values(key).annotate(distance=Min(distance_m(lat, lon)))
+    queryset = queryset.filter(distance__lte=radius_m)
+    if after is not None:
+        queryset = queryset.filter(Q(distance__gt=after[0]) | Q(distance=after[0], **{f'{key}__gt': after[1]}))
+    rows = list(queryset.order_by('distance', key).values_list(key, 'distance')[:limit + 1])
+    page = [(row_key, round(distance, 1)) for row_key, distance in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last_key, last_distance = rows[limit - 1]
+        next_cursor = encode_cursor(last_distance, last_key)
+    return page, next_cursor
+
+
+def same_location(queryset, city: str, country: Optional[str] = None):
+    """Профілі з тим самим містом (і країною) без урахування регістру - по функціональному індексу."""
+    queryset = queryset.alias(city_key=Lower('city')).filter(city_key=city.strip().lower())
+    if country:
+        queryset = queryset.alias(country_key=Lower('country')).filter(country_key=country.strip().lower())
+    return queryset
@@ -0,0 +1,1214 @@
+import asyncio
+import datetime
+import json
+from io import StringIO
+from unittest import mock, skipUnless
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APITestCase
+
+from . import (authentication, backfill, challenges, deletion, estimation, fast_serializers, heatmap,
+               notifications, outbox, partitioning, records, renderers, throttling, versions)
+from .consumers import TokenAuthMiddleware
+from .models import (Activity, ActivityEstimate, ActivityPoint, ActivityPointRetentionLog, BackfillChunk, BackfillRun,
+                     Challenge, Comment, DeletionJob, Follower, Kudos, Notification, OutboxEvent, Profile,
+                     RouteSketch, UserMonthlyStats)
+from .repositories import BaseRepository, DataAccessLayer
+from .routing import websocket_urlpatterns
+from .serializer import ActivitySerializer
+
+
+def at(year: int, month: int, day: int = 15) -> datetime.datetime:
+    return datetime.datetime(year, month, day, 12, tzinfo=datetime.timezone.utc)
+
+
+class ApiTestCase(APITestCase):
+    """Два користувачі; запити йдуть від alice. Кеш (ліміти запитів, версії) порожній на старті."""
+
+    def setUp(self):
+        cache.clear()
+        throttling.get_backend().reset()
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        self.client.force_authenticate(self.alice)
+
+    def as_user(self, user) -> APIClient:
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    @staticmethod
+    def activity_payload(**fields) -> dict:
+        payload = dict(activity_type='running', start_time='2026-03-15T12:00:00Z', duration_sec=1800,
+                       distance_m=5000.0, elevation_gain_m=20, height=180)
+        payload.update(fields)
+        return payload
+
+    @staticmethod
+    def track(count: int = 5, lat: float = 50.45, lon: float = 30.52) -> list:
+        return [{'lat': lat + i * 0.001, 'lon': lon + i * 0.001, 'recorded_at': f"2026-03-15T12:{i:02d}:00Z"}
+                for i in range(count)]
+
+
+# --- Ідемпотентні завантаження ---
+
+class IdempotentUploadTests(ApiTestCase):
+
+    def test_same_idempotency_key_returns_original(self):
+        first = self.client.post('/api/activities/', self.activity_payload(), format='json',
+                                 HTTP_IDEMPOTENCY_KEY='upload-1')
+        again = self.client.post('/api/activities/', self.activity_payload(distance_m=9999.0), format='json',
+                                 HTTP_IDEMPOTENCY_KEY='upload-1')
+        self.assertEqual((first.status_code, again.status_code), (201, 200))
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(again.data['distance_m'], 5000.0)
+        self.assertEqual(Activity.objects.count(), 1)
+
+    def test_same_track_without_key_is_a_duplicate(self):
+        first = self.client.post('/api/activities/', self.activity_payload(points=self.track()), format='json')
+        again = self.client.post('/api/activities/', self.activity_payload(points=self.track()), format='json')
+        self.assertEqual((first.status_code, again.status_code), (201, 200))
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(ActivityPoint.objects.count(), 5)
+
+    def test_other_activity_type_or_user_is_not_a_duplicate(self):
+        self.client.post('/api/activities/', self.activity_payload(), format='json')
+        cycling = self.client.post('/api/activities/', self.activity_payload(activity_type='cycling'), format='json')
+        by_bob = self.as_user(self.bob).post('/api/activities/', self.activity_payload(), format='json')
+        self.assertEqual((cycling.status_code, by_bob.status_code), (201, 201))
+        self.assertEqual(Activity.objects.count(), 3)
+
+    def test_update_refreshes_fingerprint(self):
+        created = self.client.post('/api/activities/', self.activity_payload(), format='json')
+        self.client.patch(f"/api/activities/{created.data['id']}/", {'duration_sec': 2400}, format='json')
+        again = self.client.post('/api/activities/', self.activity_payload(), format='json')
+        self.assertEqual(again.status_code, 201)
+
+    def test_long_idempotency_key_rejected(self):
+        response = self.client.post('/api/activities/', self.activity_payload(), format='json',
+                                    HTTP_IDEMPOTENCY_KEY='k' * 65)
+        self.assertEqual(response.status_code, 400)
+
+
+# --- Kudos і підписки ---
+
+class ToggleTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.activity = Activity.objects.create(user=self.bob, activity_type='running', duration_sec=1, distance_m=1.0,
+                                                elevation_gain_m=0, height=0)
+        self.url = f"/api/activities/{self.activity.id}/kudos/"
+
+    def test_kudos_put_is_idempotent(self):
+        first, again = self.client.put(self.url), self.client.put(self.url)
+        self.assertEqual((first.status_code, again.status_code), (201, 200))
+        self.assertEqual(again.data['kudos_count'], 1)
+        self.assertEqual(Kudos.objects.count(), 1)
+
+    def test_kudos_delete_is_idempotent(self):
+        self.client.put(self.url)
+        self.as_user(self.bob).put(self.url)
+        first, again = self.client.delete(self.url), self.client.delete(self.url)
+        self.assertEqual((first.status_code, again.status_code), (200, 200))
+        self.assertEqual(again.data['kudos_count'], 1)
+        self.assertEqual(Activity.objects.get(id=self.activity.id).kudos_count, 1)
+
+    def test_kudos_on_missing_activity(self):
+        self.assertEqual(self.client.put('/api/activities/999999/kudos/').status_code, 404)
+
+    def test_duplicate_kudos_post_is_rejected(self):
+        data = {'activity': self.activity.id}
+        self.assertEqual(self.client.post('/api/kudos/', data).status_code, 201)
+        self.assertEqual(self.client.post('/api/kudos/', data).status_code, 400)
+        self.assertEqual(Activity.objects.get(id=self.activity.id).kudos_count, 1)
+
+    def test_follow_toggle(self):
+        url = f"/api/users/{self.bob.id}/follow/"
+        self.assertEqual([self.client.put(url).status_code for _ in range(2)], [201, 200])
+        self.assertEqual(Follower.objects.filter(follower=self.alice, followee=self.bob).count(), 1)
+        self.assertEqual([self.client.delete(url).status_code for _ in range(2)], [200, 200])
+        self.assertFalse(Follower.objects.exists())
+
+    def test_follow_self_or_missing_user(self):
+        self.assertEqual(self.client.put(f"/api/users/{self.alice.id}/follow/").status_code, 400)
+        self.assertEqual(self.client.put('/api/users/999999/follow/').status_code, 404)
+
+
+# --- Вибіркові поля і компактні формати ---
+
+class ResponseFormatTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.first = self.client.post('/api/activities/', self.activity_payload(), format='json').data
+        self.client.post('/api/activities/', self.activity_payload(activity_type='cycling', distance_m=20000.0),
+                         format='json')
+
+    def test_fields_on_list_and_retrieve(self):
+        listed = self.client.get('/api/activities/?fields=distance_m,activity_type,unknown')
+        single = self.client.get(f"/api/activities/{self.first['id']}/?fields=distance_m")
+        self.assertEqual([set(row) for row in listed.data], [{'id', 'distance_m', 'activity_type'}] * 2)
+        self.assertEqual(single.data, {'id': self.first['id'], 'distance_m': 5000.0})
+
+    def test_exclude(self):
+        response = self.client.get('/api/activities/?exclude=fingerprint,start_geohash,id')
+        self.assertIn('id', response.data[0])
+        self.assertNotIn('fingerprint', response.data[0])
+        self.assertNotIn('start_geohash', response.data[0])
+        self.assertIn('distance_m', response.data[0])
+
+    def test_fields_ignored_on_writes(self):
+        response = self.client.patch(f"/api/activities/{self.first['id']}/?fields=id", {'duration_sec': 2400},
+                                     format='json')
+        self.assertEqual(response.data['duration_sec'], 2400)
+
+    def test_columnar_list(self):
+        response = self.client.get('/api/activities/?fields=activity_type,distance_m&format=columns')
+        self.assertEqual(response['Content-Type'], 'application/vnd.fitness.columns+json')
+        body = response.json()
+        self.assertEqual(body['count'], 2)
+        self.assertEqual(sorted(body['columns']['activity_type']), ['cycling', 'running'])
+        self.assertEqual(len(body['columns']['id']), 2)
+
+    def test_to_columns_fills_missing_keys(self):
+        columns = renderers.to_columns([{'a': 1}, {'a': 2, 'b': 'x'}, {'b': 'y'}])
+        self.assertEqual(columns, {'count': 3, 'columns': {'a': [1, 2, None], 'b': [None, 'x', 'y']}})
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        response = self.client.get(f"/api/activities/{self.first['id']}/?fields=distance_m",
+                                   HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), {'id': self.first['id'], 'distance_m': 5000.0})
+
+
+# --- Швидка серіалізація списків ---
+
+class FastEncoderTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        started = datetime.datetime(2026, 3, 15, 12, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+        # Повний рядок (з геоіндексом і мікросекундами) і рядок, де всі nullable-колонки порожні
+        Activity.objects.create(user=self.alice, activity_type='running', duration_sec=1800.5, distance_m=5000.125,
+                                elevation_gain_m=20, height=180, start_time=started,
+                                end_time=started + datetime.timedelta(minutes=30), idempotency_key='k',
+                                start_lat=50.450001, start_lon=30.52, start_geohash='u8vxn')
+        Activity.objects.create(user=self.bob, duration_sec=0.0, distance_m=0.1, elevation_gain_m=0, height=0)
+        self.queryset = Activity.objects.order_by('id')
+
+    def encode(self, serializer_class, field_names=None):
+        encoder = fast_serializers.encoder_for(serializer_class, field_names)
+        return encoder.encode_all(BaseRepository.rows(self.queryset, encoder.columns))
+
+    def test_matches_serializer(self):
+        expected = [dict(row) for row in ActivitySerializer(self.queryset, many=True).data]
+        self.assertEqual(self.encode(ActivitySerializer), expected)
+        self.assertIsNone(expected[1]['start_time'])
+        self.assertEqual(expected[0]['start_time'], '2026-03-15T12:00:00.123456Z')
+
+    def test_matches_serializer_for_field_subset(self):
+        names = ('id', 'distance_m', 'end_time')
+        expected = [{name: row[name] for name in names} for row in ActivitySerializer(self.queryset, many=True).data]
+        self.assertEqual(self.encode(ActivitySerializer, names), expected)
+
+    def test_decimal_fields_use_drf_representation(self):
+        class DecimalSerializer(ActivitySerializer):
+            distance_m = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+            class Meta(ActivitySerializer.Meta):
+                fields = ['id', 'distance_m', 'start_lat']
+
+        expected = [dict(row) for row in DecimalSerializer(self.queryset, many=True).data]
+        self.assertEqual(self.encode(DecimalSerializer), expected)
+        self.assertEqual([row['distance_m'] for row in expected], ['5000.12', '0.10'])
+
+    def test_api_list_matches_serializer_path(self):
+        fast = self.client.get('/api/activities/').json()
+        with override_settings(FAST_SERIALIZATION=False):
+            cache.clear()
+            slow = self.client.get('/api/activities/').json()
+        self.assertEqual(sorted(fast, key=lambda row: row['id']), sorted(slow, key=lambda row: row['id']))
+
+    def test_method_fields_fall_back(self):
+        class WithMethodField(ActivitySerializer):
+            pace = serializers.SerializerMethodField()
+
+        self.assertIsNone(fast_serializers.encoder_for(WithMethodField))
+
+
+# --- Рекорди і тренди ---
+
+class RecordsTests(ApiTestCase):
+
+    def upload(self, days_ago: int, **fields):
+        start = timezone.now() - datetime.timedelta(days=days_ago)
+        response = self.client.post('/api/activities/', self.activity_payload(start_time=start.isoformat(), **fields),
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def records(self) -> dict:
+        return self.client.get(f"/api/users/{self.alice.id}/records/").data
+
+    def test_records_follow_uploads(self):
+        first = self.upload(3, duration_sec=1500, distance_m=5000.0)
+        second = self.upload(2, duration_sec=3600, distance_m=10000.0)
+        self.upload(1, activity_type='cycling', duration_sec=7200, distance_m=40000.0, elevation_gain_m=300)
+        result = self.records()
+        self.assertEqual((result['fastest_5k']['value'], result['fastest_5k']['activity_id']), (1500.0, first))
+        self.assertEqual((result['fastest_10k']['value'], result['longest_run']['activity_id']), (3600.0, second))
+        self.assertEqual(result['longest_ride']['value'], 40000.0)
+        self.assertEqual(result['biggest_climb']['value'], 300)
+
+    def test_editing_or_deleting_record_holder_recomputes(self):
+        fast = self.upload(3, duration_sec=1200, distance_m=5000.0)
+        self.upload(2, duration_sec=1500, distance_m=5000.0)
+        self.client.patch(f"/api/activities/{fast}/", {'duration_sec': 1800}, format='json')
+        self.assertEqual(self.records()['fastest_5k']['value'], 1500.0)
+        self.client.delete(f"/api/activities/{self.upload(1, duration_sec=1000, distance_m=5000.0)}/")
+        self.assertEqual(self.records()['fastest_5k']['value'], 1500.0)
+
+    def test_incremental_state_matches_rebuild(self):
+        ids = [self.upload(days, duration_sec=1800 + days, distance_m=4000.0 + 100 * days) for days in (40, 20, 9, 2)]
+        self.client.patch(f"/api/activities/{ids[1]}/", {'activity_type': 'cycling'}, format='json')
+        self.client.delete(f"/api/activities/{ids[2]}/")
+        incremental = self.client.get(f"/api/users/{self.alice.id}/trends/?days=60").data
+        incremental_records = self.records()
+        records.rebuild_user(self.alice.id)
+        rebuilt = records.get_trends(self.alice.id, days=60)
+        self.assertEqual(incremental_records, records.get_records(self.alice.id))
+        self.assertEqual(incremental['weekly'], rebuilt['weekly'])
+        for name in ('fitness', 'fatigue'):
+            np.testing.assert_allclose(incremental['daily'][name], rebuilt['daily'][name], atol=0.02)
+
+    def test_trends_shape(self):
+        self.upload(0, duration_sec=3600, distance_m=10000.0)
+        trends = self.client.get(f"/api/users/{self.alice.id}/trends/?days=14").data
+        self.assertEqual(len(trends['weekly']), records.SERIES_DAYS // 7)
+        self.assertEqual(trends['weekly'][-1]['distance_m'], 10000.0)
+        self.assertEqual(trends['weekly'][-1]['load'], 60.0)
+        self.assertEqual(len(trends['daily']['fitness']), 14)
+        self.assertGreater(trends['current']['fatigue'], trends['current']['fitness'])
+
+    def test_trends_validation(self):
+        self.assertEqual(self.client.get(f"/api/users/{self.alice.id}/trends/?days=x").status_code, 400)
+        self.assertEqual(self.client.get('/api/users/999999/trends/').status_code, 404)
+
+
+# --- М'яке видалення і purge_deletions ---
+
+class SoftDeleteTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.activity_id = self.client.post('/api/activities/', self.activity_payload(points=self.track()),
+                                            format='json').data['id']
+        bob = self.as_user(self.bob)
+        bob.put(f"/api/activities/{self.activity_id}/kudos/")
+        bob.post('/api/comments/', {'activity': self.activity_id, 'body': 'nice'}, format='json')
+
+    def test_delete_hides_activity_and_children(self):
+        response = self.client.delete(f"/api/activities/{self.activity_id}/")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['target'], response.data['status']), ('activity', 'pending'))
+        self.assertEqual(self.client.get(f"/api/activities/{self.activity_id}/").status_code, 404)
+        for url in ('/api/activities/', '/api/comments/', '/api/kudos/', '/api/activity-points/'):
+            self.assertEqual(self.client.get(url).data, [], url)
+        # Рядки ще в БД, але писати до прихованої активності не можна
+        self.assertEqual(ActivityPoint.objects.count(), 5)
+        comment = self.client.post('/api/comments/', {'activity': self.activity_id, 'body': 'late'}, format='json')
+        self.assertEqual(comment.status_code, 400)
+        self.assertEqual(self.client.put(f"/api/activities/{self.activity_id}/kudos/").status_code, 404)
+
+    def test_only_owner_deletes(self):
+        self.assertEqual(self.as_user(self.bob).delete(f"/api/activities/{self.activity_id}/").status_code, 403)
+        self.assertEqual(self.client.get(f"/api/activities/{self.activity_id}/").status_code, 200)
+
+    def test_deleted_at_is_read_only(self):
+        for client in (self.client, self.as_user(self.bob)):
+            client.patch(f"/api/activities/{self.activity_id}/", {'deleted_at': '2026-03-16T00:00:00Z'},
+                         format='json')
+        self.assertIsNone(Activity.objects.get(id=self.activity_id).deleted_at)
+        self.assertFalse(DeletionJob.objects.exists())
+
+    def test_purge_activity_in_batches(self):
+        self.client.delete(f"/api/activities/{self.activity_id}/")
+        self.assertEqual(deletion.run_pending(size=2), 1)
+        job = DeletionJob.objects.get()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.rows_deleted, 5 + 1 + 1 + 1)
+        self.assertFalse(Activity.objects.exists())
+        self.assertFalse(ActivityPoint.objects.exists() or Comment.objects.exists() or Kudos.objects.exists())
+
+    def test_purge_user_corrects_kudos_given(self):
+        other = self.client.post('/api/activities/', self.activity_payload(activity_type='cycling'),
+                                 format='json').data['id']
+        self.as_user(self.bob).put(f"/api/activities/{other}/kudos/")
+        self.assertEqual(self.as_user(self.bob).delete(f"/api/users/{self.bob.id}/").status_code, 202)
+        deletion.run_pending(size=1)
+        self.assertFalse(User.objects.filter(id=self.bob.id).exists())
+        self.assertFalse(Kudos.objects.exists() or Comment.objects.exists())
+        self.assertEqual(list(Activity.objects.values_list('kudos_count', flat=True)), [0, 0])
+
+    def test_admin_form_cannot_soft_delete(self):
+        staff = User.objects.create_superuser('root', 'root@example.com', 'x')
+        self.client.force_login(staff)
+        response = self.client.get(f"/admin/activities/activity/{self.activity_id}/change/")
+        self.assertNotIn('deleted_at', response.context['adminform'].form.fields)
+
+
+# --- Outbox ---
+
+class OutboxTests(ApiTestCase):
+
+    def event(self, object_id: str, op: str = outbox.UPDATE, **fields) -> OutboxEvent:
+        return OutboxEvent.objects.create(model='activity', object_id=object_id, op=op, **fields)
+
+    def test_events_follow_writes(self):
+        self.client.post('/api/users/', {'username': 'carol', 'password': 'secret-pass'}, format='json')
+        activity_id = self.client.post('/api/activities/', self.activity_payload(), format='json').data['id']
+        self.client.patch(f"/api/activities/{activity_id}/", {'duration_sec': 2400}, format='json')
+        self.client.delete(f"/api/activities/{activity_id}/")
+
+        batch = outbox.fetch_batch('warehouse')
+        self.assertEqual([event['seq'] for event in batch], list(range(1, len(batch) + 1)))
+        user_event = next(event for event in batch if event['model'] == 'user')
+        self.assertEqual(user_event['payload']['username'], 'carol')
+        self.assertNotIn('password', user_event['payload'])
+        activity_events = outbox.fetch_batch('warehouse', models=['activity'])
+        self.assertEqual([event['op'] for event in activity_events], ['create', 'update', 'delete'])
+        self.assertEqual(activity_events[1]['payload']['duration_sec'], 2400)
+
+    def test_late_commit_is_read_after_offset(self):
+        self.event('1', id=10)
+        self.event('2', id=20)
+        outbox.ack('warehouse', outbox.fetch_batch('warehouse')[-1]['seq'])
+        # Транзакція, що отримала id раніше, комітить подію вже після прочитаного зміщення
+        self.event('3', id=15)
+        late = outbox.fetch_batch('warehouse')
+        self.assertEqual([(event['id'], event['seq']) for event in late], [(15, 3)])
+
+    def test_ack_only_moves_forward(self):
+        outbox.ack('warehouse', 5)
+        outbox.ack('warehouse', 3)
+        self.assertEqual(outbox.get_offset('warehouse'), 5)
+
+    def test_compact_keeps_unread_events(self):
+        first, second = self.event('1'), self.event('1')
+        old_tombstone = self.event('2', op=outbox.DELETE)
+        OutboxEvent.objects.filter(id=old_tombstone.id).update(
+            created_at=timezone.now() - datetime.timedelta(days=30))
+        outbox.sequence()
+        outbox.get_offset('notifications')
+        self.assertEqual(outbox.compact(), {'superseded': 0, 'tombstones': 0})
+
+        outbox.ack('notifications', OutboxEvent.objects.get(id=old_tombstone.id).seq)
+        self.assertEqual(outbox.compact(tombstone_days=7), {'superseded': 1, 'tombstones': 1})
+        self.assertEqual(list(OutboxEvent.objects.values_list('id', flat=True)), [second.id])
+
+    def test_tail_outbox_commits_offset(self):
+        self.event('1')
+        self.event('2')
+        output = StringIO()
+        call_command('tail_outbox', consumer='warehouse', batch_size=1, stdout=output)
+        self.assertEqual([json.loads(line)['object_id'] for line in output.getvalue().splitlines()], ['1', '2'])
+        self.assertEqual(outbox.get_offset('warehouse'), 2)
+        output = StringIO()
+        call_command('tail_outbox', consumer='warehouse', stdout=output)
+        self.assertEqual(output.getvalue(), '')
+
+
+# --- Сповіщення ---
+
+class NotificationTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.activity_id = self.client.post('/api/activities/', self.activity_payload(), format='json').data['id']
+        self.fans = [self.bob] + [User.objects.create_user(name, password='x') for name in ('carol', 'dave', 'eve')]
+
+    def give_kudos(self, users):
+        for user in users:
+            self.as_user(user).put(f"/api/activities/{self.activity_id}/kudos/")
+
+    def test_kudos_are_grouped(self):
+        self.give_kudos([*self.fans, self.alice])
+        notifications.process_pending()
+        notification = Notification.objects.get()
+        self.assertEqual((notification.recipient_id, notification.kind, notification.count), (self.alice.id, 'kudos', 4))
+        self.assertEqual(notifications.summary(notification),
+                         'eve, dave, carol and 1 others gave kudos to your activity')
+
+    def test_later_batches_extend_open_group(self):
+        self.give_kudos(self.fans[:2])
+        notifications.process_pending()
+        self.give_kudos(self.fans[2:])
+        notifications.process_pending(batch_size=1)
+        self.assertEqual(list(Notification.objects.values_list('count', flat=True)), [4])
+        # Прочитана група закрита: наступний kudos відкриває нову
+        self.client.post('/api/notifications/read/', {}, format='json')
+        self.as_user(self.fans[0]).delete(f"/api/activities/{self.activity_id}/kudos/")
+        self.give_kudos(self.fans[:1])
+        notifications.process_pending()
+        self.assertEqual(sorted(Notification.objects.values_list('count', flat=True)), [1, 4])
+
+    def test_each_event_counted_once(self):
+        self.give_kudos(self.fans)
+        self.assertEqual(notifications.process_batch(batch_size=3), 3)
+        self.assertEqual(notifications.process_batch(batch_size=3), 1)
+        self.assertEqual(notifications.process_batch(batch_size=3), 0)
+        self.assertEqual(Notification.objects.get().count, 4)
+
+    def test_comments_replies_and_follows(self):
+        bob = self.as_user(self.bob)
+        comment = bob.post('/api/comments/', {'activity': self.activity_id, 'body': 'nice'}, format='json').data
+        self.client.post('/api/comments/', {'activity': self.activity_id, 'body': 'thanks',
+                                            'parent_comment': comment['id']}, format='json')
+        bob.put(f"/api/users/{self.alice.id}/follow/")
+        call_command('fanout_notifications', stdout=StringIO())
+        kinds = set(Notification.objects.values_list('recipient__username', 'kind', 'target_key'))
+        self.assertEqual(kinds, {
+            ('alice', 'comment', f"activity:{self.activity_id}"),
+            ('bob', 'reply', f"comment:{comment['id']}"),
+            ('alice', 'follow', f"user:{self.alice.id}"),
+        })
+
+    def test_feed_and_read(self):
+        self.give_kudos(self.fans)
+        self.as_user(self.bob).put(f"/api/users/{self.alice.id}/follow/")
+        notifications.process_pending()
+        feed = self.client.get('/api/notifications/').data
+        self.assertEqual((len(feed['results']), feed['unread_count']), (2, 2))
+        self.assertEqual(feed['results'][0]['summary'], 'bob started following you')
+        self.assertEqual(self.as_user(self.bob).get('/api/notifications/').data['results'], [])
+
+        marked = self.client.post('/api/notifications/read/', {'ids': [feed['results'][0]['id']]}, format='json')
+        self.assertEqual((marked.data['marked_read'], marked.data['unread_count']), (1, 1))
+        bad = self.client.post('/api/notifications/read/', {'ids': 'all'}, format='json')
+        self.assertEqual(bad.status_code, 400)
+
+
+# --- Оцінка калорій і MET ---
+
+class EstimationTests(ApiTestCase):
+
+    def upload(self, **fields) -> int:
+        return self.client.post('/api/activities/', self.activity_payload(elevation_gain_m=0, **fields),
+                                format='json').data['id']
+
+    def estimate(self, activity_id: int) -> dict:
+        return self.client.get(f"/api/activities/{activity_id}/estimate/").data
+
+    def test_summary_running_matches_acsm(self):
+        result = self.estimate(self.upload())
+        # 5 км за 30 хв: 166.7 м/хв -> VO2 = 3.5 + 0.2 * 166.7 = 36.83 мл/кг/хв; типова вага 70 кг
+        self.assertEqual(result['source'], 'summary')
+        self.assertAlmostEqual(result['calories_kcal'], 36.83 * 30 * 70 * 5 / 1000, delta=0.2)
+        self.assertEqual(result['moving_time_sec'], 1800.0)
+        self.assertLess(result['active_calories_kcal'], result['calories_kcal'])
+
+    def test_constant_met_and_track_source(self):
+        yoga = self.estimate(self.upload(activity_type='yoga', duration_sec=3600, distance_m=0.0))
+        self.assertAlmostEqual(yoga['calories_kcal'], 2.5 * 3.5 * 60 * 70 * 5 / 1000, delta=0.1)
+        # 5 точок з кроком 1 хв: рухомий час - 4 сегменти, а не duration_sec
+        tracked = self.estimate(self.upload(points=self.track()))
+        self.assertEqual((tracked['source'], tracked['moving_time_sec']), ('track', 240.0))
+
+    def test_stored_until_inputs_change(self):
+        activity_id = self.upload()
+        first = self.estimate(activity_id)
+        self.assertEqual(self.estimate(activity_id), first)
+        self.client.patch(f"/api/activities/{activity_id}/", {'height': 175}, format='json')
+        self.assertFalse(ActivityEstimate.objects.get(activity_id=activity_id).stale)
+        self.client.patch(f"/api/activities/{activity_id}/", {'duration_sec': 2400}, format='json')
+        self.assertTrue(ActivityEstimate.objects.get(activity_id=activity_id).stale)
+        self.assertLess(self.estimate(activity_id)['met_avg'], first['met_avg'])
+
+    def test_profile_weight_changes_estimates(self):
+        activity_id = self.upload()
+        default = self.estimate(activity_id)['calories_kcal']
+        self.client.post('/api/profiles/', {'display_name': 'Alice', 'weight_kg': 90.0}, format='json')
+        self.assertTrue(ActivityEstimate.objects.get(activity_id=activity_id).stale)
+        self.assertAlmostEqual(self.estimate(activity_id)['calories_kcal'], default * 90 / 70, delta=0.2)
+
+    def test_estimate_command_fills_pending(self):
+        ids = [self.upload(start_time=f"2026-03-{day:02d}T12:00:00Z") for day in (1, 2, 3)]
+        call_command('estimate_activities', batch_size=2, stdout=StringIO())
+        self.assertEqual(sorted(ActivityEstimate.objects.filter(stale=False).values_list('activity_id', flat=True)),
+                         ids)
+        self.assertFalse(estimation.pending_ids().exists())
+
+
+# --- Ліміти запитів ---
+
+@override_settings(THROTTLE_BUCKETS={'default': {'capacity': 3, 'refill_per_sec': 0.5}})
+class ThrottlingTests(ApiTestCase):
+
+    def test_exhausted_bucket_returns_429_with_retry_after(self):
+        # list коштує 5 токенів - більше за місткість, тож списується все відро
+        self.assertEqual(self.client.get('/api/activities/').status_code, 200)
+        response = self.client.get('/api/activities/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '6')
+
+    def test_cost_depends_on_action(self):
+        activity = Activity.objects.create(user=self.alice, activity_type='running', duration_sec=1, distance_m=1.0,
+                                           elevation_gain_m=0, height=0)
+        statuses = [self.client.get(f"/api/activities/{activity.id}/").status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+    def test_buckets_are_per_user(self):
+        self.client.get('/api/activities/')
+        self.assertEqual(self.as_user(self.bob).get('/api/activities/').status_code, 200)
+
+    @override_settings(THROTTLE_BUCKETS={'default': {'capacity': 3, 'refill_per_sec': 0}})
+    def test_non_positive_rate_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.client.get('/api/activities/')
+
+    def test_take_tokens_refills_up_to_capacity(self):
+        state, wait = throttling.take_tokens(None, 100.0, capacity=3, refill_per_sec=0.5, cost=3)
+        self.assertEqual((state, wait), ((0, 100.0), 0.0))
+        state, wait = throttling.take_tokens(state, 102.0, capacity=3, refill_per_sec=0.5, cost=2)
+        self.assertEqual((state, wait), ((1.0, 102.0), 2.0))
+        state, wait = throttling.take_tokens(state, 1000.0, capacity=3, refill_per_sec=0.5, cost=1)
+        self.assertEqual((state, wait), ((2.0, 1000.0), 0.0))
+
+
+# --- Теплові карти ---
+
+@override_settings(HEATMAP_MIN_ZOOM=10, HEATMAP_MAX_ZOOM=10)
+class HeatmapTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/activities/', self.activity_payload(points=self.track(count=5)), format='json')
+        self.activity_id = response.data['id']
+        x, y, _, _ = heatmap.project(np.array([50.45]), np.array([30.52]), 10)
+        self.url = f"/api/heatmap/10/{int(x[0])}/{int(y[0])}.json"
+
+    def total(self, client=None, scope: str = '') -> int:
+        response = (client or self.client).get(self.url + scope)
+        self.assertEqual(response.status_code, 200)
+        return sum(count for _, _, count in response.data['pixels'])
+
+    def test_new_points_appear_after_incremental_update(self):
+        self.assertEqual(self.total(), 0)
+        heatmap.update_incremental()
+        self.assertEqual(self.total(), 5)
+        self.assertEqual(self.total(scope='?scope=me'), 5)
+        self.assertEqual(self.total(self.as_user(self.bob), '?scope=me'), 0)
+
+    def test_deleted_point_is_subtracted(self):
+        heatmap.update_incremental()
+        point = ActivityPoint.objects.filter(activity_id=self.activity_id).first()
+        self.assertEqual(self.client.delete(f"/api/activity-points/{point.id}/").status_code, 204)
+        self.assertEqual(self.total(), 4)
+
+    def test_delete_before_incremental_update(self):
+        # Видалення випередило додавання: від'ємний піксель не видно, після додавання сума точна
+        point = ActivityPoint.objects.filter(activity_id=self.activity_id).first()
+        self.client.delete(f"/api/activity-points/{point.id}/")
+        self.assertEqual(self.total(), 0)
+        heatmap.update_incremental()
+        self.assertEqual(self.total(), 4)
+
+    def test_rebuild_matches_incremental(self):
+        heatmap.update_incremental()
+        incremental = self.client.get(self.url).data['pixels']
+        heatmap.rebuild(workers=0)
+        self.assertEqual(self.client.get(self.url).data['pixels'], incremental)
+        heatmap.update_incremental()
+        self.assertEqual(self.total(), 5)
+
+    def test_png_tile(self):
+        response = self.client.get(self.url.replace('.json', '.png'))
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+
+
+# --- Партиції і зберігання треків ---
+
+class RetentionTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('alice', password='x')
+        self.activity = Activity.objects.create(user=user, activity_type='running', duration_sec=600,
+                                                distance_m=2000.0, elevation_gain_m=0, height=0)
+        ActivityPoint.objects.bulk_create([
+            ActivityPoint(activity=self.activity, lat=50.0 + i * 0.001, lon=30.0,
+                          recorded_at=at(2025, 1, 10) + datetime.timedelta(seconds=i))
+            for i in range(10)
+        ])
+
+    def test_downsample_keeps_every_nth_point(self):
+        deleted = partitioning.downsample_month(2025, 1, 5)
+        self.assertEqual(deleted, 8)
+        kept = ActivityPoint.objects.order_by('recorded_at').values_list('lat', flat=True)
+        self.assertEqual([round(lat, 3) for lat in kept], [50.0, 50.005])
+        self.assertTrue(ActivityPointRetentionLog.objects.filter(year=2025, month=1, rows_deleted=8).exists())
+
+    @override_settings(ACTIVITY_POINT_RETENTION={'FULL_RESOLUTION_MONTHS': 1, 'KEEP_EVERY_NTH': 5,
+                                                 'DROP_AFTER_MONTHS': None, 'PARTITIONS_AHEAD': 0})
+    def test_retention_downsamples_each_month_once(self):
+        self.assertEqual(partitioning.apply_retention()['downsampled'], {'2025-01': 8})
+        self.assertEqual(partitioning.apply_retention()['downsampled'], {})
+
+    def test_drop_months_before(self):
+        ActivityPoint.objects.create(activity=self.activity, lat=50.0, lon=30.0, recorded_at=at(2025, 2))
+        partitioning.drop_months_before(2025, 2)
+        self.assertEqual(ActivityPoint.objects.count(), 1)
+
+    @skipUnless(connection.vendor == 'postgresql', "Partitioning needs PostgreSQL")
+    def test_convert_keeps_indexes(self):
+        self.assertEqual(partitioning.convert_to_partitioned(), 10)
+        self.assertTrue(partitioning.is_partitioned())
+        with connection.cursor() as cursor:
+            parent = connection.introspection.get_constraints(cursor, partitioning.PARENT_TABLE)
+            january = connection.introspection.get_constraints(cursor, partitioning.partition_name(2025, 1))
+        for constraints in (parent, january):
+            indexed = [info['columns'] for info in constraints.values() if info['index']]
+            self.assertIn(['recorded_at'], indexed)
+            self.assertIn(['activity_id'], indexed)
+        self.assertEqual(ActivityPoint.objects.filter(activity=self.activity).count(), 10)
+
+
+class BackfillTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+
+    def activity(self, user, **fields) -> Activity:
+        values = dict(activity_type='running', start_time=at(2026, 3), duration_sec=1800, distance_m=5000.0,
+                      elevation_gain_m=0, height=0)
+        values.update(fields)
+        return Activity.objects.create(user=user, **values)
+
+    # --- Чанки і чекпоінти ---
+
+    def test_chunks_cover_id_range(self):
+        activities = [self.activity(self.alice) for _ in range(7)]
+        run = backfill.run('kudos_count', workers=0, chunk_size=3)
+
+        chunks = list(run.chunks.order_by('start_id').values_list('start_id', 'end_id', 'status', 'rows'))
+        self.assertEqual(run.status, 'done')
+        self.assertEqual(run.rows_processed, 7)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[0][0], activities[0].id)
+        self.assertEqual(chunks[-1][1], activities[-1].id + 1)
+        for (_, end, _, _), (start, _, _, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, start)
+        self.assertEqual([status for _, _, status, _ in chunks], ['done'] * 3)
+        self.assertEqual([rows for _, _, _, rows in chunks], [3, 3, 1])
+
+    def test_resume_after_failed_chunk(self):
+        activities = [self.activity(self.alice) for _ in range(6)]
+        failing_start = activities[2].id
+        calls = []
+        process_range = backfill.KudosCountBackfill.process_range
+
+        def flaky(instance, start_id, end_id):
+            calls.append(start_id)
+            if start_id == failing_start and calls.count(start_id) == 1:
+                raise RuntimeError("connection lost")
+            return process_range(instance, start_id, end_id)
+
+        with mock.patch.object(backfill.KudosCountBackfill, 'process_range', flaky):
+            with self.assertRaises(RuntimeError):
+                backfill.run('kudos_count', workers=0, chunk_size=2)
+            run = BackfillRun.objects.get(name='kudos_count')
+            self.assertEqual(run.status, 'failed')
+            statuses = dict(run.chunks.values_list('start_id', 'status'))
+            self.assertEqual(statuses, {activities[0].id: 'done', failing_start: 'failed', activities[4].id: 'pending'})
+            self.assertIn("connection lost", run.chunks.get(start_id=failing_start).error)
+
+            resumed = backfill.run('kudos_count', workers=0, chunk_size=2)
+
+        # Той самий запуск: завершений чанк не повторюється, невдалий і решта - виконуються
+        self.assertEqual(resumed.id, run.id)
+        self.assertEqual(resumed.status, 'done')
+        self.assertEqual(resumed.rows_processed, 6)
+        self.assertEqual(calls, [activities[0].id, failing_start, failing_start, activities[4].id])
+        self.assertFalse(BackfillChunk.objects.filter(run=resumed).exclude(status='done').exists())
+
+    def test_restart_starts_new_run(self):
+        self.activity(self.alice)
+        with mock.patch.object(backfill.KudosCountBackfill, 'process_range', side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                backfill.run('kudos_count', workers=0)
+        first = BackfillRun.objects.get(name='kudos_count')
+
+        second = backfill.run('kudos_count', workers=0, restart=True)
+        first.refresh_from_db()
+        self.assertNotEqual(second.id, first.id)
+        self.assertEqual(first.status, 'failed')
+        self.assertEqual(second.status, 'done')
+
+    def test_unknown_backfill(self):
+        with self.assertRaises(ValueError):
+            backfill.run('no_such_backfill', workers=0)
+
+    # --- Зареєстровані перерахунки ---
+
+    def test_kudos_count_repairs_drift(self):
+        liked = self.activity(self.alice)
+        ignored = self.activity(self.alice)
+        untouched = self.activity(self.bob)
+        kudos = DataAccessLayer().kudos
+        kudos.give(liked.id, self.bob.id)
+        kudos.give(liked.id, self.alice.id)
+        kudos.give(untouched.id, self.alice.id)
+        Activity.objects.filter(id=liked.id).update(kudos_count=0)
+        Activity.objects.filter(id=ignored.id).update(kudos_count=5)
+        version = Activity.objects.get(id=untouched.id).updated_at
+
+        backfill.run('kudos_count', workers=0, chunk_size=2)
+
+        counts = dict(Activity.objects.values_list('id', 'kudos_count'))
+        self.assertEqual(counts, {liked.id: 2, ignored.id: 0, untouched.id: 1})
+        # Правильні лічильники не переписуються (ETag рядка не змінюється)
+        self.assertEqual(Activity.objects.get(id=untouched.id).updated_at, version)
+
+    def test_monthly_stats_recomputes_totals(self):
+        self.activity(self.alice, start_time=at(2026, 3, 2), distance_m=5000.0, duration_sec=1800)
+        self.activity(self.alice, start_time=at(2026, 3, 20), distance_m=7000.0, duration_sec=2400)
+        self.activity(self.alice, start_time=at(2026, 4), distance_m=1000.0, duration_sec=600)
+        self.activity(self.bob, start_time=at(2026, 3), distance_m=3000.0, duration_sec=900)
+        self.activity(self.bob, start_time=at(2026, 3), distance_m=9000.0, duration_sec=9000,
+                      deleted_at=at(2026, 4))
+        self.activity(self.bob, start_time=None)
+        # Застарілий рядок перезаписується, а не дублюється
+        UserMonthlyStats.objects.create(user=self.alice, year=2026, month=3, total_distance_m=1.0,
+                                        total_duration_sec=1)
+
+        backfill.run('monthly_stats', workers=0, chunk_size=2)
+
+        stats = {
+            (row['user_id'], row['year'], row['month']): (row['total_distance_m'], row['total_duration_sec'])
+            for row in UserMonthlyStats.objects.values('user_id', 'year', 'month', 'total_distance_m',
+                                                       'total_duration_sec')
+        }
+        self.assertEqual(stats, {
+            (self.alice.id, 2026, 3): (12000.0, 4200),
+            (self.alice.id, 2026, 4): (1000.0, 600),
+            (self.bob.id, 2026, 3): (3000.0, 900),
+        })
+
+    def test_monthly_stats_rerun_is_idempotent(self):
+        self.activity(self.alice, distance_m=5000.0, duration_sec=1800)
+        backfill.run('monthly_stats', workers=0)
+        backfill.run('monthly_stats', workers=0, restart=True)
+        row = UserMonthlyStats.objects.get(user=self.alice)
+        self.assertEqual((row.total_distance_m, row.total_duration_sec), (5000.0, 1800))
+
+
+# --- Умовні GET (ETag / Last-Modified) ---
+
+class ConditionalGetTests(ApiTestCase):
+    """Версії колекцій підвищуються після коміту, тож записи йдуть через captureOnCommitCallbacks."""
+
+    def write(self, method: str, url: str, data=None, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(client or self.client, method)(url, data, format='json')
+
+    def get(self, url: str, etag: str = None):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag) if etag else self.client.get(url)
+
+    def test_retrieve_not_modified_until_row_changes(self):
+        activity_id = self.write('post', '/api/activities/', self.activity_payload()).data['id']
+        url = f"/api/activities/{activity_id}/"
+        first = self.get(url)
+        self.assertTrue(first.has_header('Last-Modified'))
+        self.assertEqual(self.get(url, first['ETag']).status_code, 304)
+        self.write('patch', url, {'duration_sec': 2400})
+        changed = self.get(url, first['ETag'])
+        self.assertEqual((changed.status_code, changed.data['duration_sec']), (200, 2400))
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+    def test_etag_depends_on_representation(self):
+        activity_id = self.write('post', '/api/activities/', self.activity_payload()).data['id']
+        url = f"/api/activities/{activity_id}/"
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(f"{url}?fields=distance_m", etag).status_code, 200)
+        self.assertEqual(self.get(f"{url}?format=columns", etag).status_code, 200)
+
+    def test_list_not_modified_until_collection_changes(self):
+        self.write('post', '/api/activities/', self.activity_payload())
+        etag = self.get('/api/activities/')['ETag']
+        self.assertEqual(self.get('/api/activities/', etag).status_code, 304)
+        self.write('post', '/api/activities/', self.activity_payload(activity_type='cycling'))
+        self.assertEqual(len(self.get('/api/activities/', etag).data), 2)
+
+    def test_soft_delete_invalidates_child_lists(self):
+        activity_id = self.write('post', '/api/activities/', self.activity_payload(points=self.track())).data['id']
+        etag = self.get('/api/activity-points/')['ETag']
+        self.write('delete', f"/api/activities/{activity_id}/")
+        stale = self.get('/api/activity-points/', etag)
+        self.assertEqual((stale.status_code, stale.data), (200, []))
+
+    def test_user_delete_invalidates_activity_lists(self):
+        bob = self.as_user(self.bob)
+        self.write('post', '/api/activities/', self.activity_payload(points=self.track()), client=bob)
+        etags = {url: self.get(url)['ETag'] for url in ('/api/activities/', '/api/activity-points/')}
+        self.write('delete', f"/api/users/{self.bob.id}/", client=bob)
+        for url, etag in etags.items():
+            self.assertEqual(self.get(url, etag).data, [], url)
+
+    def test_bump_increments_once_per_commit(self):
+        before = versions.current(Activity)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                versions.bump(Activity)
+        self.assertEqual(versions.current(Activity)[0], before + 1)
+
+    def test_rolled_back_bump_is_dropped(self):
+        before = versions.current(Activity)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    versions.bump(Activity)
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+            versions.bump(Profile)
+        self.assertEqual(versions.current(Activity)[0], before)
+        with self.captureOnCommitCallbacks(execute=True):
+            versions.bump(Activity)
+        self.assertEqual(versions.current(Activity)[0], before + 1)
+
+
+# --- Той самий маршрут ---
+
+class RouteTests(ApiTestCase):
+
+    @staticmethod
+    def route(lat: float = 50.45, lon: float = 30.5193, shift: float = 0.0) -> list:
+        # 20 точок на північ з кроком ~55 м (~1 км) посередині стовпчика geohash-клітинок;
+        # shift зсуває трек на схід (0.00001° ~ 0.7 м)
+        return [{'lat': lat + i * 0.0005, 'lon': lon + shift, 'recorded_at': f"2026-03-15T12:{i:02d}:00Z"}
+                for i in range(20)]
+
+    def upload(self, points, client=None, **fields) -> int:
+        payload = self.activity_payload(points=points, duration_sec=fields.pop('duration_sec', 1800), **fields)
+        return (client or self.client).post('/api/activities/', payload, format='json').data['id']
+
+    def similar(self, activity_id: int, query: str = ''):
+        return self.client.get(f"/api/activities/{activity_id}/similar/{query}")
+
+    def test_same_route_grouped_fastest_first(self):
+        mine = self.upload(self.route(), duration_sec=1800)
+        again = self.upload(self.route(shift=0.00002), duration_sec=1700)
+        by_bob = self.upload(self.route(shift=-0.00002), client=self.as_user(self.bob), duration_sec=1600)
+        self.upload(self.route(lat=50.40))
+        self.upload(self.route(), activity_type='cycling')
+
+        result = self.similar(mine).data
+        self.assertEqual((result['group_size'], result['rank']), (3, 3))
+        self.assertEqual([row['id'] for row in result['similar']], [by_bob, again])
+        self.assertEqual(result['similar'][0]['user'], self.bob.id)
+        self.assertEqual([row['id'] for row in self.similar(mine, '?scope=me').data['similar']], [again])
+
+    def test_short_track_has_no_group(self):
+        result = self.similar(self.upload(self.route()[:5])).data
+        self.assertEqual((result['route_group'], result['similar']), (None, []))
+
+    def test_point_edit_regroups_after_commit(self):
+        first = self.upload(self.route())
+        second = self.upload(self.route(shift=0.00002), duration_sec=1700)
+        point = ActivityPoint.objects.filter(activity_id=second).order_by('recorded_at').last()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f"/api/activity-points/{point.id}/", {'lat': 50.60}, format='json')
+        self.assertTrue(RouteSketch.objects.filter(activity_id=second).exists())
+        self.assertEqual(self.similar(first).data['similar'], [])
+
+    def test_deleted_activity_leaves_group(self):
+        first = self.upload(self.route())
+        second = self.upload(self.route(shift=0.00002), duration_sec=1700)
+        self.client.delete(f"/api/activities/{second}/")
+        self.assertEqual(self.similar(first).data['group_size'], 1)
+        self.assertEqual(self.similar(second).status_code, 404)
+
+    def test_invalid_limit(self):
+        self.assertEqual(self.similar(self.upload(self.route()), '?limit=x').status_code, 400)
+
+
+# --- Пошук поблизу ---
+
+class NearbyTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Старти на північ від (50.45, 30.52) з кроком 0.01° (~1.1 км)
+        self.ids = [
+            self.client.post('/api/activities/', self.activity_payload(
+                points=self.track(lat=50.45 + i * 0.01), duration_sec=1800 + i), format='json').data['id']
+            for i in range(4)
+        ]
+
+    def nearby(self, query: str):
+        return self.client.get(f"/api/activities/nearby/?lat=50.45&lon=30.52{query}")
+
+    def test_nearest_first_within_radius(self):
+        results = self.nearby('&radius=2500').data['results']
+        self.assertEqual([row['id'] for row in results], self.ids[:3])
+        self.assertEqual(results[0]['distance_from_query_m'], 0.0)
+        self.assertAlmostEqual(results[1]['distance_from_query_m'], 1112, delta=5)
+        self.assertEqual(results[1]['distance_m'], 5000.0)
+
+    def test_cursor_pages_cover_all_once(self):
+        seen, response = [], self.nearby('&limit=3')
+        while True:
+            seen += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(seen, self.ids)
+
+    def test_type_filter(self):
+        self.assertEqual(self.nearby('&type=cycling').data['results'], [])
+
+    def test_invalid_query(self):
+        for query in ('', '?lat=50.45', '?lat=x&lon=30.52', '?lat=91&lon=30.52',
+                      '?lat=50.45&lon=30.52&radius=0', '?lat=50.45&lon=30.52&cursor=bad'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f"/api/activities/nearby/{query}").status_code, 400)
+
+    def test_profiles_nearby_excludes_self(self):
+        Profile.objects.create(user=self.alice, display_name='Alice')
+        Profile.objects.create(user=self.bob, display_name='Bob')
+        self.as_user(self.bob).post('/api/activities/', self.activity_payload(points=self.track(lat=50.46)),
+                                    format='json')
+        results = self.client.get('/api/profiles/nearby/?lat=50.45&lon=30.52').data['results']
+        self.assertEqual([row['user'] for row in results], [self.bob.id])
+        self.assertAlmostEqual(results[0]['distance_from_query_m'], 1112, delta=5)
+
+
+# --- Live-трекінг ---
+
+class IdentityCacheTests(TestCase):
+
+    def setUp(self):
+        authentication.identity_cache.clear()
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        Profile.objects.create(user=self.alice, display_name='Alice')
+        Profile.objects.create(user=self.bob, display_name='Bob')
+        self.key = Token.objects.create(user=self.alice).key
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.key}")
+
+    def test_hit_served_from_process_cache(self):
+        authentication.CachedTokenAuthentication().authenticate_credentials(self.key)
+        with self.assertNumQueries(0):
+            user, _ = authentication.CachedTokenAuthentication().authenticate_credentials(self.key)
+        self.assertEqual(user.profile.display_name, 'Alice')
+
+    def test_invalidation_from_another_process(self):
+        authentication.CachedTokenAuthentication().authenticate_credentials(self.key)
+        # Інший воркер деактивував користувача: локальний кеш цього процесу не чіпали
+        User.objects.filter(id=self.alice.id).update(is_active=False)
+        authentication.bump_generation(self.alice.id)
+        with self.assertRaises(AuthenticationFailed):
+            authentication.CachedTokenAuthentication().authenticate_credentials(self.key)
+
+    def test_other_profiles_read_from_database(self):
+        bob_key = Token.objects.create(user=self.bob).key
+        authentication.CachedTokenAuthentication().authenticate_credentials(bob_key)
+        Profile.objects.filter(user=self.bob).update(display_name='Robert')
+
+        response = self.client.get(f"/api/profiles/{self.bob.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['display_name'], 'Robert')
+        response = self.client.get(f"/api/profiles/{self.alice.id}/")
+        self.assertEqual(response.data['display_name'], 'Alice')
+
+
+class ChallengeTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        self.challenge = Challenge.objects.create(title='March', metric='distance_m', goal=10000.0,
+                                                  starts_at=at(2026, 3, 1), ends_at=at(2026, 4, 1))
+        for user in (self.alice, self.bob):
+            challenges.join(self.challenge, user.id)
+
+    def run_for(self, user, distance_m: float):
+        DataAccessLayer().activities.add(user=user, activity_type='running', start_time=at(2026, 3), duration_sec=1800,
+                                         distance_m=distance_m, elevation_gain_m=0, height=0)
+
+    def test_activity_write_leaves_challenge_row_alone(self):
+        self.run_for(self.alice, 12000.0)
+        self.challenge.refresh_from_db()
+        self.assertEqual((self.challenge.total_progress, self.challenge.completed_count), (0.0, 0))
+
+        challenges.take_snapshot(self.challenge)
+        self.challenge.refresh_from_db()
+        self.assertEqual((self.challenge.total_progress, self.challenge.completed_count), (12000.0, 1))
+        self.assertEqual(self.challenge.snapshots.get().total_progress, 12000.0)
+
+    def test_rank_from_latest_snapshot_or_live(self):
+        self.run_for(self.alice, 3000.0)
+        self.assertIsNone(challenges.participant_rank(self.challenge.id, self.bob.id)['rank'])
+        challenges.take_snapshot(self.challenge)
+        self.run_for(self.bob, 5000.0)
+
+        me = challenges.participant_rank(self.challenge.id, self.bob.id)
+        self.assertEqual((me['rank'], me['progress']), (2, 5000.0))
+        self.assertIsNotNone(me['ranked_at'])
+        self.assertEqual(challenges.participant_rank(self.challenge.id, self.bob.id, live=True)['rank'], 1)
+
+
+class AdminBatchDeleteTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('root', 'root@example.com', 'x'))
+        owner = User.objects.create_user('alice', password='x')
+        self.activity = Activity.objects.create(user=owner, activity_type='running', duration_sec=1, distance_m=1.0,
+                                                elevation_gain_m=0, height=0)
+        ActivityPoint.objects.bulk_create([
+            ActivityPoint(activity=self.activity, lat=50.0, lon=30.0, recorded_at=at(2026, 3, day))
+            for day in range(1, 6)
+        ])
+
+    def test_delete_in_batches_asks_for_confirmation(self):
+        url = f"/admin/activities/activitypoint/?activity__id__exact={self.activity.id}"
+        data = {'action': 'delete_in_batches', 'select_across': '1', '_selected_action': ['1']}
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'admin/delete_in_batches_confirmation.html')
+        self.assertEqual(ActivityPoint.objects.count(), 5)
+
+        response = self.client.post(url, dict(data, post='yes'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ActivityPoint.objects.count(), 0)
+
+
+def sample(second: int, lat: float = 50.45) -> dict:
+    return {'lat': lat + second * 0.001, 'lon': 30.52, 'recorded_at': f"2026-10-01T10:00:{second:02d}Z"}
+
+
+@override_settings(LIVE_FLUSH_BATCH=1000, LIVE_FLUSH_INTERVAL_SEC=3600, LIVE_IDLE_TIMEOUT_SEC=0.2)
+class LiveTrackingTests(TransactionTestCase):
+    """Споживачі працюють у потоках database_sync_to_async, тож дані мають бути закомічені."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('runner', password='x')
+        self.fan = User.objects.create_user('fan', password='x')
+        Follower.objects.create(follower=self.fan, followee=self.owner)
+        self.activity = Activity.objects.create(user=self.owner, activity_type='running', duration_sec=0,
+                                                distance_m=0.0, elevation_gain_m=0, height=0)
+        self.tokens = {user.id: Token.objects.create(user=user).key for user in (self.owner, self.fan)}
+        self.application = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    async def connect(self, user, publish: bool = False) -> WebsocketCommunicator:
+        path = f"/ws/activities/{self.activity.id}/live/{'publish/' if publish else ''}?token={self.tokens[user.id]}"
+        communicator = WebsocketCommunicator(self.application, path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def saved_track(self):
+        return await sync_to_async(list)(
+            ActivityPoint.objects.filter(activity=self.activity).order_by('recorded_at').values_list('lat', flat=True)
+        )
+
+    async def distance(self) -> float:
+        return (await Activity.objects.aget(id=self.activity.id)).distance_m
+
+    async def test_publish_watch_finish(self):
+        watcher = await self.connect(self.fan)
+        publisher = await self.connect(self.owner, publish=True)
+
+        await publisher.send_json_to({'type': 'samples', 'samples': [sample(0), sample(1)]})
+        received = await watcher.receive_json_from()
+        self.assertEqual([point['recorded_at'] for point in received['samples']],
+                         ['2026-10-01T10:00:00+00:00', '2026-10-01T10:00:01+00:00'])
+
+        await publisher.send_json_to({'type': 'finish'})
+        finished = await publisher.receive_json_from()
+        self.assertEqual(finished['type'], 'finished')
+        self.assertGreater(finished['activity']['distance_m'], 100)
+        self.assertEqual((await watcher.receive_json_from())['type'], 'finished')
+        self.assertEqual(len(await self.saved_track()), 2)
+        await publisher.wait()
+        await watcher.disconnect()
+
+    async def test_drop_keeps_session_open_and_reconnect_resumes(self):
+        watcher = await self.connect(self.fan)
+        publisher = await self.connect(self.owner, publish=True)
+        await publisher.send_json_to({'type': 'samples', 'samples': [sample(0), sample(1)]})
+        await watcher.receive_json_from()
+
+        # Розрив: точки збережено, але активність ще не фіналізовано
+        await publisher.disconnect()
+        self.assertEqual(len(await self.saved_track()), 2)
+        self.assertEqual(await self.distance(), 0.0)
+
+        publisher = await self.connect(self.owner, publish=True)
+        # Телефон повторює вже збережену точку - її відкинуто, нову розіслано
+        await publisher.send_json_to({'type': 'samples', 'samples': [sample(1), sample(2)]})
+        received = await watcher.receive_json_from()
+        self.assertEqual([point['recorded_at'] for point in received['samples']], ['2026-10-01T10:00:02+00:00'])
+
+        # Таймер першого з'єднання спрацював, але сесію продовжує нове
+        await asyncio.sleep(0.4)
+        self.assertTrue(await watcher.receive_nothing(0.05))
+        self.assertEqual(await self.distance(), 0.0)
+
+        await publisher.send_json_to({'type': 'finish'})
+        self.assertEqual((await publisher.receive_json_from())['type'], 'finished')
+        self.assertEqual(len(await self.saved_track()), 3)
+        await publisher.wait()
+        await watcher.disconnect()
+
+    async def test_reconnect_restores_tail_for_new_watchers(self):
+        publisher = await self.connect(self.owner, publish=True)
+        await publisher.send_json_to({'type': 'samples', 'samples': [sample(0), sample(1)]})
+        await publisher.disconnect()
+
+        publisher = await self.connect(self.owner, publish=True)
+        watcher = await self.connect(self.fan)
+        tail = await watcher.receive_json_from()
+        self.assertEqual([point['recorded_at'] for point in tail['samples']],
+                         ['2026-10-01T10:00:00+00:00', '2026-10-01T10:00:01+00:00'])
+        await publisher.send_json_to({'type': 'finish'})
+        await publisher.receive_json_from()
+        await publisher.wait()
+        await watcher.disconnect()
+
+    async def test_abandoned_session_finalized_after_idle_timeout(self):
+        watcher = await self.connect(self.fan)
+        publisher = await self.connect(self.owner, publish=True)
+        await publisher.send_json_to({'type': 'samples', 'samples': [sample(0), sample(1)]})
+        await watcher.receive_json_from()
+        await publisher.disconnect()
+        self.assertTrue(await watcher.receive_nothing(0.05))
+
+        finished = await watcher.receive_json_from(timeout=2)
+        self.assertEqual(finished['type'], 'finished')
+        self.assertGreater(await self.distance(), 100)
+        await watcher.disconnect()
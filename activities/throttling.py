@@ -0,0 +1,158 @@
+"""
+Обмеження частоти запитів: token bucket на пару (користувач, клас ендпоінта).
+
+Кожен запит списує з відра `cost` токенів залежно від дії (list/звіти дорожчі
+за retrieve). Відро поповнюється з постійною швидкістю до `capacity`.
+Якщо токенів бракує - 429 із заголовком Retry-After (його ставить DRF за wait()).
+"""
+import math
+import threading
+import time
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+DEFAULT_BUCKETS = {
+    'default': {'capacity': 120, 'refill_per_sec': 2.0},
+}
+DEFAULT_COSTS = {
+    'list': 5,
+    'retrieve': 1,
+    'create': 2,
+    'update': 2,
+    'partial_update': 2,
+    'destroy': 2,
+}
+
+
+def take_tokens(state: Optional[Tuple[float, float]], now: float, capacity: float,
+                refill_per_sec: float, cost: float) -> Tuple[Tuple[float, float], float]:
+    """
+    Чиста арифметика token bucket (refill_per_sec > 0 - перевіряє get_bucket).
+    Повертає (новий стан (tokens, timestamp), скільки секунд чекати; 0 - дозволено).
+    """
+    tokens, last = state if state else (capacity, now)
+    tokens = min(capacity, tokens + max(0.0, now - last) * refill_per_sec)
+    if tokens >= cost:
+        return (tokens - cost, now), 0.0
+    return (tokens, now), (cost - tokens) / refill_per_sec
+
+
+# --- Сховища лічильників ---
+
+class InProcessBucketBackend:
+    """Лічильники в пам'яті процесу. Для тестів і розробки з одним процесом."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, cost: float, capacity: float, refill_per_sec: float) -> float:
+        with self._lock:
+            state, wait = take_tokens(self._buckets.get(key), time.monotonic(), capacity, refill_per_sec, cost)
+            self._buckets[key] = state
+        return wait
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketBackend:
+    """
+    Спільні лічильники в кеші Django (Redis/Memcached у продакшені), тож ліміт
+    діє на всі воркери. Читання-зміна-запис стану відра захищене коротким
+    локом через атомарний cache.add.
+    """
+    lock_timeout = 1
+    lock_attempts = 20
+
+    def __init__(self, alias: str = 'default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', self.alias)]
+
+    def consume(self, key: str, cost: float, capacity: float, refill_per_sec: float) -> float:
+        cache = self.cache
+        lock_key = f"{key}:lock"
+        locked = False
+        for _ in range(self.lock_attempts):
+            if cache.add(lock_key, 1, timeout=self.lock_timeout):
+                locked = True
+                break
+            time.sleep(0.001)
+        try:
+            state, wait = take_tokens(cache.get(key), time.time(), capacity, refill_per_sec, cost)
+            # Повне відро можна забути: після цього часу воно однаково наповниться
+            cache.set(key, state, timeout=math.ceil(capacity / refill_per_sec) + 1)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return wait
+
+
+_backend = None
+_backend_path = None
+
+
+def get_backend():
+    global _backend, _backend_path
+    path = getattr(settings, 'THROTTLE_BACKEND', 'activities.throttling.CacheBucketBackend')
+    if _backend is None or _backend_path != path:
+        _backend = import_string(path)()
+        _backend_path = path
+    return _backend
+
+
+# --- DRF throttle ---
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Ліміт на (користувач або IP, throttle_scope ViewSet-а).
+    Вартість дії: view.throttle_costs -> settings.THROTTLE_COSTS -> 1.
+    """
+
+    def __init__(self):
+        self._wait = 0.0
+
+    def get_scope(self, view) -> str:
+        return getattr(view, 'throttle_scope', None) or 'default'
+
+    def get_bucket(self, scope: str) -> dict:
+        buckets = {**DEFAULT_BUCKETS, **getattr(settings, 'THROTTLE_BUCKETS', {})}
+        bucket = buckets.get(scope, buckets['default'])
+        # Нульова швидкість дала б нескінченний Retry-After (і 500 замість 429)
+        if not (bucket.get('capacity', 0) > 0 and bucket.get('refill_per_sec', 0) > 0):
+            raise ImproperlyConfigured(
+                f"THROTTLE_BUCKETS[{scope!r}] needs a positive 'capacity' and 'refill_per_sec'."
+            )
+        return bucket
+
+    def get_cost(self, view) -> float:
+        action = getattr(view, 'action', None) or 'default'
+        costs = {**DEFAULT_COSTS, **getattr(settings, 'THROTTLE_COSTS', {}), **getattr(view, 'throttle_costs', {})}
+        return costs.get(action, 1)
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(view)
+        bucket = self.get_bucket(scope)
+        if request.user and request.user.is_authenticated:
+            ident = f"user:{request.user.pk}"
+        else:
+            ident = f"anon:{self.get_ident(request)}"
+
+        # Дорожча за місткість дія інакше ніколи б не пройшла
+        cost = min(self.get_cost(view), bucket['capacity'])
+        self._wait = get_backend().consume(
+            f"throttle:{scope}:{ident}", cost, bucket['capacity'], bucket['refill_per_sec']
+        )
+        return self._wait == 0
+
+    def wait(self):
+        return self._wait
@@ -14,6 +14,10 @@ router.register(r'kudos', views.KudosViewSet, basename='kudos')
 router.register(r'followers', views.FollowerViewSet, basename='follower')
 router.register(r'activity-points', views.ActivityPointViewSet, basename='activitypoint')
 router.register(r'user-stats', views.UserMonthlyStatsViewSet, basename='userstats')
+router.register(r'deletion-jobs', views.DeletionJobViewSet, basename='deletionjob')
+router.register(r'notifications', views.NotificationViewSet, basename='notification')
+router.register(r'auth', views.AuthViewSet, basename='auth')
+router.register(r'challenges', views.ChallengeViewSet, basename='challenge')
 
 # Реєструємо звіт (оскільки це не ModelViewSet)
 router.register(r'reports/global-stats', views.GlobalStatsReport, basename='report-stats')
@@ -21,4 +25,9 @@ router.register(r'reports/global-stats', views.GlobalStatsReport, basename='repo
 # urlpatterns тепер автоматично генеруються роутером
 urlpatterns = [
     path('', include(router.urls)),
+    path(
+        'heatmap/<int:z>/<int:x>/<int:y>.<str:fmt>',
+        views.HeatmapViewSet.as_view({'get': 'tile'}),
+        name='heatmap-tile'
+    ),
 ]
\ No newline at end of file
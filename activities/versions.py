@@ -0,0 +1,88 @@
+"""
+Версії колекцій для умовних GET-запитів до списків (ETag / Last-Modified).
+
+Кожен запис, що змінює вміст списку (репозиторії, purge_deletions, політика
+зберігання треків, backfill), викликає bump() у своїй транзакції: версія
+колекції зростає разом із даними. Перевірка списку - один lookup за первинним
+ключем у CollectionVersion замість читання і серіалізації всієї таблиці.
+
+Рядок версії один на модель і гарячий: UPDATE у транзакції запису тримав би
+його заблокованим до коміту, і всі записи моделі (разом з усім, що вони ще
+роблять після bump()) йшли б по одному. Тому в транзакції bump() лише
+позначає колекцію в множині очікуваних інкрементів потоку і реєструє
+transaction.on_commit, а сам UPDATE виконується після коміту в автокоміті, з
+блокуванням на час одного оператора, - один на колекцію, скільки б разів bump()
+не викликали. Відкат транзакції скасовує і інкремент.
+Між комітом і інкрементом (мить у тому ж потоці) список може віддати 304 за
+старою версією; тіло, прочитане в цю мить, отримує стару версію і
+перезапитується після інкремента - застарілим воно не лишається.
+"""
+import datetime
+import threading
+from functools import partial
+from typing import Tuple
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CollectionVersion
+
+# Колекції, чий інкремент чекає на коміт поточної транзакції потоку
+_pending = threading.local()
+
+
+def collection_name(model) -> str:
+    return model._meta.model_name
+
+
+def bump(model) -> None:
+    """Підвищує версію колекції: одразу поза транзакцією, інакше - після її коміту."""
+    name = collection_name(model)
+    if not connection.in_atomic_block:
+        increment(name)
+        return
+    _pending_names().add(name)
+    transaction.on_commit(partial(flush, name))
+
+
+def _pending_names() -> set:
+    # З'єднання Django належить потоку, тож множина потоку - це множина з'єднання
+    if not hasattr(_pending, 'names'):
+        _pending.names = set()
+    return _pending.names
+
+
+def flush(name: str) -> None:
+    """Callback коміту: UPDATE виконує лише перший callback колекції, повторні bump() транзакції - ні."""
+    # Позначка з відкоченої транзакції лишається без callback-а: інкремент дасть лише наступний коміт
+    names = _pending_names()
+    if name in names:
+        names.discard(name)
+        increment(name)
+
+
+def increment(name: str) -> None:
+    now = timezone.now()
+    if CollectionVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=now):
+        return
+    try:
+        with transaction.atomic():
+            CollectionVersion.objects.create(name=name, version=1, updated_at=now)
+    except IntegrityError:
+        # Рядок щойно створила паралельна транзакція
+        CollectionVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=now)
+
+
+def current(model) -> Tuple[int, datetime.datetime]:
+    """(версія, час останньої зміни) колекції; перший виклик заводить рядок з версією 0."""
+    name = collection_name(model)
+    row = CollectionVersion.objects.filter(name=name).values_list('version', 'updated_at').first()
+    if row is None:
+        try:
+            with transaction.atomic():
+                state = CollectionVersion.objects.create(name=name, version=0, updated_at=timezone.now())
+            row = (state.version, state.updated_at)
+        except IntegrityError:
+            row = CollectionVersion.objects.filter(name=name).values_list('version', 'updated_at').first()
+    return row
@@ -1,9 +1,16 @@
-from rest_framework import viewsets, status
+import hashlib
+from rest_framework import viewsets, status, serializers
 from rest_framework.response import Response
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.pagination import CursorPagination
+from django.contrib.auth import logout as session_logout
 from django.contrib.auth.models import User
+from rest_framework.authtoken.serializers import AuthTokenSerializer
 from .models import (
-    Activity, Profile, Comment, Kudos, Follower, ActivityPoint, UserMonthlyStats
+    Activity, Profile, Comment, Kudos, Follower, ActivityPoint, UserMonthlyStats, DeletionJob,
+    Notification, Challenge, ChallengeSnapshot
 )
 from .serializer import (
     ActivitySerializer,
@@ -13,11 +20,25 @@ from .serializer import (
     FollowerSerializer,
     ActivityPointSerializer,
     UserMonthlyStatsSerializer,
-    UserSerializer
+    UserSerializer,
+    DeletionJobSerializer,
+    NotificationSerializer,
+    ActivityEstimateSerializer,
+    ChallengeSerializer,
+    ChallengeParticipantSerializer,
+    ChallengeSnapshotSerializer,
+    sparse_fieldset
 )
 from .repositories import DataAccessLayer
+from .fast_serializers import encoder_for
+from django.conf import settings
 from django.db import IntegrityError
-from django.http import Http404
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.utils.urls import replace_query_param
+from . import challenges, estimation, heatmap, notifications, records, routes, spatial, versions
 
 
 # --- БАЗОВИЙ КЛАС, ЯКИЙ ВИКОНУЄ УМОВУ 3 ---
@@ -51,11 +72,107 @@ class RepositoryViewSet(viewsets.ModelViewSet):
             self.repo = self.db.activity_points
         elif model_name == 'usermonthlystats':
             self.repo = self.db.user_stats
+        elif model_name == 'challenge':
+            self.repo = self.db.challenges
         else:
             raise ValueError(f"Repository for model {model_name} not found in DataAccessLayer")
 
+    # Списки серіалізуються швидким шляхом (values_list + скомпільований енкодер),
+    # якщо це дозволено тут і в settings.FAST_SERIALIZATION
+    fast_list = True
+
+    # Умовні GET: retrieve порівнює ETag з версією рядка (repo.get_version),
+    # list - з версією колекції (versions.py). 304 віддається без серіалізації.
+    row_versioned = False
+    collection_versioned = False
+
     def get_queryset(self):
-        return self.repo.get_all()
+        return self.repo.get_all(fields=self.get_model_fields())
+
+    def get_row_encoder(self):
+        if not (self.fast_list and getattr(settings, 'FAST_SERIALIZATION', False)):
+            return None
+        field_names = None
+        params = self.request.query_params
+        if 'fields' in params or 'exclude' in params:
+            readable = [name for name, field in self.get_serializer().fields.items() if not field.write_only]
+            field_names = tuple(sparse_fieldset(self.request, readable))
+        return encoder_for(self.get_serializer_class(), field_names)
+
+    # --- Умовні запити (ETag / Last-Modified) ---
+
+    def representation_etag(self, *version) -> str:
+        """Сильний ETag: версія даних + формат відповіді + параметри (?fields=, ?exclude=, ...)."""
+        params = sorted(self.request.query_params.lists())
+        raw = repr((self.queryset.model._meta.label_lower, self.request.accepted_renderer.format, params, version))
+        return '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+
+    def not_modified(self, etag: str, changed_at):
+        # Last-Modified має точність до секунди; точна перевірка - за ETag
+        response = get_conditional_response(self.request, etag=etag, last_modified=int(changed_at.timestamp()))
+        if response is not None:
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @staticmethod
+    def set_validators(response, etag: str, changed_at):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(changed_at.timestamp())
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.row_versioned:
+            return super().retrieve(request, *args, **kwargs)
+        # Один lookup за ключем лише по колонці версії
+        updated_at = self.repo.get_version(self.kwargs["pk"])
+        if updated_at is None:
+            raise Http404
+        not_modified = self.not_modified(self.representation_etag(updated_at.isoformat()), updated_at)
+        if not_modified is not None:
+            return not_modified
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        # Валідатори - від щойно прочитаного рядка, щоб вони точно відповідали тілу
+        return self.set_validators(response, self.representation_etag(instance.updated_at.isoformat()), instance.updated_at)
+
+    def list(self, request, *args, **kwargs):
+        if not self.collection_versioned:
+            return self.list_response(request, *args, **kwargs)
+        model = self.queryset.model
+        version = versions.current(model)
+        etag = self.representation_etag(version[0], version[1].isoformat())
+        not_modified = self.not_modified(etag, version[1])
+        if not_modified is not None:
+            return not_modified
+        response = self.list_response(request, *args, **kwargs)
+        # Запис, закомічений під час читання списку, підвищує версію одразу після коміту - тоді тіло новіше за неї
+        if versions.current(model) == version:
+            self.set_validators(response, etag, version[1])
+        return response
+
+    def list_response(self, request, *args, **kwargs):
+        encoder = self.get_row_encoder()
+        if encoder is None or self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(encoder.encode_all(self.repo.rows(queryset, encoder.columns)))
+
+    def get_model_fields(self):
+        """
+        Колонки моделі, потрібні для ?fields= / ?exclude= у списку (None - всі).
+        Передаються в репозиторій як .only(), тож зайві колонки не читаються з БД.
+        """
+        params = self.request.query_params
+        if self.action != 'list' or not ('fields' in params or 'exclude' in params):
+            return None
+        concrete = {f.name for f in self.queryset.model._meta.concrete_fields}
+        names = [
+            field.source for field in self.get_serializer().fields.values()
+            if not field.write_only and field.source in concrete
+        ]
+        return names or None
 
     def get_object(self):
         obj = self.repo.get_by_id(self.kwargs["pk"])
@@ -75,6 +192,16 @@ class RepositoryViewSet(viewsets.ModelViewSet):
     def perform_destroy(self, instance):
         self.repo.delete(id=instance.pk)
 
+    def schedule_destroy(self, instance):
+        """
+        Видалення у фоні (для моделей з великим каскадом): об'єкт прихований одразу,
+        у відповіді 202 - задача DeletionJob, прогрес якої видно в /api/deletion-jobs/.
+        """
+        job = self.repo.schedule_delete(instance.pk, requested_by_id=self.request.user.id)
+        if job is None:
+            raise Http404
+        return Response(DeletionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
 
 # --- CRUD ДЛЯ USER ---
 class UserViewSet(RepositoryViewSet):
@@ -88,12 +215,99 @@ class UserViewSet(RepositoryViewSet):
             return [AllowAny()]
         return [IsAuthenticated()]
 
+    @action(detail=True, methods=['get'], url_path='records')
+    def records(self, request, pk=None):
+        """GET /api/users/<pk>/records/ - особисті рекорди (оновлюються при записі активностей)."""
+        if not self.db.users.get_by_id(pk):
+            raise Http404
+        return Response(records.get_records(int(pk)), status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='trends')
+    def trends(self, request, pk=None):
+        """GET /api/users/<pk>/trends/?days=90 - тижневі обсяги і криві fitness/fatigue."""
+        if not self.db.users.get_by_id(pk):
+            raise Http404
+        try:
+            days = int(request.query_params.get('days', 90))
+        except ValueError:
+            raise serializers.ValidationError({"error": "days must be an integer."})
+        return Response(records.get_trends(int(pk), days=days), status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['put', 'delete'], url_path='follow')
+    def follow(self, request, pk=None):
+        """
+        PUT /api/users/<pk>/follow/ - підписатися, DELETE - відписатися.
+        Ідемпотентно: повтор не створює дубліката і не кидає помилку.
+        """
+        followee_id = int(pk)
+        if followee_id == request.user.id:
+            raise serializers.ValidationError({"error": "You cannot follow yourself."})
+
+        if request.method == 'PUT':
+            follow_id, followee_exists = self.db.followers.follow(request.user.id, followee_id)
+            if not followee_exists:
+                raise Http404
+            return Response(
+                {"followee": followee_id, "following": True},
+                status=status.HTTP_201_CREATED if follow_id else status.HTTP_200_OK
+            )
+
+        self.db.followers.unfollow(request.user.id, followee_id)
+        return Response({"followee": followee_id, "following": False}, status=status.HTTP_200_OK)
+
+    def destroy(self, request, *args, **kwargs):
+        user = self.get_object()
+        if user != request.user and not request.user.is_staff:
+            raise PermissionDenied("You can only delete your own account.")
+        return self.schedule_destroy(user)
+
+
+# --- ПОШУК ПОБЛИЗУ ---
+def nearby_query(request):
+    """(lat, lon, radius, limit, курсор) з ?lat=&lon=&radius=&limit=&cursor= (див. spatial.py)."""
+    params = request.query_params
+    try:
+        lat, lon = float(params['lat']), float(params['lon'])
+        radius = float(params.get('radius', spatial.DEFAULT_RADIUS_M))
+        limit = min(max(int(params.get('limit', 20)), 1), 100)
+    except KeyError:
+        raise serializers.ValidationError({"error": "lat and lon are required."})
+    except ValueError:
+        raise serializers.ValidationError({"error": "lat, lon, radius and limit must be numbers."})
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        raise serializers.ValidationError({"error": "lat must be within [-90, 90] and lon within [-180, 180]."})
+    if not 0 < radius <= spatial.MAX_RADIUS_M:
+        raise serializers.ValidationError({"error": f"radius must be in (0, {spatial.MAX_RADIUS_M:.0f}] metres."})
+    after = None
+    if params.get('cursor'):
+        try:
+            after = spatial.decode_cursor(params['cursor'])
+        except ValueError:
+            raise serializers.ValidationError({"error": "Invalid cursor."})
+    return lat, lon, radius, limit, after
+
+
+def nearby_response(request, results, next_cursor):
+    """Та сама форма, що й у курсорної пагінації: {'next': url, 'results': [...]}."""
+    next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor) if next_cursor else None
+    return Response({"next": next_url, "results": results}, status=status.HTTP_200_OK)
+
+
+class SameCityPagination(CursorPagination):
+    """Атлети з того ж міста: курсор по user_id."""
+    ordering = ('user_id',)
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
 
 # --- CRUD ДЛЯ PROFILE ---
 class ProfileViewSet(RepositoryViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [IsAuthenticated]
+    row_versioned = True
+    collection_versioned = True
 
     def perform_create(self, serializer):
         try:
@@ -106,13 +320,41 @@ class ProfileViewSet(RepositoryViewSet):
             )
 
     def get_object(self):
-        # Профіль прив'язаний до User ID (pk)
-        obj = self.repo.get_by_id(self.kwargs["pk"])
+        # Профіль прив'язаний до User ID (pk); власний - з кешу ідентичності, чужі - з БД
+        pk = self.kwargs["pk"]
+        own = str(pk) == str(self.request.user.id)
+        obj = self.repo.get_own(self.request.user) if own else self.repo.get_by_id(pk)
         if not obj:
             raise Http404
         self.check_object_permissions(self.request, obj)
         return obj
 
+    @action(detail=False, methods=['get'], url_path='nearby')
+    def nearby(self, request):
+        """
+        GET /api/profiles/nearby/?lat=&lon=&radius=5000 - атлети, чиї активності
+        стартували поруч (найближчі першими). Без координат - атлети з того ж
+        міста: ?city=&country=, типово - місто з власного профілю.
+        """
+        params = request.query_params
+        if 'lat' in params or 'lon' in params:
+            lat, lon, radius, limit, after = nearby_query(request)
+            page, next_cursor = self.repo.nearby(lat, lon, radius, limit, after=after, exclude_user_id=request.user.id)
+            results = [dict(self.get_serializer(profile).data, distance_from_query_m=distance) for profile, distance in page]
+            return nearby_response(request, results, next_cursor)
+
+        city, country = params.get('city'), params.get('country')
+        if not city:
+            own = self.repo.get_own(request.user)
+            city, country = (own.city, own.country) if own else (None, None)
+        if not city:
+            raise serializers.ValidationError({"error": "city is required when your profile has no city."})
+        paginator = SameCityPagination()
+        page = paginator.paginate_queryset(
+            self.repo.same_city(city, country, exclude_user_id=request.user.id), request, view=self
+        )
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
     # 💡 Додаємо логіку безпеки для 'update'
     def perform_update(self, serializer):
         profile = self.get_object()
@@ -132,9 +374,91 @@ class ActivityViewSet(RepositoryViewSet):
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
     permission_classes = [IsAuthenticated]
+    row_versioned = True
+    collection_versioned = True
 
-    def perform_create(self, serializer):
-        serializer.save(repository=self.repo, user=self.request.user)
+    def create(self, request, *args, **kwargs):
+        """
+        Ідемпотентне завантаження: повторний запит з тим самим заголовком
+        'Idempotency-Key' (або з тим самим треком) повертає оригінал з кодом 200.
+        """
+        idempotency_key = request.headers.get('Idempotency-Key') or None
+        if idempotency_key and len(idempotency_key) > 64:
+            raise serializers.ValidationError({"error": "Idempotency-Key must be at most 64 characters."})
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        activity, created = self.repo.get_or_add(
+            user=request.user,
+            idempotency_key=idempotency_key,
+            **serializer.validated_data
+        )
+        return Response(
+            self.get_serializer(activity).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    def destroy(self, request, *args, **kwargs):
+        activity = self.get_object()
+        if activity.user_id != request.user.id and not request.user.is_staff:
+            raise PermissionDenied("You can only delete your own activities.")
+        return self.schedule_destroy(activity)
+
+    @action(detail=True, methods=['get'], url_path='estimate')
+    def estimate(self, request, pk=None):
+        """
+        GET /api/activities/<pk>/estimate/ - калорії, MET і відносна інтенсивність
+        з урахуванням профілю власника (перераховується лише після змін вхідних даних).
+        """
+        if not self.repo.get_by_id(pk):
+            raise Http404
+        return Response(ActivityEstimateSerializer(estimation.get_estimate(int(pk))).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='similar')
+    def similar(self, request, pk=None):
+        """
+        GET /api/activities/<pk>/similar/?limit=20&scope=me - активності тим самим
+        маршрутом (групуються при завантаженні треку), найшвидші першими.
+        """
+        if not self.repo.get_by_id(pk):
+            raise Http404
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            raise serializers.ValidationError({"error": "limit must be an integer."})
+        user_id = request.user.id if request.query_params.get('scope') == 'me' else None
+        return Response(routes.similar(int(pk), user_id=user_id, limit=limit), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='nearby')
+    def nearby(self, request):
+        """
+        GET /api/activities/nearby/?lat=&lon=&radius=5000&type=running - активності,
+        що стартували в радіусі (м), найближчі першими; ?cursor= - наступна сторінка.
+        """
+        lat, lon, radius, limit, after = nearby_query(request)
+        activity_type = request.query_params.get('type') or None
+        page, next_cursor = self.repo.nearby(lat, lon, radius, limit, after=after, activity_type=activity_type)
+        results = [dict(self.get_serializer(activity).data, distance_from_query_m=distance) for activity, distance in page]
+        return nearby_response(request, results, next_cursor)
+
+    @action(detail=True, methods=['put', 'delete'], url_path='kudos')
+    def kudos(self, request, pk=None):
+        """
+        PUT /api/activities/<pk>/kudos/ - поставити kudos, DELETE - зняти.
+        Одна інструкція SQL на клік, лічильник kudos_count оновлюється в ній же.
+        """
+        if request.method == 'PUT':
+            kudos_id, kudos_count = self.db.kudos.give(int(pk), request.user.id)
+            created = kudos_id is not None
+        else:
+            deleted, kudos_count = self.db.kudos.take_back(int(pk), request.user.id)
+            created = False
+        if kudos_count is None:
+            raise Http404
+        return Response(
+            {"activity": int(pk), "kudos": request.method == 'PUT', "kudos_count": kudos_count},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
 
 
 # --- CRUD ДЛЯ COMMENT ---
@@ -153,14 +477,16 @@ class KudosViewSet(RepositoryViewSet):
     serializer_class = KudosSerializer
     permission_classes = [IsAuthenticated]
 
-    def perform_create(self, serializer):
-        try:
-            serializer.save(repository=self.repo, user=self.request.user)
-        except IntegrityError:
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        kudos_id, _ = self.repo.give(serializer.validated_data['activity'].id, request.user.id)
+        if kudos_id is None:
             return Response(
                 {"error": "You already gave kudos to this activity."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        return Response(self.get_serializer(self.repo.get_by_id(kudos_id)).data, status=status.HTTP_201_CREATED)
 
 
 # --- CRUD ДЛЯ ACTIVITYPOINT ---
@@ -168,6 +494,8 @@ class ActivityPointViewSet(RepositoryViewSet):
     queryset = ActivityPoint.objects.all()
     serializer_class = ActivityPointSerializer
     permission_classes = [IsAuthenticated]
+    collection_versioned = True
+    throttle_scope = 'activity_points'
 
     def perform_create(self, serializer):
         activity = serializer.validated_data['activity']
@@ -183,29 +511,119 @@ class FollowerViewSet(RepositoryViewSet):
     serializer_class = FollowerSerializer
     permission_classes = [IsAuthenticated]
 
-    def perform_create(self, serializer):
-        if serializer.validated_data['followee'] == self.request.user:
-            return Response(
-                {"error": "You cannot follow yourself."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        try:
-            serializer.save(repository=self.repo, follower=self.request.user)
-        except IntegrityError:
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        followee = serializer.validated_data['followee']
+        if followee == request.user:
+            raise serializers.ValidationError({"error": "You cannot follow yourself."})
+
+        follow_id, _ = self.repo.follow(request.user.id, followee.id)
+        if follow_id is None:
             return Response(
                 {"error": "You are already following this user."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        follow = self.repo.get_by_composite_key(request.user.id, followee.id)
+        return Response(self.get_serializer(follow).data, status=status.HTTP_201_CREATED)
 
     # 💡 Кастомний 'destroy' для композитного ключа
     def perform_destroy(self, instance):
         # 'instance' - це об'єкт Follower
-        if instance.follower != self.request.user:
-            return Response(
-                {"error": "You can only unfollow for yourself."},
-                status=status.HTTP_403_FORBIDDEN
-            )
-        self.repo.delete(follower_id=instance.follower.id, followee_id=instance.followee.id)
+        if instance.follower_id != self.request.user.id:
+            raise PermissionDenied("You can only unfollow for yourself.")
+        self.repo.unfollow(instance.follower_id, instance.followee_id)
+
+
+# --- ЧЕЛЕНДЖІ ---
+class ChallengeViewSet(RepositoryViewSet):
+    queryset = Challenge.objects.all()
+    serializer_class = ChallengeSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        serializer.save(repository=self.repo, created_by=self.request.user)
+
+    def check_owner(self, challenge):
+        if challenge.created_by_id != self.request.user.id and not self.request.user.is_staff:
+            raise PermissionDenied("You can only change challenges you created.")
+
+    def perform_update(self, serializer):
+        self.check_owner(serializer.instance)
+        super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        self.check_owner(instance)
+        super().perform_destroy(instance)
+
+    @action(detail=True, methods=['put', 'delete'], url_path='join')
+    def join(self, request, pk=None):
+        """
+        PUT /api/challenges/<pk>/join/ - приєднатися (активності, вже завантажені
+        у вікні челенджу, зараховуються одразу), DELETE - вийти. Ідемпотентно.
+        """
+        challenge = self.get_object()
+        if request.method == 'DELETE':
+            self.db.challenges.leave(challenge.id, request.user.id)
+            return Response({"challenge": challenge.id, "joined": False}, status=status.HTTP_200_OK)
+        if challenge.ends_at <= timezone.now():
+            raise serializers.ValidationError({"error": "This challenge has already ended."})
+        participant, created = self.db.challenges.join(challenge, request.user.id)
+        return Response(
+            ChallengeParticipantSerializer(participant).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    @action(detail=True, methods=['get'], url_path='standings')
+    def standings(self, request, pk=None):
+        """
+        GET /api/challenges/<pk>/standings/?limit=50&cursor=... - таблиця лідерів
+        (впорядкований скан індексу, сторінки курсором) і місце поточного
+        користувача з останнього знімка (?me=live - точне місце зараз).
+        ?snapshot=<id> - та сама таблиця зі збереженого знімка.
+        """
+        challenge = self.get_object()
+        params = request.query_params
+        try:
+            limit = min(max(int(params.get('limit', 50)), 1), 200)
+        except ValueError:
+            raise serializers.ValidationError({"error": "limit must be an integer."})
+
+        if params.get('snapshot'):
+            snapshot = ChallengeSnapshot.objects.filter(id=params['snapshot'], challenge=challenge).first() \
+                if params['snapshot'].isdigit() else None
+            if snapshot is None:
+                raise Http404
+            try:
+                after_rank = int(params.get('cursor', 0))
+            except ValueError:
+                raise serializers.ValidationError({"error": "Invalid cursor."})
+            results, next_rank = challenges.snapshot_standings(snapshot.id, limit, after_rank)
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_rank) if next_rank else None
+            return Response({"snapshot": ChallengeSnapshotSerializer(snapshot).data, "next": next_url,
+                             "results": results}, status=status.HTTP_200_OK)
+
+        after = None
+        if params.get('cursor'):
+            try:
+                after = challenges.decode_cursor(params['cursor'])
+            except ValueError:
+                raise serializers.ValidationError({"error": "Invalid cursor."})
+        results, next_cursor = challenges.standings(challenge.id, limit, after)
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor) if next_cursor else None
+        return Response({
+            "challenge": self.get_serializer(challenge).data,
+            "me": challenges.participant_rank(challenge.id, request.user.id, live=params.get('me') == 'live'),
+            "next": next_url,
+            "results": results,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='snapshots')
+    def snapshots(self, request, pk=None):
+        """GET /api/challenges/<pk>/snapshots/ - збережені знімки таблиці, новіші першими."""
+        challenge = self.get_object()
+        snapshots = ChallengeSnapshot.objects.filter(challenge=challenge).order_by('-taken_at')[:100]
+        return Response(ChallengeSnapshotSerializer(snapshots, many=True).data, status=status.HTTP_200_OK)
 
 
 # --- READ-ONLY ДЛЯ USERMONTHLYSTATS ---
@@ -217,6 +635,86 @@ class UserMonthlyStatsViewSet(viewsets.ReadOnlyModelViewSet):
     # і не потребує кастомних 'create', 'update'
 
 
+# --- READ-ONLY ДЛЯ DELETIONJOB ---
+class DeletionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Прогрес фонових видалень, запитаних поточним користувачем."""
+    serializer_class = DeletionJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return DeletionJob.objects.filter(requested_by=self.request.user).order_by('-id')
+
+
+# --- СПОВІЩЕННЯ ---
+class NotificationPagination(CursorPagination):
+    """Курсор по (latest_at, id): стабільні сторінки без OFFSET, плюс лічильник непрочитаних."""
+    ordering = ('-latest_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['unread_count'] = notifications.unread_count(self.request.user.id)
+        return response
+
+
+class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    GET /api/notifications/ - згруповані сповіщення поточного користувача (?cursor=).
+    GET /api/notifications/unread-count/, POST /api/notifications/read/ {"ids": [...]}
+    (без ids - позначити прочитаними всі).
+    """
+    serializer_class = NotificationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = NotificationPagination
+
+    def get_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user)
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        return Response({"unread_count": notifications.unread_count(request.user.id)}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='read')
+    def read(self, request):
+        ids = request.data.get('ids')
+        if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+            raise serializers.ValidationError({"error": "ids must be a list of integers."})
+        marked = notifications.mark_read(request.user.id, ids)
+        return Response(
+            {"marked_read": marked, "unread_count": notifications.unread_count(request.user.id)},
+            status=status.HTTP_200_OK
+        )
+
+
+# --- ТОКЕНИ ---
+class AuthViewSet(viewsets.ViewSet):
+    """
+    POST /api/auth/token/ {"username", "password"} - отримати токен.
+    POST /api/auth/logout/ - відкликати токен і завершити сесію
+    (ідентичність одразу зникає з кешу CachedTokenAuthentication).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.db = DataAccessLayer()
+
+    @action(detail=False, methods=['post'], url_path='token', permission_classes=[AllowAny])
+    def token(self, request):
+        serializer = AuthTokenSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        key = self.db.users.issue_token(serializer.validated_data['user'].id)
+        return Response({"token": key}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='logout')
+    def logout(self, request):
+        revoked = self.db.users.logout(request.user.id)
+        session_logout(request._request)
+        return Response({"token_revoked": revoked}, status=status.HTTP_200_OK)
+
+
 # --- Агрегований Звіт (Умова 2) ---
 class GlobalStatsReport(viewsets.ViewSet):
     """
@@ -224,6 +722,9 @@ class GlobalStatsReport(viewsets.ViewSet):
     Він реалізує тільки 'list' (для GET /api/reports/global-stats/).
     """
     permission_classes = [AllowAny]
+    throttle_scope = 'reports'
+    # Сім агрегатів по всіх таблицях - найдорожчий запит API
+    throttle_costs = {'list': 10}
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -247,4 +748,38 @@ class GlobalStatsReport(viewsets.ViewSet):
         if not report_data["activities_overview"] or report_data["activities_overview"].get('total_activities') is None:
             return Response({"error": "No data available to report."}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response(report_data, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(report_data, status=status.HTTP_200_OK)
+
+
+# --- Теплові карти (тайли) ---
+class HeatmapViewSet(viewsets.ViewSet):
+    """
+    GET /api/heatmap/{z}/{x}/{y}.png  - PNG-тайл
+    GET /api/heatmap/{z}/{x}/{y}.json - сира щільність [[px, py, count], ...]
+    ?scope=me - персональна мапа, інакше - глобальна.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'heatmap'
+
+    def tile(self, request, z, x, y, fmt):
+        if fmt not in ('png', 'json'):
+            raise Http404
+        if z not in heatmap.zoom_levels() or not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+            raise Http404
+
+        user_id = request.user.id if request.query_params.get('scope') == 'me' else None
+        density = heatmap.get_tile_density(z, x, y, user_id=user_id)
+
+        if fmt == 'png':
+            response = HttpResponse(heatmap.render_png(density), content_type='image/png')
+            response['Cache-Control'] = 'private, max-age=300'
+            return response
+
+        pixels = []
+        if density is not None:
+            py, px = density.nonzero()
+            pixels = [[int(a), int(b), int(c)] for a, b, c in zip(px, py, density[py, px])]
+        return Response(
+            {"zoom": z, "x": x, "y": y, "tile_size": heatmap.TILE_SIZE, "pixels": pixels},
+            status=status.HTTP_200_OK
+        )
\ No newline at end of file
@@ -13,4 +13,23 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lab_3_with_Django.settings")
 
-application = get_asgi_application()
+# HTTP-додаток створюється першим: він ініціалізує Django до імпорту споживачів
+django_asgi_app = get_asgi_application()
+
+# Live-трекінг по WebSocket доступний, лише коли встановлено пакет channels
+try:
+    from channels.auth import AuthMiddlewareStack
+    from channels.routing import ProtocolTypeRouter, URLRouter
+    from channels.security.websocket import AllowedHostsOriginValidator
+except ImportError:
+    application = django_asgi_app
+else:
+    from activities.consumers import TokenAuthMiddleware
+    from activities.routing import websocket_urlpatterns
+
+    application = ProtocolTypeRouter({
+        "http": django_asgi_app,
+        "websocket": AllowedHostsOriginValidator(
+            TokenAuthMiddleware(AuthMiddlewareStack(URLRouter(websocket_urlpatterns)))
+        ),
+    })
@@ -117,9 +117,97 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        # TokenAuthentication з кешем token -> користувач -> профіль у пам'яті процесу
+        'activities.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
-}
\ No newline at end of file
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'activities.throttling.TokenBucketThrottle',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'activities.renderers.ColumnarJSONRenderer',
+    ],
+}
+
+# MessagePack віддаємо лише тоді, коли пакет msgpack встановлено
+try:
+    import msgpack  # noqa: F401
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('activities.renderers.MessagePackRenderer')
+except ImportError:
+    pass
+
+# Token bucket ліміти на (користувач, throttle_scope ViewSet-а).
+# Лічильники живуть у кеші 'default' - у продакшені це має бути спільний Redis/Memcached.
+# Тести (settings_test.py) беруть InProcessBucketBackend. Обидва числа відра мають бути додатними.
+THROTTLE_BACKEND = 'activities.throttling.CacheBucketBackend'
+THROTTLE_BUCKETS = {
+    'default': {'capacity': 120, 'refill_per_sec': 2.0},
+    'activity_points': {'capacity': 60, 'refill_per_sec': 1.0},
+    'reports': {'capacity': 20, 'refill_per_sec': 0.2},
+    'heatmap': {'capacity': 300, 'refill_per_sec': 10.0},
+}
+# Скільки токенів коштує дія ViewSet-а (list і звіти дорожчі за retrieve)
+THROTTLE_COSTS = {
+    'list': 5,
+    'retrieve': 1,
+    'create': 2,
+    'update': 2,
+    'partial_update': 2,
+    'destroy': 2,
+}
+
+# Зберігання треків (ActivityPoint): повна роздільність N місяців, далі - проріджені треки.
+# DROP_AFTER_MONTHS = None означає, що старі місяці не видаляються.
+ACTIVITY_POINT_RETENTION = {
+    'FULL_RESOLUTION_MONTHS': 6,
+    'KEEP_EVERY_NTH': 5,
+    'DROP_AFTER_MONTHS': None,
+    'PARTITIONS_AHEAD': 3,
+}
+
+# Теплові карти: діапазон рівнів масштабу, для яких будуються тайли
+HEATMAP_MIN_ZOOM = 2
+HEATMAP_MAX_ZOOM = 14
+
+# Швидкий шлях для GET-списків: values_list() + скомпільовані енкодери рядків замість ModelSerializer
+FAST_SERIALIZATION = True
+
+# Рядків на один DELETE у purge_deletions (коротші транзакції й блокування)
+DELETION_BATCH_SIZE = 5000
+
+# Транзакційний outbox для споживачів змін (tail_outbox / compact_outbox)
+OUTBOX_ENABLED = True
+OUTBOX_TOMBSTONE_DAYS = 7
+
+# Непрочитане сповіщення збирає однакові події (kudos, коментарі, підписки) протягом цього часу
+NOTIFICATION_GROUP_WINDOW_HOURS = 24
+
+# run_backfill чекає, поки в PostgreSQL активних запитів не більше цього (0 - без перевірки)
+BACKFILL_MAX_ACTIVE_QUERIES = 20
+
+# "Той самий маршрут": найбільша дискретна відстань Фреше між треками, м
+ROUTE_MATCH_MAX_DEVIATION_M = 150
+
+# Скільки живе кешована ідентичність (токен, користувач, профіль) у процесі.
+# Інвалідації інших воркерів видно одразу через покоління в кеші Django -
+# для кількох воркерів потрібен спільний бекенд кешу (Redis/Memcached)
+IDENTITY_CACHE_TTL_SEC = 30
+IDENTITY_CACHE_MAX_ENTRIES = 10000
+
+# Live-трекінг (WebSocket, потрібен пакет channels)
+ASGI_APPLICATION = 'lab_3_with_Django.asgi.application'
+# In-memory шар працює в межах одного процесу (розробка, тести);
+# кілька воркерів ASGI потребують channels_redis.layers.RedisChannelLayer
+CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+}
+# Кільцевий буфер останніх точок для нових глядачів і частота пакетного збереження
+LIVE_BUFFER_SIZE = 600
+LIVE_FLUSH_INTERVAL_SEC = 5
+LIVE_FLUSH_BATCH = 60
+# Розрив з'єднання публікатора фіналізує активність, лише якщо він не повернувся за цей час
+LIVE_IDLE_TIMEOUT_SEC = 300
@@ -0,0 +1,17 @@
+"""
+Налаштування для тестів: SQLite замість PostgreSQL, щоб тести не вимагали сервера БД.
+python manage.py test --settings=lab_3_with_Django.settings_test
+"""
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+# У activities немає файлів міграцій - тестова БД будується прямо з моделей
+MIGRATION_MODULES = {'activities': None}
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+# Ліміти запитів - у пам'яті процесу; тести скидають їх у setUp
+THROTTLE_BACKEND = 'activities.throttling.InProcessBucketBackend'